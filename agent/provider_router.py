@@ -0,0 +1,281 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from utils.genai_pool import resolve_api_key
+from utils.models import VisionAnalysis
+from utils.metrics import metrics
+
+# Preference order for provider=auto; providers without credentials are skipped
+VISION_PROVIDER_ORDER = [name.strip() for name in os.getenv("VISION_PROVIDER_ORDER", "gemini,hf").split(",")
+                         if name.strip()]
+# Outcomes remembered per provider for its latency / error profile
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "50"))
+# Successful calls needed before the provider's own p95 replaces ROUTER_HEDGE_DELAY
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "5"))
+# Seconds to wait for the primary before hedging, until its p95 is known
+ROUTER_HEDGE_DELAY = float(os.getenv("ROUTER_HEDGE_DELAY", "8"))
+# A provider is routed around after this many failures in a row, or this error rate over the window...
+ROUTER_TRIP_FAILURES = int(os.getenv("ROUTER_TRIP_FAILURES", "3"))
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))
+# ...and gets one trial call again after this many seconds
+ROUTER_COOLDOWN = float(os.getenv("ROUTER_COOLDOWN", "30"))
+ROUTER_MAX_WORKERS = int(os.getenv("ROUTER_MAX_WORKERS", "16"))
+
+PROVIDER_CALLS = metrics.counter(
+    "provider_calls_total", "Vision provider calls by outcome (ok, error, abandoned)", ["provider", "outcome"])
+PROVIDER_ANSWERS = metrics.counter(
+    "provider_answers_total", "Requests answered per provider, and whether a hedge was sent", ["provider", "hedged"])
+
+
+class NoProviderAvailableError(Exception):
+    """
+    Raised when no configured provider can take the request (e.g. no API keys).
+    """
+
+
+class Provider:
+    """
+    A vision backend: `call(image, api_key)` returns its answer, and
+    `available(api_key)` says whether it is configured for this request.
+    `uses_request_key` marks a backend that calls with the caller's own key
+    when one is given (Gemini); the others always use server credentials.
+    """
+    __slots__ = ("name", "call", "available", "uses_request_key")
+
+    def __init__(self, name, call, available=None, uses_request_key=False):
+        self.name = name
+        self.call = call
+        self.available = available or (lambda api_key: True)
+        self.uses_request_key = uses_request_key
+
+
+class ProviderProfile:
+    """
+    Rolling record of one provider's last `window` outcomes: latency p95 of the
+    successes, error rate, and a trip switch. After `trip_failures` failures in
+    a row (or `max_error_rate` over at least `min_samples` calls) the provider
+    is skipped for `cooldown` seconds, then gets one trial call; a success
+    closes the switch again.
+    """
+
+    def __init__(self, name, window=ROUTER_WINDOW, min_samples=ROUTER_MIN_SAMPLES,
+                 trip_failures=ROUTER_TRIP_FAILURES, max_error_rate=ROUTER_MAX_ERROR_RATE,
+                 cooldown=ROUTER_COOLDOWN, clock=time.monotonic):
+        self.name = name
+        self.min_samples = min_samples
+        self.trip_failures = trip_failures
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.clock = clock
+        self._outcomes = deque(maxlen=window)
+        self._latencies = deque(maxlen=window)
+        self._consecutive_failures = 0
+        self._tripped_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok):
+        with self._lock:
+            self._outcomes.append(ok)
+            if ok:
+                self._latencies.append(latency)
+                self._consecutive_failures = 0
+                self._tripped_until = 0.0
+                return
+            self._consecutive_failures += 1
+            failures = self._outcomes.count(False)
+            if self._consecutive_failures >= self.trip_failures or (
+                    len(self._outcomes) >= self.min_samples and failures / len(self._outcomes) >= self.max_error_rate):
+                self._tripped_until = self.clock() + self.cooldown
+
+    def healthy(self):
+        return self.clock() >= self._tripped_until
+
+    def p95(self):
+        """
+        95th percentile latency of recent successes, or None until min_samples are in.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def error_rate(self):
+        with self._lock:
+            outcomes = list(self._outcomes)
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def get_stats(self):
+        p95 = self.p95()
+        return {"p95_ms": round(p95 * 1000, 1) if p95 is not None else 0.0, "error_rate": round(self.error_rate(), 3),
+                "healthy": self.healthy(), "samples": len(self._outcomes)}
+
+
+class ProviderRouter:
+    """
+    Sends each request to the first healthy provider in preference order. If
+    it has not answered by its own p95 latency, the same request is hedged to
+    the next healthy provider and whichever valid answer arrives first wins.
+    A provider that fails (raises, or returns something `is_valid` rejects)
+    is failed over to the next one immediately.
+
+    A request carrying its own API key only goes to providers that use it,
+    so it is never hedged or failed over onto server credentials. Its
+    failures are not recorded in the shared profiles either: a bad or
+    exhausted user key says nothing about the provider, and must not trip it
+    for everyone else.
+
+    The losing call is cancelled if it has not started; a call already in
+    flight cannot be interrupted, so it is abandoned and its eventual
+    outcome still feeds its provider's profile.
+
+    `clock` and `executor` are injectable so the router can be driven by
+    local fake providers.
+    """
+
+    def __init__(self, providers, is_valid=bool, hedge_delay=ROUTER_HEDGE_DELAY, clock=time.monotonic,
+                 executor=None, **profile_options):
+        self.providers = list(providers)
+        self.is_valid = is_valid
+        self.hedge_delay = hedge_delay
+        self.clock = clock
+        self.executor = executor or ThreadPoolExecutor(max_workers=ROUTER_MAX_WORKERS,
+                                                       thread_name_prefix="provider-router")
+        self.profiles = {p.name: ProviderProfile(p.name, clock=clock, **profile_options) for p in self.providers}
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "failovers": 0, "failed": 0}
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def candidates(self, api_key=None):
+        """
+        Configured providers for this request, healthy ones first (each group in preference order).
+        With a caller's API key, only the providers that call with that key.
+        """
+        configured = [p for p in self.providers if p.available(api_key) and (p.uses_request_key or not api_key)]
+        healthy = [p for p in configured if self.profiles[p.name].healthy()]
+        return healthy + [p for p in configured if p not in healthy]
+
+    def _delay_for(self, provider):
+        p95 = self.profiles[provider.name].p95()
+        return p95 if p95 is not None else self.hedge_delay
+
+    def _start(self, provider, image, api_key):
+        profile = self.profiles[provider.name]
+        user_key = bool(api_key) and provider.uses_request_key
+        start = self.clock()
+
+        def run():
+            try:
+                answer = provider.call(image, api_key)
+            except Exception as e:
+                print(f"⚠️ ROUTER: {provider.name} raised {type(e).__name__}: {e}")
+                answer = None
+            ok = self.is_valid(answer)
+            if ok or not user_key:
+                profile.record(self.clock() - start, ok)
+            PROVIDER_CALLS.inc(provider=provider.name, outcome="ok" if ok else "error")
+            return answer
+
+        return self.executor.submit(run)
+
+    def route(self, image, api_key=None):
+        """
+        Returns (answer, provider name). When every provider fails, the last
+        invalid answer is returned (e.g. a rate-limit payload) with the name
+        of the provider that gave it; raises NoProviderAvailableError if none
+        is configured.
+        """
+        queue = self.candidates(api_key)
+        if not queue:
+            raise NoProviderAvailableError("No vision provider is configured for this request.")
+        self._count("requests")
+
+        running = {}  # future -> provider
+        last = (None, queue[0].name)
+        hedged = False
+
+        def launch():
+            provider = queue.pop(0)
+            running[self._start(provider, image, api_key)] = provider
+            return provider
+
+        primary = launch()
+        deadline = self.clock() + self._delay_for(primary)
+        while running:
+            # Until the hedge fires, only wait for the primary's p95; afterwards wait for any answer
+            timeout = max(0.0, deadline - self.clock()) if queue and not hedged else None
+            done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                secondary = launch()
+                self._count("hedged")
+                print(f"🔀 ROUTER: {primary.name} past its p95 ({self._delay_for(primary):.1f}s), "
+                      f"hedging to {secondary.name}")
+                continue
+            for future in done:
+                provider = running.pop(future)
+                answer = future.result()
+                if self.is_valid(answer):
+                    self._abandon(running)
+                    if hedged and provider is not primary:
+                        self._count("hedge_wins")
+                    PROVIDER_ANSWERS.inc(provider=provider.name, hedged=str(hedged).lower())
+                    return answer, provider.name
+                last = (answer, provider.name)
+            if not running and queue:
+                # Every call in flight failed: fail over to the next provider straight away
+                self._count("failovers")
+                print(f"🔀 ROUTER: {last[1]} failed, failing over to {queue[0].name}")
+                primary = launch()
+                deadline = self.clock() + self._delay_for(primary)
+        self._count("failed")
+        return last
+
+    def _abandon(self, running):
+        for future, provider in running.items():
+            if not future.cancel():
+                PROVIDER_CALLS.inc(provider=provider.name, outcome="abandoned")
+        running.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        for name, profile in self.profiles.items():
+            for stat, value in profile.get_stats().items():
+                stats[f"{name}_{stat}"] = value
+        return stats
+
+
+def _gemini_configured(api_key):
+    try:
+        resolve_api_key(api_key)
+    except ValueError:
+        return False
+    return True
+
+
+def _analyze_gemini(image, api_key):
+    from agent.vision_reader import analyze_image
+    return analyze_image(image, api_key_override=api_key)
+
+
+def _analyze_hf(image, api_key):
+    from agent.vision_reader import analyze_image_hf
+    return analyze_image_hf(image)
+
+
+VISION_PROVIDERS = {
+    "gemini": Provider("gemini", _analyze_gemini, _gemini_configured, uses_request_key=True),
+    "hf": Provider("hf", _analyze_hf, lambda api_key: bool(os.getenv("HF_TOKEN"))),
+}
+
+# Shared by every provider=auto request, so the latency / error profiles are process-wide
+vision_router = ProviderRouter([VISION_PROVIDERS[name] for name in VISION_PROVIDER_ORDER if name in VISION_PROVIDERS],
+                               is_valid=lambda answer: isinstance(answer, VisionAnalysis))
+metrics.add_collector("vision_router", vision_router.get_stats)
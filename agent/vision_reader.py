@@ -1,35 +1,19 @@
 import google.generativeai as genai
 import os
-import json
+import base64
 import typing_extensions as typing
+from utils.result_cache import analysis_cache, hash_bytes, prompt_version, make_key
+from utils.image_preprocess import prepare_image, read_image_source, IMAGE_MAX_EDGE
+from utils.genai_pool import key_fingerprint
+from utils.gemini_scheduler import generate_content, stream_content, SchedulerDeadlineError
+from utils.single_flight import model_calls
+from utils.classifier import CLASSIFICATION_TASKS, CLASSIFICATION_SCHEMA
+from utils.models import VisionAnalysis, VisionItem, Classification, ModelDecodeError, decode_json, decode_vision
+from utils.json_stream import ArrayItemStream
+from utils.metrics import record_fallback, record_tokens, stage_timer
+from utils.http_pool import configure_huggingface, HTTP_READ_TIMEOUT
 
-# Initialize Model - will be deferred or checked in functions
-model = None
-
-def get_model(api_key_override=None):
-    global model
-    api_key = api_key_override or os.getenv("GOOGLE_API_KEY")
-    
-    # If not in env, try reloading .env just in case we are in a sub-process
-    if not api_key:
-        from dotenv import load_dotenv
-        load_dotenv()
-        api_key = os.getenv("GOOGLE_API_KEY")
-
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEY is missing. Use 'X-Gemini-API-Key' header to provide one.")
-
-    # Re-configure ensures the key sticks in every request thread
-    genai.configure(api_key=api_key)
-    
-    # If a custom key is provided, we return a fresh model instance to ensure it uses that key
-    if api_key_override:
-        return genai.GenerativeModel("models/gemini-flash-latest")
-        
-    if model is None:
-        model = genai.GenerativeModel("models/gemini-flash-latest")
-    
-    return model
+VISION_MODEL_NAME = "models/gemini-flash-latest"
 
 SYSTEM_PROMPT = """
 You are a cost-estimation vision agent for interior designs.
@@ -75,49 +59,49 @@ JSON schema:
 }
 """
 
-def analyze_image(image_path, api_key_override=None):
+# Changes whenever either prompt (or the upload resolution) changes, so stale cached analyses are never served
+PROMPT_VERSION = prompt_version(SYSTEM_PROMPT, USER_PROMPT_TEMPLATE, str(IMAGE_MAX_EDGE))
+
+# Fused mode: one call returns the extraction above plus the classifier's output,
+# instead of a second round trip that re-sends the whole analysis as text
+FUSED_PROMPT_TEMPLATE = f"""
+Then, based on what you extracted, classify the project into:
+{CLASSIFICATION_TASKS}
+Return ONE JSON object with exactly two keys:
+
+{{
+  "vision_analysis": <the JSON schema above>,
+  "business_classification":
+{CLASSIFICATION_SCHEMA}
+}}
+"""
+
+FUSED_PROMPT_VERSION = prompt_version(SYSTEM_PROMPT, USER_PROMPT_TEMPLATE, FUSED_PROMPT_TEMPLATE, str(IMAGE_MAX_EDGE))
+
+def analyze_image(image, api_key_override=None):
     """
-    Sends the image to Gemini Vision to extract structured data.
+    Sends the image (a file path, or bytes / memoryview of the upload) to
+    Gemini Vision to extract structured data.
+    Results are cached by image content, model and prompt version, and
+    concurrent requests for the same image share one Gemini call.
+    Returns a VisionAnalysis, an {"error": ...} dict for rate limits, or None.
     """
     try:
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"Image not found at {image_path}")
+        image_data, label = read_image_source(image)
 
-        # specific mime type detection could be added, defaulting to png/jpeg logic handled by genai usually
-        # but helper wants data.
-        
-        with open(image_path, "rb") as f:
-            image_data = f.read()
-
-        # Simple mime type guess based on extension
-        mime_type = "image/jpeg"
-        if image_path.lower().endswith(".png"):
-            mime_type = "image/png"
-            
-        generation_config = genai.GenerationConfig(
-            response_mime_type="application/json"
-        )
-
-        response = get_model(api_key_override).generate_content(
-            [
-                SYSTEM_PROMPT,
-                USER_PROMPT_TEMPLATE,
-                {"mime_type": mime_type, "data": image_data}
-            ],
-            generation_config=generation_config
-        )
-        
-        # Clean up response text if necessary
-        try:
-            text = response.text.strip()
-            if text.startswith("```json"):
-                text = text[7:-3].strip()
-            return json.loads(text)
-        except ValueError as ve:
-             # This happens if Gemini returns an error message instead of JSON (like 429)
-             print(f"Gemini API Error: {response.candidates[0].safety_ratings}")
-             return {"error": "API_LIMIT_REACHED", "message": "Gemini rate limit exceeded. Please wait 60s."}
+        cache_key = make_key(hash_bytes(image_data), VISION_MODEL_NAME, PROMPT_VERSION)
+        cached = analysis_cache.get(cache_key)
+        if cached is not None:
+            print(f"⚡ CACHE HIT: Reusing analysis for {label}")
+            return VisionAnalysis.from_dict(cached)
+
+        # A double-click or client retry joins the call already in flight instead of paying for another
+        return model_calls.do(("vision", cache_key, key_fingerprint(api_key_override)),
+                              lambda: _analyze_uncached(image_data, label, cache_key, api_key_override))
 
+    except SchedulerDeadlineError as e:
+        print(f"Vision request shed: {e}")
+        return {"error": "RATE_LIMIT", "message": "Gemini is at its rate limit. Try again in 1 minute."}
     except Exception as e:
         error_msg = str(e)
         if "429" in error_msg:
@@ -125,51 +109,238 @@ def analyze_image(image_path, api_key_override=None):
         print(f"Error in Vision Agent (Gemini): {e}")
         return None
 
-def analyze_image_hf(image_path, model_id="Qwen/Qwen2-VL-7B-Instruct"):
+def _analyze_uncached(image_data, label, cache_key, api_key_override=None):
+    # Orientation fix, downscale and re-encode; mime type comes from the magic bytes
+    prepared = prepare_image(image_data)
+    prepared.report(label)
+
+    generation_config = genai.GenerationConfig(
+        response_mime_type="application/json"
+    )
+
+    # Throttled per key/model; 429s are retried (honouring Retry-After) before we give up
+    response = generate_content(
+        VISION_MODEL_NAME,
+        [
+            SYSTEM_PROMPT,
+            USER_PROMPT_TEMPLATE,
+            prepared.as_part()
+        ],
+        api_key_override=api_key_override,
+        label="vision",
+        generation_config=generation_config
+    )
+    
+    try:
+        text = response.text
+    except ValueError:
+         # This happens if Gemini returns an error message instead of JSON (like 429)
+         print(f"Gemini API Error: {response.candidates[0].safety_ratings}")
+         return {"error": "API_LIMIT_REACHED", "message": "Gemini rate limit exceeded. Please wait 60s."}
+
+    try:
+        data = decode_json(text)
+        analysis = VisionAnalysis.from_dict(data, require_items=True)
+    except ModelDecodeError as e:
+        # Malformed extraction: fail the stage here rather than deep inside pricing
+        print(f"⚠️ VISION: Unusable model output: {e}")
+        return None
+    # The decoded answer is cached as-is; from_dict on a hit normalizes it the same way
+    analysis_cache.set(cache_key, data)
+    return analysis
+
+def stream_analysis(image, api_key_override=None):
+    """
+    Streaming variant of analyze_image. Yields ("item", VisionItem) for each
+    extracted item as soon as the model has finished writing it, then
+    ("analysis", VisionAnalysis) once the whole answer is in and validated.
+
+    Shares analyze_image's cache (a hit replays the cached items at once), but
+    not its single-flight: a stream cannot be joined halfway. Raises
+    ModelDecodeError if the complete answer is malformed, and the scheduler's
+    errors (SchedulerDeadlineError, 429s after retries) as-is.
+    """
+    image_data, label = read_image_source(image)
+
+    cache_key = make_key(hash_bytes(image_data), VISION_MODEL_NAME, PROMPT_VERSION)
+    cached = analysis_cache.get(cache_key)
+    if cached is not None:
+        print(f"⚡ CACHE HIT: Reusing analysis for {label}")
+        analysis = VisionAnalysis.from_dict(cached)
+        for item in analysis.items:
+            yield "item", item
+        yield "analysis", analysis
+        return
+
+    prepared = prepare_image(image_data)
+    prepared.report(label)
+
+    generation_config = genai.GenerationConfig(
+        response_mime_type="application/json"
+    )
+
+    parser = ArrayItemStream("items")
+    for chunk in stream_content(
+        VISION_MODEL_NAME,
+        [
+            SYSTEM_PROMPT,
+            USER_PROMPT_TEMPLATE,
+            prepared.as_part()
+        ],
+        api_key_override=api_key_override,
+        label="vision_stream",
+        generation_config=generation_config
+    ):
+        for data in parser.feed(chunk):
+            item = VisionItem.from_dict(data)
+            if item is not None:
+                yield "item", item
+
+    data = decode_json(parser.text)
+    analysis = VisionAnalysis.from_dict(data, require_items=True)
+    analysis_cache.set(cache_key, data)
+    yield "analysis", analysis
+
+def analyze_and_classify(image, api_key_override=None):
+    """
+    Fused variant of analyze_image + classify_project: a single Gemini call
+    returns both, split back into (vision_data, classification).
+
+    vision_data is what analyze_image would return (a VisionAnalysis, or its
+    error dicts / None). classification is the dict classify_project would
+    return, or None when the model's part is missing or malformed, in which
+    case the caller should classify separately.
+    """
+    try:
+        image_data, label = read_image_source(image)
+
+        cache_key = make_key(hash_bytes(image_data), VISION_MODEL_NAME, FUSED_PROMPT_VERSION)
+        cached = analysis_cache.get(cache_key)
+        if cached is not None:
+            print(f"⚡ CACHE HIT: Reusing fused analysis for {label}")
+            return VisionAnalysis.from_dict(cached["vision_analysis"]), cached["business_classification"]
+
+        result = model_calls.do(("fused", cache_key, key_fingerprint(api_key_override)),
+                                lambda: _analyze_fused_uncached(image_data, label, cache_key, api_key_override))
+        if isinstance(result, tuple):
+            return result
+        # Error payload from the model call; same shape analyze_image returns
+        return result, None
+
+    except SchedulerDeadlineError as e:
+        print(f"Vision request shed: {e}")
+        return {"error": "RATE_LIMIT", "message": "Gemini is at its rate limit. Try again in 1 minute."}, None
+    except Exception as e:
+        if "429" in str(e):
+            return {"error": "RATE_LIMIT", "message": "Gemini Free Tier limit reached. Try again in 1 minute."}, None
+        print(f"Error in Vision Agent (Gemini, fused): {e}")
+        return None, None
+
+def _analyze_fused_uncached(image_data, label, cache_key, api_key_override=None):
+    prepared = prepare_image(image_data)
+    prepared.report(label)
+
+    generation_config = genai.GenerationConfig(
+        response_mime_type="application/json"
+    )
+
+    response = generate_content(
+        VISION_MODEL_NAME,
+        [
+            SYSTEM_PROMPT,
+            USER_PROMPT_TEMPLATE,
+            FUSED_PROMPT_TEMPLATE,
+            prepared.as_part()
+        ],
+        api_key_override=api_key_override,
+        label="vision+classify",
+        # Room for the classification on top of the extraction
+        output_tokens=2048,
+        generation_config=generation_config
+    )
+
+    try:
+        result = decode_json(response.text)
+    except ModelDecodeError as e:
+        print(f"⚠️ FUSED: Unusable model output: {e}")
+        return None
+    except ValueError:
+        print(f"Gemini API Error: {response.candidates[0].safety_ratings}")
+        return {"error": "API_LIMIT_REACHED", "message": "Gemini rate limit exceeded. Please wait 60s."}
+
+    vision_data = result.get("vision_analysis") if isinstance(result, dict) else None
+    try:
+        vision = VisionAnalysis.from_dict(vision_data, require_items=True)
+    except ModelDecodeError:
+        print("⚠️ FUSED: Response did not contain a usable vision_analysis")
+        return None
+
+    try:
+        classification = Classification.from_dict(result.get("business_classification")).to_dict()
+    except ModelDecodeError:
+        # Only complete answers are cached; a missing classification is re-asked next time
+        print("⚠️ FUSED: Classification part missing or malformed, falling back to a separate call")
+        record_fallback("fused_classification")
+        return vision, None
+    analysis_cache.set(cache_key, {"vision_analysis": vision_data, "business_classification": classification})
+    return vision, classification
+
+# token -> InferenceClient; the clients themselves share huggingface_hub's pooled session
+_hf_clients = {}
+
+def get_hf_client(token):
+    """
+    Returns the InferenceClient for `token`, created once per token.
+    """
+    client = _hf_clients.get(token)
+    if client is None:
+        from huggingface_hub import InferenceClient
+        configure_huggingface()
+        client = _hf_clients.setdefault(token, InferenceClient(api_key=token, timeout=HTTP_READ_TIMEOUT))
+    return client
+
+def analyze_image_hf(image, model_id="Qwen/Qwen2-VL-7B-Instruct"):
     """
     Uses Hugging Face Inference API for vision extraction.
+    `image` is a file path, or bytes / memoryview of the upload.
     default model: meta-llama/Llama-3.2-11B-Vision-Instruct (or Qwen/Qwen2-VL-72B-Instruct if available)
     """
     try:
-        from huggingface_hub import InferenceClient
-        
         if not os.getenv("HF_TOKEN"):
              print("Error: HF_TOKEN not found in .env")
              return None
              
-        client = InferenceClient(api_key=os.getenv("HF_TOKEN"))
+        client = get_hf_client(os.getenv("HF_TOKEN"))
         
-        with open(image_path, "rb") as f:
-            image_data = f.read()
+        image_data, label = read_image_source(image)
+        prepared = prepare_image(image_data)
+        prepared.report(label)
+        image_url = f"data:{prepared.mime_type};base64,{base64.b64encode(prepared.data).decode('utf-8')}"
 
         # Update prompt for HF models (they might need simpler prompting or chat format)
         messages = [
             {
                 "role": "user",
                 "content": [
-                    {"type": "image"},
+                    {"type": "image_url", "image_url": {"url": image_url}},
                     {"type": "text", "text": USER_PROMPT_TEMPLATE}
                 ]
             }
         ]
         
         # For Llama 3.2 Vision or similar
-        response = client.chat_completion(
-            model=model_id,
-            messages=messages,
-            max_tokens=1000
-        )
-        
-        text = response.choices[0].message.content
+        with stage_timer("vision_hf"):
+            response = client.chat_completion(
+                model=model_id,
+                messages=messages,
+                max_tokens=1000
+            )
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            record_tokens(model_id, getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0))
         
-        # Clean up code blocks
-        text = text.strip()
-        if text.startswith("```json"):
-            text = text[7:-3].strip()
-        elif text.startswith("```"):
-            text = text[3:-3].strip()
-            
-        return json.loads(text)
+        # Chat models tend to wrap the JSON in a code fence; decode_vision strips it
+        return decode_vision(response.choices[0].message.content)
         
     except Exception as e:
         print(f"Error in Vision Agent (HF): {e}")
@@ -1,19 +1,27 @@
 import os
-import shutil
 import json
-from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Header, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Header, Response, Request
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 from typing import Optional
-from utils.supabase_handler import save_analysis
 
 # Load env variables AT THE TOP
 load_dotenv()
 
-from agent.vision_reader import analyze_image
-from utils.pricing_utils import calculate_estimate
-from main import load_catalog
 from utils.classifier import classify_project
+from utils.analysis_pipeline import run_analysis, stream_estimate
+from utils.pipeline import PipelineError
+from utils.catalog_store import catalog_store, UnknownRegionError
+from utils.batch_estimator import compare_regions
+from utils.history import get_history_page, get_history_item, history_cache, InvalidCursorError
+from utils.auth import AuthenticationError, auth_enabled, verified_user_id, request_user_id
+from utils.metrics import metrics, stage_timer, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from utils.models import dump
+from utils.batch_analysis import (
+    BatchRun, BatchResponse, analyze_batch_item, iter_multipart_files, iter_zip_files, BATCH_MAX_FILE_MB
+)
 
 app = FastAPI(
     title="Interior Estimator & Classifier API", 
@@ -49,6 +57,28 @@ def health_check():
         "environment": "vercel" if os.getenv("VERCEL") else "local"
     }
 
+@app.get("/api/v1/metrics", include_in_schema=False)
+def metrics_endpoint():
+    """
+    Stage latencies, token usage, fallbacks and cache stats in Prometheus text format.
+    """
+    return Response(content=metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/api/v1/cache-stats")
+def cache_stats():
+    """
+    Hit/miss counters for the vision analysis cache and model client pool, plus persistence queue depth.
+    """
+    from utils.result_cache import analysis_cache, classification_cache
+    from utils.genai_pool import model_pool
+    from utils.persistence_queue import persistence_queue
+    from utils.gemini_scheduler import gemini_scheduler
+    from utils.single_flight import model_calls
+    return {"analysis_cache": analysis_cache.get_stats(), "classification_cache": classification_cache.get_stats(),
+            "model_pool": model_pool.get_stats(),
+            "gemini_scheduler": gemini_scheduler.get_stats(), "single_flight": model_calls.get_stats(),
+            "persistence": persistence_queue.get_stats(), "history_cache": history_cache.get_stats()}
+
 @app.get("/", include_in_schema=False)
 def read_root():
     return {
@@ -84,47 +114,77 @@ def estimate_get_info():
 @app.post("/api/v1/estimate")
 @app.post("/estimate", include_in_schema=False)
 async def estimate_design_cost(
-    background_tasks: BackgroundTasks,
-    provider: str = "gemini", 
+    response: Response,
+    provider: Optional[str] = None,
+    region: Optional[str] = None,
+    city_tier: Optional[str] = None,
     file: UploadFile = File(...),
-    x_gemini_api_key: Optional[str] = Header(None)
+    x_gemini_api_key: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
 ):
     """
     Step 1 & 2: Upload an image to extract vision data and calculate costs.
+    Pass 'region' (and optionally 'city_tier') to price for a specific market.
     If you are hitting rate limits, provide your own key in the 'X-Gemini-API-Key' header.
     """
-    temp_file_path = os.path.join(TEMP_DIR, file.filename)
-    
     try:
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        vision_data = None
-        # Pass the custom key if provided
-        if provider == "hf":
-             from agent.vision_reader import analyze_image_hf
-             vision_data = analyze_image_hf(temp_file_path)
-        else:
-            vision_data = analyze_image(temp_file_path, api_key_override=x_gemini_api_key)
-        
-        if not vision_data:
-            raise HTTPException(status_code=400, detail="Vision extraction failed.")
-            
-        catalog = load_catalog()
-        estimates = calculate_estimate(vision_data, catalog)
-        
-        # Save to Supabase in background
-        background_tasks.add_task(save_analysis, vision_data, estimates)
-        
+        # Analysed straight from memory: no per-request temp file to collide or leak
+        with stage_timer("upload"):
+            image = await file.read()
+
+        # Pass the custom key if provided; persistence runs in the background
+        result = await run_in_threadpool(
+            run_analysis, image, provider, x_gemini_api_key, classify=False,
+            region=region, city_tier=city_tier, user_id=request_user_id(authorization)
+        )
+        response.headers["Server-Timing"] = result.server_timing()
+
         return {
-            "vision_analysis": vision_data,
-            "cost_estimates": estimates
+            "vision_analysis": dump(result["vision"]),
+            "cost_estimates": dump(result["estimate"])
         }
-        
+
+    except UnknownRegionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PipelineError as e:
+        if e.stage == "vision":
+            raise HTTPException(status_code=400, detail="Vision extraction failed.")
+        raise HTTPException(status_code=500, detail=str(e.error))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if os.path.exists(temp_file_path): os.remove(temp_file_path)
+
+@app.post("/api/v1/estimate/stream")
+async def estimate_design_cost_stream(
+    region: Optional[str] = None,
+    city_tier: Optional[str] = None,
+    file: UploadFile = File(...),
+    x_gemini_api_key: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
+):
+    """
+    Streaming /estimate (Gemini only): NDJSON with one line per item as the model
+    extracts it, carrying its unit prices and the running tier totals, then a
+    final "done" line with the same vision_analysis / cost_estimates as /estimate.
+    """
+    try:
+        catalog_store.get().columns_for(region, city_tier)
+    except UnknownRegionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    with stage_timer("upload"):
+        image = await file.read()
+    user_id = request_user_id(authorization)
+
+    def lines():
+        # Runs in the threadpool; each line is flushed as soon as its item is priced
+        try:
+            for event in stream_estimate(image, x_gemini_api_key, region, city_tier, user_id):
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            print(f"Error in streamed estimate: {e}")
+            yield json.dumps({"event": "error", "error": str(e)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 @app.get("/api/v1/classify", include_in_schema=False)
 @app.get("/classify", include_in_schema=False)
@@ -147,7 +207,20 @@ async def classify_results(
     """
     vision_analysis = data.get("vision_analysis", data)
     classification = classify_project(vision_analysis, api_key_override=x_gemini_api_key)
-    return classification
+    return dump(classification)
+
+@app.post("/api/v1/region-comparison")
+async def region_comparison(data: dict = Body(...)):
+    """
+    Prices a vision_analysis for every configured region in one pass.
+    Body: {"vision_analysis": {...}, "city_tier": "tier_1" (optional)}
+    """
+    vision_analysis = data.get("vision_analysis", data)
+    try:
+        comparison = compare_regions(vision_analysis, catalog_store.get(), data.get("city_tier"))
+    except UnknownRegionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"city_tier": data.get("city_tier"), "regions": comparison}
 
 @app.get("/api/v1/full-analysis", include_in_schema=False)
 @app.get("/full-analysis", include_in_schema=False)
@@ -162,47 +235,120 @@ def full_analysis_get_info():
 @app.post("/api/v1/full-analysis")
 @app.post("/full-analysis", include_in_schema=False)
 async def full_analysis(
-    background_tasks: BackgroundTasks,
-    provider: str = "gemini", 
+    response: Response,
+    provider: Optional[str] = None,
+    region: Optional[str] = None,
+    city_tier: Optional[str] = None,
+    fused: Optional[bool] = None,
     file: UploadFile = File(...),
-    x_gemini_api_key: Optional[str] = Header(None)
+    x_gemini_api_key: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
 ):
     """
     Complete Flow: Image Upload -> Extraction -> Pricing -> Classification.
     Returns a unified response object.
     Use 'X-Gemini-API-Key' header to bypass server rate limits.
+    'fused' forces (true) or disables (false) single-call extraction + classification.
     """
-    temp_file_path = os.path.join(TEMP_DIR, file.filename)
-    
     try:
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        vision_data = analyze_image(temp_file_path, api_key_override=x_gemini_api_key) if provider == "gemini" else None
-        if provider == "hf":
-            from agent.vision_reader import analyze_image_hf
-            vision_data = analyze_image_hf(temp_file_path)
-
-        if not vision_data:
-            raise HTTPException(status_code=400, detail="Analysis failed.")
+        with stage_timer("upload"):
+            image = await file.read()
 
-        catalog = load_catalog()
-        estimates = calculate_estimate(vision_data, catalog)
-        classification = classify_project(vision_data, api_key_override=x_gemini_api_key)
-
-        # Save to Supabase in background
-        background_tasks.add_task(save_analysis, vision_data, estimates, classification)
+        # Classification overlaps with pricing; persistence runs in the background
+        result = await run_in_threadpool(
+            run_analysis, image, provider, x_gemini_api_key, region=region, city_tier=city_tier,
+            user_id=request_user_id(authorization), fused=fused
+        )
+        response.headers["Server-Timing"] = result.server_timing()
 
         return {
-            "vision_analysis": vision_data,
-            "cost_estimates": estimates,
-            "business_classification": classification
+            "vision_analysis": dump(result["vision"]),
+            "cost_estimates": dump(result["estimate"]),
+            "business_classification": dump(result["classify"])
         }
-        
+
+    except UnknownRegionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PipelineError as e:
+        if e.stage == "vision":
+            raise HTTPException(status_code=400, detail="Analysis failed.")
+        raise HTTPException(status_code=500, detail=str(e.error))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/v1/history")
+def history(limit: Optional[int] = None, cursor: Optional[str] = None,
+            authorization: Optional[str] = Header(None)):
+    """
+    One page of the signed-in user's past analyses (summary fields only), newest first.
+    Needs "Authorization: Bearer <Supabase access token>". Pass the returned
+    next_cursor as 'cursor' to fetch the following page.
+    """
+    user_id = _history_user(authorization)
+    try:
+        return get_history_page(user_id, limit, cursor)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/v1/history/{analysis_id}")
+def history_item(analysis_id: str, authorization: Optional[str] = Header(None)):
+    """
+    Full stored payload of one analysis from the signed-in user's history.
+    """
+    user_id = _history_user(authorization)
+    try:
+        item = get_history_item(user_id, analysis_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if os.path.exists(temp_file_path): os.remove(temp_file_path)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    return item
+
+def _history_user(authorization):
+    # History is only served for a verified identity; without SUPABASE_JWT_SECRET the routes do not exist
+    if not auth_enabled():
+        raise HTTPException(status_code=404, detail="Not Found")
+    try:
+        return verified_user_id(authorization)
+    except AuthenticationError as e:
+        raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"})
+
+@app.post("/api/v1/batch-analysis")
+async def batch_analysis(
+    request: Request,
+    provider: Optional[str] = None,
+    region: Optional[str] = None,
+    city_tier: Optional[str] = None,
+    x_gemini_api_key: Optional[str] = Header(None)
+):
+    """
+    Full analysis for many images in one request.
+    Body: multipart/form-data with any number of image files, or a zip (Content-Type: application/zip).
+    Streams one NDJSON line per image (in completion order) with its vision analysis,
+    estimates and classification, or the error for that image, then a summary line.
+    """
+    try:
+        catalog_store.get().columns_for(region, city_tier)
+    except UnknownRegionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    content_type = request.headers.get("content-type", "")
+    max_bytes = int(BATCH_MAX_FILE_MB * 1024 * 1024)
+    if content_type.startswith("multipart/form-data"):
+        files = iter_multipart_files(request, TEMP_DIR, max_bytes)
+    elif content_type in ("application/zip", "application/x-zip-compressed"):
+        files = iter_zip_files(request, TEMP_DIR, max_bytes)
+    else:
+        raise HTTPException(status_code=415, detail="Send multipart/form-data images or an application/zip archive.")
+
+    def analyze(path):
+        return analyze_batch_item(path, provider, x_gemini_api_key, region, city_tier)
+
+    # The response starts right away: images are analysed as each one is received and
+    # their lines are sent as they finish, while the rest of the upload is still being read
+    return BatchResponse(BatchRun(analyze), files)
 
 if __name__ == "__main__":
     import uvicorn
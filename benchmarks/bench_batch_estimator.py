@@ -0,0 +1,84 @@
+"""
+Throughput of calculate_estimates_batch vs calling calculate_estimate in a loop.
+
+    python benchmarks/bench_batch_estimator.py [--sizes 1000 10000 100000] [--fractional 0.1]
+
+Synthetic analyses (random catalog and off-catalog items, int and fractional
+quantities, random complexity flags) are priced both ways; the outputs are
+compared with json.dumps (after dropping the loop's per-item lists, which
+the batch engine does not build) so int/float differences count as mismatches.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.catalog_store import catalog_store
+from utils.pricing_utils import calculate_estimate
+from utils.batch_estimator import calculate_estimates_batch
+
+ITEM_NAMES = [
+    "Velvet sofa", "Oak coffee table", "Jute area rug", "Linen curtains", "Pendant light", "Floor lamp",
+    "Engineered wood flooring", "Glass door", "Brass door handle", "Hydraulic door closer",
+    "Fluted wall panel", "Acoustic ceiling", "Projection screen", "Ceiling speaker", "Motion sensor",
+    "Armchair", "Bookshelf", "Ceramic vase", "Wall art", "Indoor plant",
+]
+FLAGS = ["false_ceiling", "wall_paneling", "built_in_storage", "custom_carpentry"]
+
+
+def make_analyses(count, fractional=0.1, seed=3):
+    rng = random.Random(seed)
+    analyses = []
+    for _ in range(count):
+        items = []
+        for _ in range(rng.randint(3, 18)):
+            quantity = rng.randint(1, 6) if rng.random() >= fractional else round(rng.uniform(1, 250), 1)
+            items.append({"category": "furniture", "name": rng.choice(ITEM_NAMES), "quantity": quantity})
+        analyses.append({
+            "room_type": "Living Room",
+            "items": items,
+            "complexity_flags": {flag: rng.random() < 0.4 for flag in FLAGS},
+        })
+    return analyses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--fractional", type=float, default=0.1, help="share of items with non-integer quantities")
+    args = parser.parse_args()
+
+    catalog = catalog_store.get()
+    print(f"{'analyses':>10} {'loop/s':>12} {'batch/s':>12} {'identical':>10}")
+    print("-" * 47)
+
+    ok = True
+    for size in args.sizes:
+        analyses = make_analyses(size, args.fractional)
+        # Warm the item-name memo so both paths measure pricing, not matching
+        calculate_estimate(analyses[0], catalog)
+
+        start = time.perf_counter()
+        single = [calculate_estimate(analysis, catalog) for analysis in analyses]
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = calculate_estimates_batch(analyses, catalog)
+        batch_time = time.perf_counter() - start
+
+        for estimates in single:
+            for tier in estimates.values():
+                tier.pop("items")
+        identical = json.dumps(single) == json.dumps(batch)
+        ok = ok and identical
+        print(f"{size:>10} {size / loop_time:>12,.0f} {size / batch_time:>12,.0f} {str(identical):>10}")
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
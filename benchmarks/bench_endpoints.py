@@ -0,0 +1,384 @@
+"""
+Offline load test for the Flask and FastAPI apps.
+
+    python benchmarks/bench_endpoints.py [--endpoints fastapi:full-analysis flask:generate-specs ...]
+        [--requests 60] [--concurrency 8] [--latency 0.6] [--image-latency 1.2]
+        [--error-rate 0.02] [--rate-limit-rate 0.02] [--db-latency 0.02]
+        [--save results.json] [--baseline results.json --max-regression 0.25]
+
+Both apps are served from this process on loopback ports (uvicorn / werkzeug)
+with Gemini and Supabase replaced by benchmarks/fake_services.py, so it needs
+no network access or API keys. Each endpoint gets a warm-up, then --requests
+requests at --concurrency. Every upload is a distinct image so the analysis
+cache does not hide model latency (--same-image measures the cached path).
+
+Reports throughput, p50/p95/p99 latency and the peak RSS seen while each
+endpoint was under load; for the streaming estimate, also how long the first
+priced item took to arrive. With --baseline, exits 1 if any endpoint's p95 or
+throughput is more than --max-regression worse than the saved run.
+"""
+import io
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import tempfile
+import argparse
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+HISTORY_USERS = 20
+HISTORY_ROWS_PER_USER = 60
+BENCH_JWT_SECRET = "offline-benchmark-jwt-signing-secret-0001"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--endpoints", nargs="+", default=["all"], help="names from the table, or 'all'")
+    parser.add_argument("--requests", type=int, default=60, help="measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=None, help="untimed requests first (default: --concurrency)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.6, help="fake Gemini text/vision latency, seconds")
+    parser.add_argument("--image-latency", type=float, default=1.2, help="fake Gemini image latency, seconds")
+    parser.add_argument("--jitter", type=float, default=0.3, help="+/- fraction applied to each latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Gemini calls failing with 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of Gemini calls failing with 429")
+    parser.add_argument("--retry-after", type=float, default=0.5, help="retry hint carried by fake 429s")
+    parser.add_argument("--db-latency", type=float, default=0.02, help="fake Supabase round trip, seconds")
+    parser.add_argument("--quota", action="store_true", help="keep the real GEMINI_RPM/TPM limits (default: unlimited)")
+    parser.add_argument("--fused", choices=["off", "on"], default=None, help="sets FUSED_ANALYSIS for the run")
+    parser.add_argument("--same-image", action="store_true", help="upload one image everywhere (cache hits)")
+    parser.add_argument("--image-size", default="1280x960", help="WxH of the generated uploads")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--save", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON from a previous --save to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25)
+    parser.add_argument("--verbose", action="store_true", help="keep the apps' own log lines")
+    return parser.parse_args()
+
+
+def configure_environment(args, workdir):
+    # Must run before the app modules are imported: they read these at import time
+    os.environ["GOOGLE_API_KEY"] = "offline-benchmark-key"
+    # Empty values stop load_dotenv from pulling real Supabase credentials out of .env
+    os.environ["SUPABASE_URL"] = ""
+    os.environ["SUPABASE_KEY"] = ""
+    # No real Hugging Face token either, so provider=auto never hedges out of the sandbox
+    os.environ["HF_TOKEN"] = ""
+    # History is only served to verified users: the scenarios sign their own Supabase-style tokens
+    os.environ["SUPABASE_JWT_SECRET"] = BENCH_JWT_SECRET
+    os.environ["ANALYSIS_CACHE_DB"] = os.path.join(workdir, "analysis_cache.sqlite3")
+    os.environ["CLASSIFICATION_CACHE_DB"] = os.path.join(workdir, "classification_cache.sqlite3")
+    os.environ["IMAGE_STORE_DIR"] = os.path.join(workdir, "image_store")
+    os.environ["PERSIST_SPOOL_PATH"] = os.path.join(workdir, "persist_spool.jsonl")
+    os.environ.setdefault("GEMINI_BACKOFF_BASE", "0.1")
+    if not args.quota:
+        os.environ["GEMINI_RPM"] = os.environ["GEMINI_TPM"] = "1000000000"
+    if args.fused:
+        os.environ["FUSED_ANALYSIS"] = args.fused
+
+
+# -- load generation ----------------------------------------------------------
+
+def make_uploads(count, size, same_image, seed, scenario=0):
+    from PIL import Image
+    width, height = size
+    base = Image.effect_noise((width, height), 48).convert("RGB")
+    uploads = []
+    for index in range(1 if same_image else count):
+        img = base.copy()
+        # One changed pixel per upload; `scenario` keeps endpoints from hitting each other's cache entries
+        img.putpixel((index % width, (index // width) % height), (seed % 256, index % 256, scenario % 256))
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=88)
+        uploads.append(buffer.getvalue())
+    return [uploads[i % len(uploads)] for i in range(count)]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+class RssSampler:
+    """
+    Samples this process's resident set size every `interval` seconds and
+    keeps the peak since the last reset().
+    """
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self._page = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def rss(self):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self._page
+        except OSError:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.rss())
+
+    def start(self):
+        self._thread.start()
+
+    def reset(self):
+        self.peak = self.rss()
+
+    def stop(self):
+        self._stop.set()
+
+
+def drive(call, total, concurrency):
+    """
+    Runs call(i) for i in range(total) on `concurrency` threads.
+    Returns (latencies in seconds, error count, wall seconds).
+    """
+    import requests
+    local = threading.local()
+    latencies = [0.0] * total
+    errors = [0]
+    lock = threading.Lock()
+
+    def one(index):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            ok = call(session, index).status_code < 400
+        except Exception:
+            ok = False
+        latencies[index] = time.perf_counter() - start
+        if not ok:
+            with lock:
+                errors[0] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    return latencies, errors[0], time.perf_counter() - start
+
+
+# -- servers and scenarios ----------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_fastapi(app):
+    import uvicorn
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    threading.Thread(target=server.run, name="bench-uvicorn", daemon=True).start()
+    while not server.started:
+        time.sleep(0.02)
+    return f"http://127.0.0.1:{port}", lambda: setattr(server, "should_exit", True)
+
+
+def start_flask(app):
+    from werkzeug.serving import make_server
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-werkzeug", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+
+def seed_history(supabase, fixtures):
+    from utils.catalog_store import catalog_store
+    from utils.pricing_utils import calculate_estimate
+    from utils.supabase_handler import build_analysis_row
+    estimate = calculate_estimate(fixtures["vision"], catalog_store.get())
+    rows = [build_analysis_row(fixtures["vision"], estimate, fixtures["classify"], f"bench-user-{u}")
+            for _ in range(HISTORY_ROWS_PER_USER) for u in range(HISTORY_USERS)]
+    supabase.table("analyses").insert(rows).execute()
+
+
+def build_scenarios(urls, uploads, first_items):
+    from utils.upload_sessions import upload_sessions
+
+    import jwt
+    expires = int(time.time()) + 24 * 3600
+    tokens = [jwt.encode({"sub": f"bench-user-{u}", "aud": "authenticated", "exp": expires}, BENCH_JWT_SECRET,
+                         algorithm="HS256") for u in range(HISTORY_USERS)]
+
+    def user(i):
+        return {"Authorization": f"Bearer {tokens[i % HISTORY_USERS]}"}
+
+    def upload(i):
+        return {"file": ("room.jpg", uploads[i], "image/jpeg")}
+
+    sessions = []
+
+    def make_sessions():
+        sessions[:] = [upload_sessions.create(data, "room.jpg") for data in uploads]
+
+    def stream(s, i):
+        # Reads the NDJSON to the end, noting when the first priced item arrived
+        start = time.perf_counter()
+        response = s.post(f"{urls['fastapi']}/api/v1/estimate/stream", files=upload(i),
+                          headers=user(i), stream=True)
+        for line in response.iter_lines():
+            event = json.loads(line).get("event")
+            if event == "item" and i not in first_items:
+                first_items[i] = time.perf_counter() - start
+            elif event == "error":
+                response.status_code = 502
+        return response
+
+    return [
+        ("fastapi:estimate", None, lambda s, i: s.post(
+            f"{urls['fastapi']}/api/v1/estimate", files=upload(i), headers=user(i))),
+        ("fastapi:estimate-stream", None, stream),
+        ("fastapi:full-analysis", None, lambda s, i: s.post(
+            f"{urls['fastapi']}/api/v1/full-analysis", files=upload(i), headers=user(i))),
+        ("fastapi:history", None, lambda s, i: s.get(
+            f"{urls['fastapi']}/api/v1/history", headers=user(i))),
+        ("flask:generate-specs", None, lambda s, i: s.post(
+            f"{urls['flask']}/api/v1/generate-specs", files=upload(i),
+            data={"preset": "Modern", "budget": "9L-15L", "zone": "Living"})),
+        ("flask:analyze-selected", make_sessions, lambda s, i: s.post(
+            f"{urls['flask']}/api/v1/analyze-selected", headers=user(i),
+            json={"session_id": sessions[i], "spec": {"id": 1}})),
+        ("flask:history", None, lambda s, i: s.get(
+            f"{urls['flask']}/api/v1/history", headers=user(i))),
+    ]
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if current["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.0f}ms -> {current['p95_ms']:.0f}ms")
+        if current["rps"] < before["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['rps']:.2f} -> {current['rps']:.2f} req/s")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="bench_endpoints_")
+    configure_environment(args, workdir)
+    out = sys.stdout
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    with quiet:
+        import flask_app
+        import app_fastapi
+        import fake_services
+        from utils.metrics import MODEL_TOKENS
+        from utils.persistence_queue import persistence_queue
+
+    fixtures = fake_services.load_fixtures()
+    gemini = fake_services.FakeGeminiTransport(
+        fixtures, latency=args.latency, image_latency=args.image_latency, jitter=args.jitter,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+        seed=args.seed)
+    supabase = fake_services.FakeSupabase(latency=args.db_latency)
+    fake_services.install(gemini, supabase)
+    with quiet:
+        seed_history(supabase, fixtures)
+
+    if not args.verbose:
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    urls = {}
+    urls["fastapi"], stop_fastapi = start_fastapi(app_fastapi.app)
+    urls["flask"], stop_flask = start_flask(flask_app.app)
+
+    warmup = args.concurrency if args.warmup is None else args.warmup
+    size = tuple(int(v) for v in args.image_size.lower().split("x"))
+    # Refilled in place for every endpoint; the scenarios read it by index
+    uploads = make_uploads(warmup + args.requests, size, args.same_image, args.seed)
+    first_items = {}
+    scenarios = build_scenarios(urls, uploads, first_items)
+    names = [name for name, _, _ in scenarios]
+    wanted = names if "all" in args.endpoints else args.endpoints
+    unknown = [name for name in wanted if name not in names]
+    if unknown:
+        raise SystemExit(f"Unknown endpoint(s) {unknown}; choose from {names}")
+
+    print(f"Fake Gemini {args.latency}s (images {args.image_latency}s), 503 {args.error_rate:.0%}, "
+          f"429 {args.rate_limit_rate:.0%}; fake Supabase {args.db_latency * 1000:.0f}ms; "
+          f"{args.requests} requests x {args.concurrency} concurrent; uploads {len(uploads[0]) // 1024}KB", file=out)
+    print(f"{'endpoint':<24} {'ok':>5} {'err':>4} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'peak RSS MB':>12}", file=out)
+    print("-" * 84, file=out)
+
+    sampler = RssSampler()
+    sampler.start()
+    results = {}
+    with quiet:
+        for position, (name, setup, call) in enumerate(scenarios):
+            if name not in wanted:
+                continue
+            if not args.same_image:
+                uploads[:] = make_uploads(warmup + args.requests, size, False, args.seed, position)
+            if setup:
+                setup()
+            # Warm-up requests use the tail of the upload list so measured uploads stay unseen
+            drive(lambda s, i: call(s, args.requests + i), warmup, args.concurrency)
+            persistence_queue.flush(timeout=30)
+            sampler.reset()
+            latencies, errors, wall = drive(call, args.requests, args.concurrency)
+            persistence_queue.flush(timeout=30)
+            ordered = sorted(latencies)
+            results[name] = {
+                "requests": args.requests, "errors": errors, "rps": args.requests / wall,
+                "p50_ms": percentile(ordered, 50) * 1000, "p95_ms": percentile(ordered, 95) * 1000,
+                "p99_ms": percentile(ordered, 99) * 1000, "peak_rss_mb": sampler.peak / 1024 / 1024,
+            }
+            if name == "fastapi:estimate-stream":
+                firsts = sorted(first_items.get(i, 0.0) for i in range(args.requests))
+                results[name]["first_item_p50_ms"] = percentile(firsts, 50) * 1000
+                results[name]["first_item_p95_ms"] = percentile(firsts, 95) * 1000
+            r = results[name]
+            print(f"{name:<24} {args.requests - errors:>5} {errors:>4} {r['rps']:>7.2f} {r['p50_ms']:>8.0f} "
+                  f"{r['p95_ms']:>8.0f} {r['p99_ms']:>8.0f} {r['peak_rss_mb']:>12.1f}", file=out)
+    sampler.stop()
+    stop_fastapi()
+    streamed = results.get("fastapi:estimate-stream")
+    if streamed:
+        print(f"\nfastapi:estimate-stream first priced item: p50 {streamed['first_item_p50_ms']:.0f} ms, "
+              f"p95 {streamed['first_item_p95_ms']:.0f} ms (complete: p50 {streamed['p50_ms']:.0f} ms)", file=out)
+    stop_flask()
+
+    tokens = {f"{model.rsplit('/', 1)[-1]} {direction}": int(count)
+              for (model, direction), count in sorted(MODEL_TOKENS._values.items())}
+    print(f"\nGemini calls by kind: {gemini.calls_by_kind} (injected 503s {gemini.stats['errors']}, "
+          f"429s {gemini.stats['rate_limited']})", file=out)
+    print(f"Tokens: {tokens}", file=out)
+    print(f"Supabase: {supabase.stats}", file=out)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+        print(f"Saved results to {args.save}", file=out)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.max_regression)
+        if regressions:
+            print("\nREGRESSIONS:\n  " + "\n  ".join(regressions), file=out)
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.max_regression:.0%} against {args.baseline}", file=out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Micro-benchmark: rules-file ItemMatcher vs the original _map_item_to_catalog if-chain.
+
+    python benchmarks/bench_item_matcher.py [--names 5000] [--rules 5000]
+
+Checks that both agree on every generated name, then reports per-item cost for
+cold (uncached) and memoized lookups, and for a synthetic catalog with
+thousands of extra rules to show the cost does not grow with the rule count.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.item_matcher import ItemMatcher, ITEM_RULES_PATH
+
+
+def legacy_map_item_to_catalog(item_name):
+    # Verbatim copy of the pre-rules implementation
+    item_name = item_name.lower()
+    if "closer" in item_name: return "door_closer"
+    if "handle" in item_name or "pull" in item_name: return "hardware_set"
+    if "sofa" in item_name: return "sofa_3_seater"
+    if "table" in item_name and "coffee" in item_name: return "coffee_table"
+    if "rug" in item_name or "carpet" in item_name: return "area_rug"
+    if "curtain" in item_name: return "curtains_set"
+    if "light" in item_name or "lamp" in item_name: return "ceiling_light"
+    if "floor" in item_name: return "flooring_sqft"
+    if "door" in item_name: return "commercial_door"
+    if "panel" in item_name and ("wall" in item_name or "cladding" in item_name): return "wall_paneling_sqft"
+    if "ceiling" in item_name: return "acoustic_ceiling_sqft"
+    if "screen" in item_name and "projection" in item_name: return "projector_screen"
+    if "speaker" in item_name or "sensor" in item_name or "device" in item_name: return "sensor_device"
+    return None
+
+
+ADJECTIVES = ["Modern", "Velvet", "Oak", "Brass", "Minimalist", "Walnut", "Glass", "Marble", "Rattan", "Linen", "Teak"]
+NOUNS = [
+    "sofa", "coffee table", "side table", "area rug", "carpet tiles", "sheer curtains", "pendant light",
+    "floor lamp", "wooden flooring", "glass door", "door handle", "door closer", "cabinet pull",
+    "wall panel", "wall cladding panels", "false ceiling", "projection screen", "ceiling speaker",
+    "motion sensor", "smart device", "armchair", "bookshelf", "vase", "wall art", "plant pot",
+]
+
+
+def make_names(count, seed=7):
+    rng = random.Random(seed)
+    return [f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.randint(1, 400)}" for _ in range(count)]
+
+
+def synthetic_rules(base_rules, extra, seed=11):
+    rng = random.Random(seed)
+    letters = "bcdfghjkmnpqrstvwxz"
+    rules = list(base_rules)
+    for i in range(extra):
+        word = "".join(rng.choice(letters) for _ in range(7))
+        rules.append({"key": f"sku_{i}", "match": [[word]]})
+    return rules
+
+
+def timed(fn, names, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for name in names:
+            fn(name)
+        best = min(best, time.perf_counter() - start)
+    return best / len(names) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--names", type=int, default=5000)
+    parser.add_argument("--rules", type=int, default=5000, help="extra synthetic rules for the scaling run")
+    args = parser.parse_args()
+
+    import json
+    with open(ITEM_RULES_PATH) as f:
+        base_rules = json.load(f)["rules"]
+
+    names = make_names(args.names)
+    matcher = ItemMatcher(base_rules, cache_size=0)
+    cached = ItemMatcher(base_rules)
+
+    mismatches = [n for n in names if matcher.match(n)[0] != legacy_map_item_to_catalog(n)]
+    print(f"Agreement: {len(names) - len(mismatches)}/{len(names)} names")
+    for name in mismatches[:10]:
+        print(f"  MISMATCH {name!r}: legacy={legacy_map_item_to_catalog(name)} matcher={matcher.match(name)[0]}")
+
+    for name in names:
+        cached.match(name)
+
+    print(f"\n{'variant':<40} {'us/item':>10}")
+    print("-" * 51)
+    print(f"{'legacy if-chain (' + str(len(base_rules)) + ' rules)':<40} {timed(legacy_map_item_to_catalog, names):>10.2f}")
+    print(f"{'matcher, uncached':<40} {timed(matcher.match, names):>10.2f}")
+    print(f"{'matcher, memoized':<40} {timed(cached.match, names):>10.2f}")
+
+    big = ItemMatcher(synthetic_rules(base_rules, args.rules), cache_size=0)
+    print(f"{'matcher, uncached, ' + str(len(big.rules)) + ' rules':<40} {timed(big.match, names):>10.2f}")
+
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
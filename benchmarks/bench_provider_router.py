@@ -0,0 +1,130 @@
+"""
+Latency and availability of hedged provider routing, with local fake providers.
+
+    python benchmarks/bench_provider_router.py [--requests 400] [--concurrency 8] [--latency 0.1]
+        [--tail-rate 0.04] [--tail-factor 6] [--secondary-latency 0.15] [--error-rate 0.02]
+
+Two fake vision providers stand in for Gemini (primary) and Hugging Face
+(secondary): each sleeps a jittered latency, with a slow tail (`tail-rate`
+of calls take `tail-factor` times longer), and fails at `error-rate`. Every
+scenario is run twice, through a router that only knows the primary and
+through one that can hedge and fail over to the secondary:
+
+  tail     primary has a slow tail; hedging at its p95 should cut p99
+  outage   primary fails every call for the middle third of the run;
+           the router should fail over, then route around it
+"""
+import io
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.provider_router import Provider, ProviderRouter
+
+
+class FakeProvider:
+    def __init__(self, name, latency, tail_rate=0.0, tail_factor=1.0, error_rate=0.0, seed=0):
+        self.name = name
+        self.latency = latency
+        self.tail_rate = tail_rate
+        self.tail_factor = tail_factor
+        self.error_rate = error_rate
+        self.down = False
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def __call__(self, image, api_key):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency * self._rng.uniform(0.7, 1.3)
+            if self._rng.random() < self.tail_rate:
+                delay *= self.tail_factor
+            failed = self.down or self._rng.random() < self.error_rate
+        if self.down:
+            # An outage answers fast with an error (e.g. 503 / quota exhausted)
+            time.sleep(delay * 0.1)
+            return None
+        time.sleep(delay)
+        return None if failed else f"analysis from {self.name}"
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+def run(router, providers, requests, concurrency, outage):
+    primary = providers[0]
+    latencies = [0.0] * requests
+    answered_by = {}
+    failures = [0]
+    lock = threading.Lock()
+
+    def one(index):
+        if outage:
+            primary.down = requests // 3 <= index < 2 * requests // 3
+        start = time.perf_counter()
+        answer, name = router.route(b"image", None)
+        latencies[index] = time.perf_counter() - start
+        with lock:
+            if answer is None:
+                failures[0] += 1
+            else:
+                answered_by[name] = answered_by.get(name, 0) + 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    primary.down = False
+    ordered = sorted(latencies)
+    return {"p50": percentile(ordered, 50), "p95": percentile(ordered, 95), "p99": percentile(ordered, 99),
+            "failed": failures[0], "answered_by": answered_by, "stats": router.get_stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.1, help="primary median latency (s)")
+    parser.add_argument("--tail-rate", type=float, default=0.04)
+    parser.add_argument("--tail-factor", type=float, default=6.0)
+    parser.add_argument("--secondary-latency", type=float, default=0.15)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'scenario':<8} {'routing':<8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'failed':>7} "
+          f"{'hedged':>7} {'failover':>9}  answered by")
+    print("-" * 96)
+    for scenario in ("tail", "outage"):
+        for routing in ("primary", "hedged"):
+            providers = [
+                FakeProvider("gemini", args.latency, args.tail_rate, args.tail_factor, args.error_rate, args.seed),
+                FakeProvider("hf", args.secondary_latency, args.tail_rate, args.tail_factor, args.error_rate,
+                             args.seed + 1),
+            ]
+            if routing == "primary":
+                providers = providers[:1]
+            # Short cooldown so the outage scenario also shows the primary being taken back
+            router = ProviderRouter([Provider(p.name, p) for p in providers], is_valid=lambda a: a is not None,
+                                    hedge_delay=args.latency * 3, cooldown=0.5,
+                                    executor=ThreadPoolExecutor(max_workers=args.concurrency * 2))
+            with contextlib.redirect_stdout(io.StringIO()):
+                r = run(router, providers, args.requests, args.concurrency, scenario == "outage")
+            s = r["stats"]
+            print(f"{scenario:<8} {routing:<8} {r['p50'] * 1000:>8.0f} {r['p95'] * 1000:>8.0f} {r['p99'] * 1000:>8.0f} "
+                  f"{r['failed']:>7} {s['hedged']:>7} {s['failovers']:>9}  {r['answered_by']}")
+            router.executor.shutdown(wait=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""
+Offline stand-ins for Gemini and Supabase, used by bench_endpoints.py.
+
+FakeGeminiTransport replaces the per-key transport in utils.genai_pool, so the
+real SDK still builds every request and parses every response; only the
+network hop is swapped for recorded JSON (benchmarks/fixtures) or a generated
+PNG, with configurable latency, transient errors and 429s.
+
+FakeSupabase replaces the client in utils.supabase_handler with an in-memory
+'analyses' table that understands the query-builder calls the app makes
+(insert, select with JSON-path aliases, eq, the keyset or_, order, limit).
+"""
+import io
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+
+from PIL import Image
+from google.api_core import exceptions as api_exceptions
+from google.generativeai import protos
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "gemini_responses.json")
+
+
+def load_fixtures(path=FIXTURES_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def make_png(seed, size=(96, 72)):
+    rng = random.Random(seed)
+    img = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class FakeGeminiTransport:
+    """
+    Answers generate_content / stream_generate_content like the Gemini
+    service. The kind of call (vision, fused, classify, specs, image) is told
+    apart from the model name and prompt text.
+
+    Each call sleeps `latency` seconds (`image_latency` for image models),
+    +/- `jitter` as a fraction, then fails with ServiceUnavailable at
+    `error_rate` or ResourceExhausted (with a retry hint of `retry_after`
+    seconds) at `rate_limit_rate`.
+    """
+
+    def __init__(self, fixtures=None, latency=0.6, image_latency=1.2, jitter=0.3, error_rate=0.0,
+                 rate_limit_rate=0.0, retry_after=0.5, seed=None):
+        self.fixtures = fixtures or load_fixtures()
+        self.latency = latency
+        self.image_latency = image_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "errors": 0, "rate_limited": 0}
+        self.calls_by_kind = {}
+
+    @staticmethod
+    def _texts(request):
+        return [part.text for content in request.contents for part in content.parts if part.text]
+
+    def _kind(self, request):
+        if "image" in request.model.rsplit("/", 1)[-1]:
+            return "image"
+        prompt = "\n".join(self._texts(request))
+        if '"vision_analysis"' in prompt:
+            return "fused"
+        if "design directions" in prompt:
+            return "specs"
+        if "classify the project" in prompt:
+            return "classify"
+        return "vision"
+
+    def _vision(self, request):
+        # Tag the recorded analysis with the image digest so different uploads get
+        # different analyses (and so different classification prompts), as in reality
+        image = next((part.inline_data.data for content in request.contents for part in content.parts
+                      if part.inline_data.data), b"")
+        vision = json.loads(json.dumps(self.fixtures["vision"]))
+        vision["items"][0]["notes"] = f"ref {hashlib.sha256(image).hexdigest()[:12]}"
+        return vision
+
+    def _answer(self, kind, request):
+        if kind == "fused":
+            return json.dumps({"vision_analysis": self._vision(request),
+                               "business_classification": self.fixtures["classify"]})
+        if kind == "vision":
+            return json.dumps(self._vision(request))
+        return json.dumps(self.fixtures[kind])
+
+    def _usage(self, request, output_chars):
+        images = sum(1 for content in request.contents for part in content.parts if part.inline_data.data)
+        prompt_tokens = sum(len(text) for text in self._texts(request)) // 4 + 258 * images
+        output_tokens = max(1, output_chars // 4)
+        return protos.GenerateContentResponse.UsageMetadata(
+            prompt_token_count=prompt_tokens, candidates_token_count=output_tokens,
+            total_token_count=prompt_tokens + output_tokens)
+
+    def _roll(self, kind, share=1.0):
+        # Sleeps `share` of the call's latency, then maybe fails; returns the full latency drawn
+        with self._lock:
+            self.stats["calls"] += 1
+            self.calls_by_kind[kind] = self.calls_by_kind.get(kind, 0) + 1
+            delay = self.image_latency if kind == "image" else self.latency
+            delay *= 1 + self._rng.uniform(-self.jitter, self.jitter)
+            roll = self._rng.random()
+        time.sleep(max(0.0, delay * share))
+        if roll < self.rate_limit_rate:
+            self.stats["rate_limited"] += 1
+            raise api_exceptions.ResourceExhausted(
+                f"429 Resource has been exhausted. Please retry in {self.retry_after}s.")
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.stats["errors"] += 1
+            raise api_exceptions.ServiceUnavailable("503 The service is currently unavailable.")
+        return delay
+
+    def _response(self, parts, request, output_chars):
+        candidate = protos.Candidate(content=protos.Content(parts=parts, role="model"),
+                                     finish_reason=protos.Candidate.FinishReason.STOP)
+        return protos.GenerateContentResponse(candidates=[candidate], usage_metadata=self._usage(request, output_chars))
+
+    def generate_content(self, request, **kwargs):
+        kind = self._kind(request)
+        self._roll(kind)
+        if kind == "image":
+            prompt = "\n".join(self._texts(request))
+            data = make_png(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+            part = protos.Part(inline_data=protos.Blob(mime_type="image/png", data=data))
+            return self._response([part], request, 1290 * 4)
+        text = self._answer(kind, request)
+        return self._response([protos.Part(text=text)], request, len(text))
+
+    def stream_generate_content(self, request, chunk_chars=400, first_chunk_share=0.3, **kwargs):
+        # Same answer and total latency as generate_content: the first piece after
+        # `first_chunk_share` of it, the rest spread evenly over the remainder.
+        # Usage counts are cumulative, so the last chunk carries the totals (as Gemini's do).
+        kind = self._kind(request)
+        delay = self._roll(kind, first_chunk_share)
+        text = self._answer(kind, request)
+        chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)]
+        interval = delay * (1 - first_chunk_share) / max(1, len(chunks) - 1)
+        for index, chunk in enumerate(chunks):
+            if index:
+                time.sleep(interval)
+            yield self._response([protos.Part(text=chunk)], request, (index * chunk_chars) + len(chunk))
+
+
+# -- Supabase ---------------------------------------------------------------
+
+_KEYSET_RE = re.compile(r'created_at\.lt\."(?P<created_at>[^"]+)",and\(created_at\.eq\."[^"]+",id\.lt\.(?P<id>\d+)\)')
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+def _project(row, columns):
+    if columns.strip() == "*":
+        return dict(row)
+    projected = {}
+    for column in columns.split(","):
+        alias, _, path = column.partition(":")
+        if not path:
+            alias, path = column, column
+        keys = path.split("->")
+        value = row.get(keys[0])
+        for key in keys[1:]:
+            value = value.get(key) if isinstance(value, dict) else None
+        projected[alias] = value
+    return projected
+
+
+class _Query:
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.columns = "*"
+        self.filters = []
+        self.orders = []
+        self.max_rows = None
+        self.rows_to_insert = None
+
+    def select(self, columns="*"):
+        self.columns = columns
+        return self
+
+    def insert(self, rows):
+        self.rows_to_insert = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: str(row.get(column)) == str(value))
+        return self
+
+    def or_(self, expression):
+        match = _KEYSET_RE.fullmatch(expression)
+        if match is None:
+            raise ValueError(f"FakeSupabase does not understand or_ filter: {expression}")
+        before = (match["created_at"], int(match["id"]))
+        self.filters.append(lambda row: (row["created_at"], row["id"]) < before)
+        return self
+
+    def order(self, column, desc=False):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.max_rows = count
+        return self
+
+    def execute(self):
+        return self.db._execute(self)
+
+
+class FakeSupabase:
+    """
+    In-memory Supabase client with `latency` seconds per round trip. Ids
+    increase and created_at timestamps are unique, as in the real table.
+    """
+
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.tables = {}
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._clock = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        self.stats = {"inserts": 0, "rows_inserted": 0, "selects": 0}
+
+    def table(self, name):
+        return _Query(self, name)
+
+    def _execute(self, query):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            rows = self.tables.setdefault(query.table, [])
+            if query.rows_to_insert is not None:
+                inserted = []
+                for row in query.rows_to_insert:
+                    self._clock += timedelta(milliseconds=1)
+                    stored = {**row, "id": self._next_id, "created_at": self._clock.isoformat()}
+                    self._next_id += 1
+                    rows.append(stored)
+                    inserted.append(stored)
+                self.stats["inserts"] += 1
+                self.stats["rows_inserted"] += len(inserted)
+                return _Result(inserted)
+
+            self.stats["selects"] += 1
+            selected = [row for row in rows if all(f(row) for f in query.filters)]
+        for column, desc in reversed(query.orders):
+            selected.sort(key=lambda row: row.get(column), reverse=desc)
+        if query.max_rows is not None:
+            selected = selected[:query.max_rows]
+        return _Result([_project(row, query.columns) for row in selected])
+
+
+def install(gemini=None, supabase=None):
+    """
+    Points the app's Gemini transports and Supabase client at the fakes. Call
+    after the app modules are imported and before the first request.
+    """
+    from utils import genai_pool, supabase_handler
+    if gemini is not None:
+        genai_pool.model_pool._make_transport = lambda api_key: gemini
+    if supabase is not None:
+        supabase_handler.supabase = supabase
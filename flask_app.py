@@ -1,127 +1,211 @@
 import os
 import shutil
 import json
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_from_directory, send_file, Response, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 from typing import Optional
-import threading
 import google.generativeai as genai
-import requests
 import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
 
 # Load env variables
 load_dotenv()
 
-from agent.vision_reader import analyze_image, get_model
-from utils.pricing_utils import calculate_estimate
-from main import load_catalog
-from utils.classifier import classify_project
-from utils.supabase_handler import save_analysis
+from agent.vision_reader import VISION_MODEL_NAME
+from utils.genai_pool import resolve_api_key, key_fingerprint
+from utils.gemini_scheduler import generate_content
+from utils.single_flight import model_calls, fingerprint
+from utils.analysis_pipeline import run_analysis, parse_flag
+from utils.pipeline import PipelineError
+from utils.catalog_store import UnknownRegionError
+from utils.image_preprocess import prepare_image, read_image_source
+from utils.upload_sessions import upload_sessions
+from utils.history import get_history_page, get_history_item, history_cache, InvalidCursorError
+from utils.auth import AuthenticationError, auth_enabled, verified_user_id, request_user_id
+from utils.image_store import image_store, etag_for, mime_type_for
+from utils.http_pool import http_pool, timeout as http_timeout, HTTP_DOWNLOAD_CHUNK
+from utils.metrics import metrics, stage_timer, record_fallback, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from utils.models import decode_json, dump
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
 CORS(app)
 
-# Ensure temp and img directories exist
-# Ensure temp and img directories exist
-if os.environ.get('VERCEL') or os.path.exists('/tmp'):
-    TEMP_DIR = "/tmp"
-else:
-    TEMP_DIR = "temp"
-    os.makedirs(TEMP_DIR, exist_ok=True)
+# Uploads are held in memory by utils/upload_sessions.py and referenced by session id;
+# nothing is written under a temp directory per request.
 
-# For IMG_OUTPUT_DIR, in Vercel we can't write to static, so we will use /tmp for temp generation
-# and return base64. But local run needs standard dir.
-IMG_OUTPUT_DIR = os.path.join("static", "img")
-if not os.environ.get('VERCEL'):
-    os.makedirs(IMG_OUTPUT_DIR, exist_ok=True)
+# Generated images live in the content-addressed store (utils/image_store.py). Locally they are served
+# from /api/v1/images/<digest>.<ext>; on Vercel, where /tmp is per instance, they go to Supabase Storage
+# (or inline as a data: URI without it). See IMAGE_DELIVERY.
 
-import base64
+# Image generation limits. The pool is shared by every request in this process,
+# so SPEC_IMAGE_MAX_WORKERS caps concurrent calls to the image providers.
+SPEC_IMAGE_MAX_WORKERS = int(os.getenv("SPEC_IMAGE_MAX_WORKERS", "3"))
+SPEC_IMAGE_DEADLINE = float(os.getenv("SPEC_IMAGE_DEADLINE", "40"))
+SPEC_REQUEST_BUDGET = float(os.getenv("SPEC_REQUEST_BUDGET", "55"))
+PLACEHOLDER_IMAGE_URL = "https://placehold.co/800x600/1a1c23/1a1c23?text=Generating..."
 
-def generate_image_via_gemini(prompt, index):
+image_executor = ThreadPoolExecutor(max_workers=SPEC_IMAGE_MAX_WORKERS, thread_name_prefix="spec-image")
+
+def _time_left(deadline):
+    """
+    Seconds until a time.monotonic() deadline (None means no deadline).
+    """
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+IMAGE_MODEL_NAME = "models/gemini-2.5-flash-image"
+
+def generate_image_via_gemini(prompt, index, deadline=None, api_key_override=None):
     """
     Generates an image using Google's native 'Nano Banana' (gemini-2.5-flash-image).
     Falls back to Pollinations AI if Gemini fails.
+    `deadline` is a time.monotonic() timestamp after which the result is no longer wanted.
     """
+    if deadline is not None and _time_left(deadline) <= 0:
+        print(f"⏱️ SKIPPED: Spec {index} image deadline passed while queued")
+        return None
+
     try:
         print(f"🍌 NANO BANANA: Generating image for spec {index}...")
         print(f"📝 Prompt: {prompt[:100]}...")
         
-        # Configure model
-        model = genai.GenerativeModel("models/gemini-2.5-flash-image")
-        
-        # Call generation
-        response = model.generate_content(prompt)
+        # Pooled per-key model behind the quota scheduler; waits for quota only while the deadline allows,
+        # and the request itself gets whatever time is left once the scheduler lets it through
+        response = generate_content(IMAGE_MODEL_NAME, prompt, api_key_override=api_key_override, deadline=deadline,
+                                    label=f"image {index}")
         
         # Extract image bytes from the first candidate
         for candidate in response.candidates:
             for part in candidate.content.parts:
                 if part.inline_data:
-                    image_bytes = part.inline_data.data
-                    
-                    # If on Vercel, return base64 data URI directly to avoid disk write issues
-                    if os.environ.get('VERCEL'):
-                        b64_string = base64.b64encode(image_bytes).decode('utf-8')
-                        print(f"✅ SUCCESS: Generated base64 image for spec {index}")
-                        return f"data:image/png;base64,{b64_string}"
-                    
-                    # Local env: Save to disk
-                    filename = f"banana_{int(time.time())}_{index}.png"
-                    filepath = os.path.join(IMG_OUTPUT_DIR, filename)
-                    with open(filepath, "wb") as f:
-                        f.write(image_bytes)
-                    print(f"✅ SUCCESS: Saved Banana image as {filename}")
-                    return f"/static/img/{filename}"
+                    filename = image_store.put(part.inline_data.data)
+                    print(f"✅ SUCCESS: Stored Banana image as {filename}")
+                    return image_store.public_url(filename)
         
         print(f"❌ FAILED: No image data returned from Nano Banana, trying fallback...")
-        return generate_image_fallback(prompt, index)
+        return generate_image_fallback(prompt, index, deadline)
         
     except Exception as e:
         print(f"❌ ERROR: Nano Banana generation failed: {e}")
         print(f"🔄 Falling back to Pollinations AI...")
-        return generate_image_fallback(prompt, index)
+        return generate_image_fallback(prompt, index, deadline)
 
-def generate_image_fallback(prompt, index):
+def generate_image_fallback(prompt, index, deadline=None):
     """
     Fallback image generation using Pollinations AI.
     """
+    timeout = 30
+    if deadline is not None:
+        timeout = min(timeout, _time_left(deadline))
+        if timeout <= 0:
+            print(f"⏱️ SKIPPED: No time left for fallback image {index}")
+            return None
+
     try:
         # Clean prompt for URL
         clean_prompt = urllib.parse.quote(prompt[:500])
         pollinations_url = f"https://image.pollinations.ai/prompt/{clean_prompt}?width=800&height=600&nologo=true&seed={index}"
         
         print(f"🎨 POLLINATIONS: Generating fallback image {index}...")
+        record_fallback("pollinations_image")
         
-        # Download the image
-        response = requests.get(pollinations_url, timeout=30)
-        if response.status_code == 200:
-            # If on Vercel, return base64
-            if os.environ.get('VERCEL'):
-                b64_string = base64.b64encode(response.content).decode('utf-8')
-                print(f"✅ SUCCESS: Generated fallback base64 image")
-                return f"data:image/png;base64,{b64_string}"
-            
-            # Local: save to disk
-            filename = f"fallback_{int(time.time())}_{index}.png"
-            filepath = os.path.join(IMG_OUTPUT_DIR, filename)
-            with open(filepath, "wb") as f:
-                f.write(response.content)
-            print(f"✅ SUCCESS: Saved fallback image as {filename}")
-            return f"/static/img/{filename}"
-        else:
-            print(f"❌ Pollinations failed with status {response.status_code}")
-            return None
+        # Stream the download straight into the image store over the pooled keep-alive connection
+        with stage_timer("image_fallback"):
+            with http_pool.client("pollinations").stream("GET", pollinations_url,
+                                                         timeout=http_timeout(read=timeout)) as response:
+                if response.status_code != 200:
+                    print(f"❌ Pollinations failed with status {response.status_code}")
+                    return None
+                filename = image_store.put_stream(response.iter_bytes(HTTP_DOWNLOAD_CHUNK))
+        print(f"✅ SUCCESS: Stored fallback image as {filename}")
+        return image_store.public_url(filename)
             
     except Exception as e:
         print(f"❌ ERROR: Fallback generation failed: {e}")
         return None
 
-def generate_specs_data(image_path, preset, budget, zone, api_key_override=None):
+def generate_image_shared(prompt, index, request_deadline=None, api_key_override=None):
     """
-    Uses Gemini to generate 3 distinct 'Build Specs' and then generates images for them.
+    generate_image_via_gemini, coalesced with any identical image already being generated.
+    The image gets SPEC_IMAGE_DEADLINE seconds from when this job starts running
+    (not from when it was queued), clipped to `request_deadline`.
+    """
+    def generate():
+        deadline = time.monotonic() + SPEC_IMAGE_DEADLINE
+        if request_deadline is not None:
+            deadline = min(deadline, request_deadline)
+        with stage_timer("image_generation"):
+            return generate_image_via_gemini(prompt, index, deadline, api_key_override)
+
+    return model_calls.do(("image", fingerprint(IMAGE_MODEL_NAME, prompt, index), key_fingerprint(api_key_override)),
+                          generate)
+
+def build_image_prompt(spec, preset, zone):
+    img_prompt = spec.get("image_prompt", f"A beautiful {preset} {zone} interior design.")
+    # Combine preset and custom prompt for maximum quality
+    return f"Professional architectural photography of a {zone}, {preset} style interior. {img_prompt}. High-end lighting, photorealistic, 8k, ultra-detailed."
+
+def submit_spec_images(specs, preset, zone, api_key_override=None):
     """
-    model = get_model(api_key_override)
+    Queues one image generation per spec on the shared pool.
+    Returns (spec, future, deadline) tuples, where deadline is the overall
+    request budget; each job's own SPEC_IMAGE_DEADLINE starts once a worker
+    picks it up, so time spent queued behind other specs is not charged to it.
+    """
+    request_deadline = time.monotonic() + SPEC_REQUEST_BUDGET
+    jobs = []
+    for spec in specs:
+        future = image_executor.submit(generate_image_shared, build_image_prompt(spec, preset, zone),
+                                       spec["id"], request_deadline, api_key_override)
+        jobs.append((spec, future, request_deadline))
+    return jobs
+
+def collect_spec_image(spec, future, deadline):
+    """
+    Waits for one spec image until `deadline` and stores the URL (or the placeholder) on the spec.
+    """
+    try:
+        image_url = future.result(timeout=_time_left(deadline))
+    except FutureTimeoutError:
+        # The worker cannot be interrupted mid-call, but it checks the deadline before the fallback
+        future.cancel()
+        print(f"⏱️ TIMEOUT: Spec {spec['id']} image missed its deadline, using placeholder")
+        image_url = None
+    except Exception as e:
+        print(f"❌ ERROR: Spec {spec['id']} image failed: {e}")
+        image_url = None
+
+    # If generation fails, we return a blank placeholder instead of text-based one
+    spec["image_url"] = image_url or PLACEHOLDER_IMAGE_URL
+    return spec
+
+def generate_spec_images(specs, preset, zone, api_key_override=None):
+    """
+    Generates the spec images concurrently; a slow spec only costs its own image.
+    """
+    for spec, future, deadline in submit_spec_images(specs, preset, zone, api_key_override):
+        collect_spec_image(spec, future, deadline)
+    return specs
+
+def fallback_specs():
+    # Return empty data instead of text-heavy fallbacks
+    return [
+        {"id": 1, "title": "Design Concept A", "description": "Processing your room vision...", "vibe": "Standard", "image_url": "https://placehold.co/800x600/1a1c23/1a1c23"},
+        {"id": 2, "title": "Design Concept B", "description": "Designing custom elements...", "vibe": "Midrange", "image_url": "https://placehold.co/800x600/1a1c23/1a1c23"},
+        {"id": 3, "title": "Design Concept C", "description": "Applying premium finishes...", "vibe": "Premium", "image_url": "https://placehold.co/800x600/1a1c23/1a1c23"}
+    ]
+
+def generate_spec_texts(image, preset, budget, zone, api_key_override=None):
+    """
+    Uses Gemini to generate 3 distinct 'Build Specs' (text only, no images yet).
+    `image` is a file path or the upload's bytes / memoryview.
+    Returns (specs, ok); on failure the placeholder specs are returned with ok=False.
+    """
+    # Fails before any upload work if there is no key at all
+    resolve_api_key(api_key_override)
     
     # Prompting for VERY specific visual details for the image generator
     prompt = f"""
@@ -142,49 +226,64 @@ def generate_specs_data(image_path, preset, budget, zone, api_key_override=None)
     Return ONLY a JSON array of 3 objects with keys: "title", "description", "vibe", "image_prompt".
     """
 
-    with open(image_path, "rb") as f:
-        image_data = f.read()
-
-    mime_type = "image/jpeg"
-    if image_path.lower().endswith(".png"):
-        mime_type = "image/png"
-
+    image_data, label = read_image_source(image)
     generation_config = genai.GenerationConfig(response_mime_type="application/json")
-    
-    try:
-        response = model.generate_content(
-            [prompt, {"mime_type": mime_type, "data": image_data}],
+
+    def call():
+        prepared = prepare_image(image_data)
+        prepared.report(label)
+        response = generate_content(
+            VISION_MODEL_NAME,
+            [prompt, prepared.as_part()],
+            api_key_override=api_key_override,
+            label="specs",
             generation_config=generation_config
         )
-        specs = json.loads(response.text)
-        
-        # Sequentially generate images
+        specs = decode_json(response.text)
         for i, spec in enumerate(specs):
             spec["id"] = i + 1
-            img_prompt = spec.get("image_prompt", f"A beautiful {preset} {zone} interior design.")
-            
-            # Combine preset and custom prompt for maximum quality
-            final_prompt = f"Professional architectural photography of a {zone}, {preset} style interior. {img_prompt}. High-end lighting, photorealistic, 8k, ultra-detailed."
-            
-            image_url = generate_image_via_gemini(final_prompt, i+1)
-            # If generation fails, we return a blank placeholder instead of text-based one
-            spec["image_url"] = image_url or "https://placehold.co/800x600/1a1c23/1a1c23?text=Generating..."
-            
         return specs
+    
+    try:
+        # Same photo + same preferences already generating (double-click, retry): share that call
+        with stage_timer("spec_texts"):
+            specs = model_calls.do(("specs", fingerprint(VISION_MODEL_NAME, prompt, image_data),
+                                    key_fingerprint(api_key_override)), call)
+        return specs, True
     except Exception as e:
         print(f"GenAI Error: {e}")
-        # Return empty data instead of text-heavy fallbacks
-        return [
-            {"id": 1, "title": "Design Concept A", "description": "Processing your room vision...", "vibe": "Standard", "image_url": "https://placehold.co/800x600/1a1c23/1a1c23"},
-            {"id": 2, "title": "Design Concept B", "description": "Designing custom elements...", "vibe": "Midrange", "image_url": "https://placehold.co/800x600/1a1c23/1a1c23"},
-            {"id": 3, "title": "Design Concept C", "description": "Applying premium finishes...", "vibe": "Premium", "image_url": "https://placehold.co/800x600/1a1c23/1a1c23"}
-        ]
-
-def background_save(vision_data, estimates, classification=None):
+        record_fallback("placeholder_specs")
+        return fallback_specs(), False
+
+def generate_specs_data(image, preset, budget, zone, api_key_override=None):
+    """
+    Uses Gemini to generate 3 distinct 'Build Specs' and then generates images for them.
+    """
+    specs, ok = generate_spec_texts(image, preset, budget, zone, api_key_override)
+    if ok:
+        generate_spec_images(specs, preset, zone, api_key_override)
+    return specs
+
+def iter_spec_images(specs, preset, zone, api_key_override=None):
+    """
+    Yields each spec as soon as its image is ready (or has fallen back to the
+    placeholder), in completion order rather than spec order.
+    """
+    jobs = {future: (spec, deadline) for spec, future, deadline in submit_spec_images(specs, preset, zone, api_key_override)}
+    if not jobs:
+        return
     try:
-        save_analysis(vision_data, estimates, classification)
-    except Exception as e:
-        print(f"Background Save Error: {e}")
+        for future in as_completed(list(jobs), timeout=_time_left(max(d for _, d in jobs.values()))):
+            spec, deadline = jobs.pop(future)
+            yield collect_spec_image(spec, future, deadline)
+    except FutureTimeoutError:
+        pass
+    # Whatever is left has missed its deadline and gets the placeholder
+    for future, (spec, deadline) in jobs.items():
+        yield collect_spec_image(spec, future, deadline)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 @app.route('/')
 def index():
@@ -197,6 +296,39 @@ def health_check():
     supabase_status = "connected" if supabase else "missing/not_configured"
     return jsonify({"status": "online", "api_key": api_key_status, "supabase": supabase_status})
 
+@app.route('/api/v1/cache-stats')
+def cache_stats():
+    from utils.result_cache import analysis_cache, classification_cache
+    from utils.genai_pool import model_pool
+    from utils.persistence_queue import persistence_queue
+    from utils.gemini_scheduler import gemini_scheduler
+    return jsonify({"analysis_cache": analysis_cache.get_stats(), "classification_cache": classification_cache.get_stats(),
+                    "model_pool": model_pool.get_stats(),
+                    "gemini_scheduler": gemini_scheduler.get_stats(), "single_flight": model_calls.get_stats(),
+                    "image_store": image_store.get_stats(), "upload_sessions": upload_sessions.get_stats(),
+                    "persistence": persistence_queue.get_stats(), "history_cache": history_cache.get_stats()})
+
+@app.route('/api/v1/metrics')
+def metrics_endpoint():
+    """
+    Stage latencies, token usage, fallbacks and cache stats in Prometheus text format.
+    """
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/v1/images/<name>')
+def serve_image(name):
+    """
+    Generated images by content hash. The bytes behind a name never change,
+    so clients may cache them forever and revalidate with the ETag.
+    """
+    path = image_store.path_for(name)
+    if path is None:
+        return jsonify({"error": "Image not found"}), 404
+    response = send_file(path, mimetype=mime_type_for(name), etag=etag_for(name), conditional=True,
+                         last_modified=None, max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 @app.route('/api/v1/generate-specs', methods=['POST'])
 def generate_specs():
     if 'file' not in request.files:
@@ -208,44 +340,127 @@ def generate_specs():
     zone = request.form.get('zone', 'Living')
     x_key = request.headers.get('X-Gemini-API-Key')
 
-    temp_path = os.path.join(TEMP_DIR, f"usr_{int(time.time())}.jpg")
-    file.save(temp_path)
+    # Kept in memory under a random session id for the follow-up analyze-selected call
+    with stage_timer("upload"):
+        session_id = upload_sessions.create(file.stream, file.filename)
 
     try:
-        specs = generate_specs_data(temp_path, preset, budget, zone, x_key)
-        return jsonify({"specs": specs, "temp_file": temp_path})
+        specs = generate_specs_data(upload_sessions.get(session_id).view(), preset, budget, zone, x_key)
+        return jsonify({"specs": specs, "session_id": session_id})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/v1/generate-specs/stream', methods=['POST'])
+def generate_specs_stream():
+    """
+    Same inputs as /api/v1/generate-specs, answered as Server-Sent Events:
+      specs  -> {"specs": [...], "session_id": ...} as soon as the text call returns
+      image  -> {"id": ..., "image_url": ...} once per spec, as each image finishes
+      done   -> {"specs": [...]} with every image_url filled in
+    """
+    if 'file' not in request.files:
+        return jsonify({"error": "No file part"}), 400
+
+    file = request.files['file']
+    preset = request.form.get('preset', 'Modern')
+    budget = request.form.get('budget', '9L-15L')
+    zone = request.form.get('zone', 'Living')
+    x_key = request.headers.get('X-Gemini-API-Key')
+
+    with stage_timer("upload"):
+        session_id = upload_sessions.create(file.stream, file.filename)
+    image = upload_sessions.get(session_id).view()
+
+    def events():
+        try:
+            specs, ok = generate_spec_texts(image, preset, budget, zone, x_key)
+            yield sse_event("specs", {"specs": specs, "session_id": session_id})
+            if ok:
+                for spec in iter_spec_images(specs, preset, zone, x_key):
+                    yield sse_event("image", {"id": spec["id"], "image_url": spec["image_url"]})
+            yield sse_event("done", {"specs": specs})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/v1/analyze-selected', methods=['POST'])
 def analyze_selected():
     data = request.json
-    temp_path = data.get('temp_file')
+    session = upload_sessions.get(data.get('session_id'))
     spec_data = data.get('spec')
     x_key = request.headers.get('X-Gemini-API-Key')
 
-    if not temp_path or not os.path.exists(temp_path):
+    if session is None:
         return jsonify({"error": "Session expired, please upload again"}), 400
 
     try:
-        vision_data = analyze_image(temp_path, api_key_override=x_key)
-        if not vision_data:
+        result = run_analysis(session.view(), provider=data.get('provider'), api_key=x_key, region=data.get('region'),
+                              city_tier=data.get('city_tier'),
+                              user_id=request_user_id(request.headers.get('Authorization')),
+                              fused=parse_flag(data.get('fused')))
+        response = jsonify({
+            "vision_analysis": dump(result["vision"]),
+            "cost_estimates": dump(result["estimate"]),
+            "business_classification": dump(result["classify"]),
+            "selected_spec": spec_data
+        })
+        response.headers["Server-Timing"] = result.server_timing()
+        return response
+    except UnknownRegionError as e:
+        return jsonify({"error": str(e)}), 400
+    except PipelineError as e:
+        if e.stage == "vision":
             return jsonify({"error": "Analysis failed"}), 400
+        return jsonify({"error": str(e.error)}), 500
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        catalog = load_catalog()
-        estimates = calculate_estimate(vision_data, catalog)
-        classification = classify_project(vision_data, api_key_override=x_key)
+def _history_user():
+    """
+    (user_id, None) for a verified Supabase access token, else (None, error response).
+    History is only served for a verified identity; without SUPABASE_JWT_SECRET the routes do not exist.
+    """
+    if not auth_enabled():
+        return None, (jsonify({"error": "Not Found"}), 404)
+    try:
+        return verified_user_id(request.headers.get('Authorization')), None
+    except AuthenticationError as e:
+        return None, (jsonify({"error": str(e)}), 401, {"WWW-Authenticate": "Bearer"})
 
-        threading.Thread(target=background_save, args=(vision_data, estimates, classification)).start()
+@app.route('/api/v1/history')
+def history():
+    """
+    One page of the signed-in user's past analyses (summary fields only), newest first.
+    Header: Authorization: Bearer <Supabase access token>.
+    Query: limit (default 20), cursor (next_cursor from the previous page).
+    """
+    user_id, error = _history_user()
+    if error:
+        return error
+    try:
+        return jsonify(get_history_page(user_id, request.args.get('limit', type=int), request.args.get('cursor')))
+    except InvalidCursorError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        return jsonify({
-            "vision_analysis": vision_data,
-            "cost_estimates": estimates,
-            "business_classification": classification,
-            "selected_spec": spec_data
-        })
+@app.route('/api/v1/history/<analysis_id>')
+def history_item(analysis_id):
+    """
+    Full stored payload of one analysis from the signed-in user's history.
+    """
+    user_id, error = _history_user()
+    if error:
+        return error
+    try:
+        item = get_history_item(user_id, analysis_id)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    if item is None:
+        return jsonify({"error": "Analysis not found"}), 404
+    return jsonify(item)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8000, debug=True)
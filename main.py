@@ -9,50 +9,55 @@ load_dotenv()
 
 # We will check for the API key inside the actual functions instead of crashing at startup
 
-from agent.vision_reader import analyze_image
-from utils.pricing_utils import calculate_estimate
+from utils.analysis_pipeline import run_analysis
+from utils.pipeline import PipelineError
+from utils.catalog_store import catalog_store, UnknownRegionError
+from utils.batch_estimator import compare_regions
+from utils.models import as_vision_analysis, dump
 
 def load_catalog():
-    # Attempt absolute path relative to this file
-    base_path = os.path.dirname(os.path.abspath(__file__))
-    catalog_path = os.path.join(base_path, "data", "catalog_prices.json")
-    
-    # Fallback for Vercel/api structure if not found
-    if not os.path.exists(catalog_path):
-        catalog_path = os.path.join(base_path, "..", "data", "catalog_prices.json")
-
-    try:
-        with open(catalog_path, "r") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Error loading catalog at {catalog_path}: {e}")
-        return {}
+    """
+    Returns the current compiled catalog; the file is only re-read when its mtime changes.
+    """
+    return catalog_store.get()
 
 def print_estimates(estimates):
     print("\n" + "="*50)
     print("ESTIMATED COST BREAKDOWN")
     print("="*50)
     
-    for tier in ["economy", "standard", "premium"]:
-        data = estimates[tier]
+    for tier, data in estimates.tiers:
         print(f"\n--- {tier.upper()} TIER ---")
         print(f"{'Item':<30} | {'Qty':<5} | {'Unit':<10} | {'Total':<10}")
         print("-" * 65)
         
-        for item in data["items"]:
-            print(f"{item['name'][:30]:<30} | {item['quantity']:<5} | INR {item['unit_price']:<9} | INR {item['cost']:<9}")
+        for item in data.items:
+            print(f"{item.name[:30]:<30} | {item.quantity:<5} | INR {item.unit_price:<9} | INR {item.cost:<9}")
             
         print("-" * 65)
-        print(f"{'Subtotal':<48} : INR {data['subtotal']}")
-        print(f"{'Labor (' + str(int(data['labor_percent']*100)) + '%)':<48} : INR {data['labor']}")
-        print(f"{'Contingency (' + str(int(data['contingency_percent']*100)) + '%)':<48} : INR {data['contingency']}")
-        print(f"{'TOTAL ESTIMATE':<48} : INR {data['total']}")
+        print(f"{'Subtotal':<48} : INR {data.subtotal}")
+        print(f"{'Labor (' + str(int(data.labor_percent*100)) + '%)':<48} : INR {data.labor}")
+        print(f"{'Contingency (' + str(int(data.contingency_percent*100)) + '%)':<48} : INR {data.contingency}")
+        print(f"{'TOTAL ESTIMATE':<48} : INR {data.total}")
+
+def print_region_comparison(comparison):
+    print("\n" + "="*50)
+    print("TOTAL BY REGION")
+    print("="*50)
+    print(f"{'Region':<15} | {'Economy':>12} | {'Standard':>12} | {'Premium':>12}")
+    print("-" * 60)
+    for region, tiers in sorted(comparison.items(), key=lambda r: r[1]["standard"]["total"]):
+        print(f"{region:<15} | {tiers['economy']['total']:>12} | {tiers['standard']['total']:>12} | {tiers['premium']['total']:>12}")
 
 def main():
     parser = argparse.ArgumentParser(description="AI Interior Design Estimator Agent")
     parser.add_argument("image_path", help="Path to the interior design image file")
-    parser.add_argument("--provider", choices=["gemini", "hf"], default="gemini", help="AI Provider to use (gemini or hf)")
+    parser.add_argument("--provider", choices=["auto", "gemini", "hf"], default=None,
+                        help="AI Provider to use (auto routes between gemini and hf; default: VISION_PROVIDER)")
     parser.add_argument("--output", help="Optional path to save results as JSON")
+    parser.add_argument("--region", help="Price for a region from data/region_multiplier.json (default: national base prices)")
+    parser.add_argument("--city-tier", help="Optional city tier multiplier, e.g. tier_1")
+    parser.add_argument("--compare-regions", action="store_true", help="Also print the total for every region")
     
     args = parser.parse_args()
     
@@ -60,47 +65,46 @@ def main():
         print(f"Error: File not found at {args.image_path}")
         return
     
-    if args.provider == "hf":
-        from agent.vision_reader import analyze_image_hf
-        vision_data = analyze_image_hf(args.image_path)
-    else:
-        vision_data = analyze_image(args.image_path)
-    
-    if not vision_data:
-        print("Failed to analyze image.")
+    try:
+        result = run_analysis(args.image_path, provider=args.provider, classify=False, persist=False,
+                              region=args.region, city_tier=args.city_tier)
+    except UnknownRegionError as e:
+        print(f"Error: {e}")
         return
-        
-    print("\nVision Extraction Successful!")
-    print(f"Room Type: {vision_data.get('room_type', 'Unknown')}")
-    print(f"Style: {vision_data.get('style_guess', 'Unknown')}")
-    print(f"Quality Tier Guess: {vision_data.get('quality_tier_guess', {}).get('tier', 'Unknown')} (Conf: {vision_data.get('quality_tier_guess', {}).get('confidence', 0)})")
+    except PipelineError as e:
+        print(f"Failed to analyze image. ({e})")
+        return
+
+    vision_data = as_vision_analysis(result["vision"])
+    estimates = result["estimate"]
+    tier_guess = vision_data.quality_tier_guess
+
+    print(f"\nVision Extraction Successful! (provider: {result.provider})")
+    print(f"Room Type: {vision_data.room_type or 'Unknown'}")
+    print(f"Style: {vision_data.style_guess or 'Unknown'}")
+    print(f"Quality Tier Guess: {tier_guess.tier or 'Unknown'} (Conf: {tier_guess.confidence})")
     
     print("\nCalculated Complexity Flags:")
-    for flag, value in vision_data.get("complexity_flags", {}).items():
+    for flag, value in vision_data.complexity_flags.items():
         print(f"- {flag}: {value}")
 
     print("\n" + "-"*30)
     print("COST SAVING ADVICE (What to eliminate/simplify):")
-    for point in vision_data.get("cost_saving_points", []):
+    for point in vision_data.cost_saving_points:
         print(f"• {point}")
     
     print("\nBUYING RECOMMENDATIONS (Affordable Stores):")
-    for rec in vision_data.get("buying_recommendations", []):
-        cat = rec.get("item_category", "General")
-        store = rec.get("store_suggestion", "N/A")
-        tip = rec.get("price_tip", "")
-        print(f"• {cat}: Buy at {store}. Tip: {tip}")
+    for rec in vision_data.buying_recommendations:
+        cat = rec.item_category or "General"
+        store = rec.store_suggestion or "N/A"
+        print(f"• {cat}: Buy at {store}. Tip: {rec.price_tip}")
     print("-" * 30)
 
-    print("\nCalculating estimates...")
-    catalog = load_catalog()
-    estimates = calculate_estimate(vision_data, catalog)
-    
     # Save to JSON if requested
     if args.output:
         output_data = {
-            "vision_analysis": vision_data,
-            "cost_estimates": estimates
+            "vision_analysis": dump(result["vision"]),
+            "cost_estimates": dump(estimates)
         }
         try:
             with open(args.output, "w") as f:
@@ -110,6 +114,8 @@ def main():
             print(f"Error saving JSON: {e}")
 
     print_estimates(estimates)
+    if args.compare_regions:
+        print_region_comparison(compare_regions(vision_data, load_catalog(), args.city_tier))
     print("\n" + "="*50)
     
 if __name__ == "__main__":
@@ -29,7 +29,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const finalDesignVibe = document.getElementById('finalDesignVibe');
 
     let currentFile = null;
-    let tempFilePath = null;
+    let uploadSessionId = null;
     let user = null;
 
     // Budget Slider Logic
@@ -301,6 +301,30 @@ document.addEventListener('DOMContentLoaded', () => {
         reader.readAsDataURL(file);
     }
 
+    // Reads a text/event-stream response body and calls onEvent(name, data) per event
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const raw = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                let event = 'message';
+                let data = '';
+                raw.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                });
+                if (data) onEvent(event, JSON.parse(data));
+            }
+        }
+    }
+
     async function fetchSpecs() {
         if (!currentFile) return;
         const formData = new FormData();
@@ -312,14 +336,26 @@ document.addEventListener('DOMContentLoaded', () => {
 
         showLoader('Designing your space with AI...');
         try {
-            const response = await fetch('/api/v1/generate-specs', { method: 'POST', body: formData });
-            const data = await response.json();
-            if (data.error) throw new Error(data.error);
-            tempFilePath = data.temp_file;
-            displaySpecs(data.specs);
-            configSection.style.display = 'none';
-            specSelectionSection.style.display = 'block';
-            specSelectionSection.scrollIntoView({ behavior: 'smooth' });
+            // Spec text arrives first; each image is swapped into its card as it finishes
+            const response = await fetch('/api/v1/generate-specs/stream', { method: 'POST', body: formData });
+            if (!response.ok) {
+                const data = await response.json();
+                throw new Error(data.error || response.statusText);
+            }
+            await readEventStream(response, (event, data) => {
+                if (event === 'specs') {
+                    uploadSessionId = data.session_id;
+                    displaySpecs(data.specs);
+                    hideLoader();
+                    configSection.style.display = 'none';
+                    specSelectionSection.style.display = 'block';
+                    specSelectionSection.scrollIntoView({ behavior: 'smooth' });
+                } else if (event === 'image') {
+                    updateSpecImage(data.id, data.image_url);
+                } else if (event === 'error') {
+                    throw new Error(data.error);
+                }
+            });
         } catch (error) {
             alert('Error: ' + error.message);
         } finally {
@@ -330,13 +366,19 @@ document.addEventListener('DOMContentLoaded', () => {
     generateSpecsBtn.addEventListener('click', fetchSpecs);
     generateMoreBtn.addEventListener('click', fetchSpecs);
 
+    let displayedSpecs = {};
+
     function displaySpecs(specs) {
         specsGrid.innerHTML = '';
+        displayedSpecs = {};
         specs.forEach(spec => {
+            displayedSpecs[spec.id] = spec;
             const card = document.createElement('div');
             card.className = 'glass-card spec-card';
+            card.dataset.specId = spec.id;
+            const imageUrl = spec.image_url || 'https://placehold.co/800x600/1a1c23/1a1c23?text=Generating...';
             card.innerHTML = `
-                <img src="${spec.image_url}" class="spec-img" onerror="this.src='https://placehold.co/600x400/f5f5f7/f5f5f7'">
+                <img src="${imageUrl}" class="spec-img" onerror="this.src='https://placehold.co/600x400/f5f5f7/f5f5f7'">
                 <h3>${spec.title}</h3>
                 <p style="color:var(--text-muted); font-size:0.95rem; margin:15px 0 25px;">${spec.description}</p>
                 <div style="margin-top:auto; display:flex; justify-content:space-between; align-items:center;">
@@ -349,13 +391,20 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    function updateSpecImage(id, imageUrl) {
+        const spec = displayedSpecs[id];
+        if (spec) spec.image_url = imageUrl;
+        const img = specsGrid.querySelector(`.spec-card[data-spec-id="${id}"] .spec-img`);
+        if (img) img.src = imageUrl;
+    }
+
     async function selectSpec(spec) {
         showLoader('Calculating Final Estimations...');
         try {
             const response = await fetch('/api/v1/analyze-selected', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ temp_file: tempFilePath, spec: spec })
+                body: JSON.stringify({ session_id: uploadSessionId, spec: spec })
             });
             const data = await response.json();
             if (data.error) throw new Error(data.error);
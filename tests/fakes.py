@@ -0,0 +1,110 @@
+import threading
+import time
+
+
+class StubBackend:
+    """
+    In-process stand-in for the database. Keeps inserted rows in `rows` and
+    fails the next `fail_times` inserts (or all of them while `down` is set),
+    so batching, retries and spool replay can be exercised without Supabase.
+    """
+
+    def __init__(self, fail_times=0, latency=0.0):
+        self.rows = []
+        self.batches = []
+        self.fail_times = fail_times
+        self.latency = latency
+        self.down = False
+        self.available = True
+        self._lock = threading.Lock()
+
+    def insert_many(self, rows):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self.down or self.fail_times > 0:
+                self.fail_times = max(0, self.fail_times - 1)
+                raise ConnectionError("stub backend unavailable")
+            self.rows.extend(rows)
+            self.batches.append(len(rows))
+
+
+class FakeClock:
+    """
+    Manual clock for the scheduler: sleep() advances time instantly and
+    records each delay in `sleeps`.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class RateLimitError(Exception):
+    """
+    429 raised by FakeGeminiProvider; real calls raise google.api_core's ResourceExhausted.
+    """
+
+    code = 429
+
+    def __init__(self, message="429 Resource has been exhausted", retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class FakeGeminiProvider:
+    """
+    Local stand-in for the Gemini API that enforces its own requests-per-minute
+    limit (fixed one-minute windows on the given clock) and answers 429s with
+    a retry_after, for exercising the scheduler without network access.
+    """
+
+    def __init__(self, rpm, clock, response="{}", retry_after=True, total_tokens=None):
+        self.rpm = rpm
+        self.clock = clock
+        self.response = response
+        self.retry_after = retry_after
+        self.total_tokens = total_tokens
+        self.calls = []
+        self.rejected = 0
+
+    def generate_content(self, *args, **kwargs):
+        now = self.clock()
+        window_start = now - (now % 60)
+        in_window = sum(1 for t in self.calls if t >= window_start)
+        if in_window >= self.rpm:
+            self.rejected += 1
+            raise RateLimitError(retry_after=(window_start + 60 - now) if self.retry_after else None)
+        self.calls.append(now)
+        usage = type("FakeUsage", (), {"total_token_count": self.total_tokens})() if self.total_tokens else None
+        return type("FakeResponse", (), {"text": self.response, "usage_metadata": usage})()
+
+
+class FakeVisionProvider:
+    """
+    Local vision backend for the provider router: returns `answer` (or raises
+    it, if it is an exception), after waiting for `gate` when one is set.
+    Records the API key of every call in `calls`.
+    """
+
+    def __init__(self, answer, gate=None):
+        self.answer = answer
+        self.gate = gate
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, image, api_key):
+        with self._lock:
+            self.calls.append(api_key)
+        if self.gate is not None:
+            self.gate.wait(5)
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
@@ -0,0 +1,106 @@
+import time
+
+import jwt
+import pytest
+
+from utils import auth
+from utils.auth import AuthenticationError, request_user_id, verified_user_id
+
+SECRET = "test-jwt-secret-with-at-least-32-bytes"
+
+
+@pytest.fixture(autouse=True)
+def jwt_secret(monkeypatch):
+    monkeypatch.setattr(auth, "SUPABASE_JWT_SECRET", SECRET)
+
+
+def token(secret=SECRET, **claims):
+    claims.setdefault("sub", "user-1")
+    claims.setdefault("aud", "authenticated")
+    claims.setdefault("exp", int(time.time()) + 3600)
+    return "Bearer " + jwt.encode({k: v for k, v in claims.items() if v is not None}, secret, algorithm="HS256")
+
+
+def test_valid_token_gives_the_subject():
+    assert verified_user_id(token()) == "user-1"
+    assert request_user_id(token()) == "user-1"
+
+
+@pytest.mark.parametrize("authorization", [
+    token(secret="some-other-secret-with-at-least-32-bytes"),
+    token(exp=int(time.time()) - 60),
+    token(aud="anon"),
+    token(sub=None),
+    token(exp=None),
+    token().replace("Bearer ", "Basic "),
+    token().replace("Bearer ", ""),
+    "Bearer ",
+    None,
+], ids=["bad-signature", "expired", "wrong-audience", "missing-sub", "missing-exp",
+        "wrong-scheme", "no-scheme", "empty", "missing"])
+def test_rejected_tokens(authorization):
+    with pytest.raises(AuthenticationError):
+        verified_user_id(authorization)
+    # Saving an analysis just falls back to anonymous
+    assert request_user_id(authorization) is None
+
+
+def test_unsigned_token_is_rejected():
+    unsigned = jwt.encode({"sub": "user-1", "aud": "authenticated", "exp": int(time.time()) + 60},
+                          None, algorithm="none")
+
+    with pytest.raises(AuthenticationError):
+        verified_user_id("Bearer " + unsigned)
+
+
+def test_nothing_is_authenticated_without_a_secret(monkeypatch):
+    monkeypatch.setattr(auth, "SUPABASE_JWT_SECRET", None)
+
+    with pytest.raises(AuthenticationError):
+        verified_user_id(token())
+    assert request_user_id(token()) is None
+
+
+@pytest.fixture(params=["flask", "fastapi"])
+def client(request, monkeypatch):
+    """
+    Test client for either app, with the history backend replaced by a fake.
+    """
+    from utils import history, supabase_handler
+    monkeypatch.setattr(history, "history_cache", history.HistoryCache())
+    monkeypatch.setattr(supabase_handler, "get_user_history_page", lambda user_id, limit, before: [])
+    monkeypatch.setattr(supabase_handler, "get_analysis", lambda user_id, analysis_id: None)
+    if request.param == "flask":
+        import flask_app
+        return flask_app.app.test_client()
+    from fastapi.testclient import TestClient
+    import app_fastapi
+    return TestClient(app_fastapi.app)
+
+
+def test_history_needs_a_token(client):
+    response = client.get("/api/v1/history")
+
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == "Bearer"
+
+
+def test_history_rejects_an_invalid_token(client):
+    response = client.get("/api/v1/history", headers={"Authorization": token(aud="anon")})
+
+    assert response.status_code == 401
+
+
+def test_history_is_served_for_a_valid_token(client):
+    response = client.get("/api/v1/history", headers={"Authorization": token()})
+
+    assert response.status_code == 200
+    body = response.get_json() if hasattr(response, "get_json") else response.json()
+    assert body == {"items": [], "next_cursor": None}
+
+
+def test_history_routes_do_not_exist_without_a_secret(client, monkeypatch):
+    monkeypatch.setattr(auth, "SUPABASE_JWT_SECRET", None)
+
+    assert client.get("/api/v1/history", headers={"Authorization": token()}).status_code == 404
+    assert client.get("/api/v1/history/42", headers={"Authorization": token()}).status_code == 404
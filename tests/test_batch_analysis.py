@@ -0,0 +1,211 @@
+import io
+import os
+import json
+import asyncio
+import zipfile
+import threading
+from functools import partial
+
+import pytest
+
+import app_fastapi
+from utils.batch_analysis import BatchRun
+
+BOUNDARY = "batchtestboundary"
+
+
+def multipart(files, boundary=BOUNDARY):
+    body = b""
+    for name, data in files:
+        body += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"files\"; filename=\"{name}\"\r\n"
+                 f"Content-Type: image/jpeg\r\n\r\n").encode() + data + b"\r\n"
+    body += b"--" + boundary.encode() + b"--\r\n"
+    return f"multipart/form-data; boundary={boundary}", body
+
+
+def zipped(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return "application/zip", buffer.getvalue()
+
+
+def chunks(body, size=1024):
+    return [body[i:i + size] for i in range(0, len(body), size)] or [b""]
+
+
+async def call(app, content_type, body_chunks, query=b"", disconnect=None, truncated=False):
+    """
+    Drives the ASGI app with the body sent in chunks. The client disconnects
+    when `disconnect` (an asyncio.Event) is set, or once the response is
+    complete; with `truncated` it disconnects straight after the last chunk.
+    """
+    pending = list(body_chunks)
+    done = disconnect or asyncio.Event()
+    if truncated:
+        done.set()
+    response = {"status": None, "body": b""}
+
+    async def receive():
+        if pending:
+            chunk = pending.pop(0)
+            return {"type": "http.request", "body": chunk, "more_body": truncated or bool(pending)}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+            if not message.get("more_body"):
+                done.set()
+
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+             "scheme": "http", "path": "/api/v1/batch-analysis", "raw_path": b"/api/v1/batch-analysis",
+             "query_string": query, "headers": [(b"content-type", content_type.encode())],
+             "client": ("127.0.0.1", 1234), "server": ("testserver", 80), "root_path": ""}
+    await asyncio.wait_for(app(scope, receive, send), timeout=10)
+    return response
+
+
+def lines(response):
+    return [json.loads(line) for line in response["body"].decode().splitlines()]
+
+
+def leftover(tmp_path):
+    return [name for name in os.listdir(tmp_path) if name.startswith("batch_")]
+
+
+@pytest.fixture
+def analyzed(monkeypatch, tmp_path):
+    """
+    Replaces the per-image analysis with a stub that records what it was given.
+    """
+    seen = []
+
+    def analyze(path, provider, api_key, region, city_tier):
+        with open(path, "rb") as f:
+            data = f.read()
+        seen.append(data)
+        return {"status": "ok", "bytes": data.decode(), "region": region}
+
+    monkeypatch.setattr(app_fastapi, "TEMP_DIR", str(tmp_path))
+    monkeypatch.setattr(app_fastapi, "analyze_batch_item", analyze)
+    return seen
+
+
+def test_multipart_images_are_analysed_with_a_summary(analyzed, tmp_path):
+    content_type, body = multipart([("a.jpg", b"alpha"), ("b.jpg", b"bravo" * 500), ("c.png", b"charlie")])
+
+    response = asyncio.run(call(app_fastapi.app, content_type, chunks(body, 100), query=b"region=mumbai"))
+
+    assert response["status"] == 200
+    *results, summary = lines(response)
+    assert sorted((r["index"], r["filename"], r["bytes"]) for r in results) == [
+        (0, "a.jpg", "alpha"), (1, "b.jpg", "bravo" * 500), (2, "c.png", "charlie")]
+    assert {r["region"] for r in results} == {"mumbai"}
+    assert summary == {"done": True, "total": 3, "succeeded": 3, "failed": 0}
+    assert leftover(tmp_path) == []
+
+
+def test_zip_images_are_analysed_and_other_members_skipped(analyzed, tmp_path):
+    content_type, body = zipped([("room/a.jpg", b"alpha"), ("notes.txt", b"skip"), ("__MACOSX/._a.jpg", b"skip"),
+                                 (".hidden.jpg", b"skip"), ("b.JPEG", b"bravo")])
+
+    response = asyncio.run(call(app_fastapi.app, content_type, chunks(body)))
+
+    *results, summary = lines(response)
+    assert sorted((r["filename"], r["bytes"]) for r in results) == [("b.JPEG", "bravo"), ("room/a.jpg", "alpha")]
+    assert summary["total"] == 2
+    assert leftover(tmp_path) == []
+
+
+@pytest.mark.parametrize("encode", [multipart, zipped])
+def test_oversized_images_are_reported_inline(analyzed, tmp_path, monkeypatch, encode):
+    monkeypatch.setattr(app_fastapi, "BATCH_MAX_FILE_MB", 1 / 1024)  # 1 KB
+    content_type, body = encode([("small.jpg", b"x" * 100), ("big.jpg", b"y" * 2048)])
+
+    *results, summary = lines(asyncio.run(call(app_fastapi.app, content_type, chunks(body, 300))))
+
+    errors = {r["filename"]: r for r in results if r["status"] == "error"}
+    assert list(errors) == ["big.jpg"]
+    assert errors["big.jpg"]["stage"] == "upload"
+    assert "limit" in errors["big.jpg"]["error"]
+    assert summary == {"done": True, "total": 2, "succeeded": 1, "failed": 1}
+    assert analyzed == [b"x" * 100]
+    assert leftover(tmp_path) == []
+
+
+def test_images_past_the_batch_limit_are_reported_inline(analyzed, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_fastapi, "BatchRun", partial(BatchRun, max_items=2))
+    content_type, body = multipart([(f"{i}.jpg", b"img") for i in range(4)])
+
+    *results, summary = lines(asyncio.run(call(app_fastapi.app, content_type, chunks(body))))
+
+    limited = sorted(r["index"] for r in results if r["status"] == "error")
+    assert limited == [2, 3]
+    assert all(r["error"] == "Batch limit of 2 images exceeded" for r in results if r["status"] == "error")
+    assert summary == {"done": True, "total": 4, "succeeded": 2, "failed": 2}
+    assert len(analyzed) == 2
+    assert leftover(tmp_path) == []
+
+
+@pytest.mark.parametrize("content_type, body, error", [
+    (*multipart([]), "No images found in upload."),
+    ("application/zip", b"not a zip", "Invalid zip archive"),
+])
+def test_upload_errors_are_reported_in_the_summary(analyzed, content_type, body, error):
+    (summary,) = lines(asyncio.run(call(app_fastapi.app, content_type, chunks(body))))
+
+    assert summary["total"] == 0
+    assert summary["error"].startswith(error)
+
+
+def test_other_content_types_are_rejected(analyzed):
+    response = asyncio.run(call(app_fastapi.app, "application/json", [b"{}"]))
+
+    assert response["status"] == 415
+
+
+def test_client_disconnect_after_the_upload_leaves_no_temp_files(analyzed, tmp_path, monkeypatch):
+    gate = threading.Event()
+    started = []
+
+    def slow_analyze(path, provider, api_key, region, city_tier):
+        started.append(path)
+        gate.wait(5)
+        return {"status": "ok"}
+
+    monkeypatch.setattr(app_fastapi, "analyze_batch_item", slow_analyze)
+    monkeypatch.setattr(app_fastapi, "BatchRun", partial(BatchRun, workers=1, queue_size=8))
+    content_type, body = multipart([(f"{i}.jpg", b"img" * 100) for i in range(5)])
+
+    async def run():
+        disconnect = asyncio.Event()
+        task = asyncio.create_task(call(app_fastapi.app, content_type, chunks(body), disconnect=disconnect))
+        while not started:
+            await asyncio.sleep(0.01)
+        disconnect.set()
+        return await task
+
+    try:
+        response = asyncio.run(run())
+    finally:
+        gate.set()
+
+    # One image was being analysed and the rest were queued: none get a line, and none stay on disk
+    assert len(started) == 1
+    assert response["body"] == b""
+    assert leftover(tmp_path) == []
+
+
+def test_client_disconnect_mid_upload_leaves_no_temp_files(analyzed, tmp_path):
+    content_type, body = multipart([("a.jpg", b"a" * 5000), ("b.jpg", b"b" * 5000)])
+
+    # The client goes away half-way through the second file
+    asyncio.run(call(app_fastapi.app, content_type, chunks(body[:7500], 500), truncated=True))
+
+    assert analyzed in ([], [b"a" * 5000])
+    assert leftover(tmp_path) == []
@@ -0,0 +1,110 @@
+import json
+import math
+import os
+
+import pytest
+
+from utils.batch_estimator import calculate_estimates_batch, compare_regions
+from utils.catalog_store import catalog_store
+from utils.pricing_utils import calculate_estimate
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "fixtures", "gemini_responses.json")
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    return catalog_store.get()
+
+
+@pytest.fixture(scope="module")
+def vision():
+    with open(FIXTURE) as f:
+        return json.load(f)["vision"]
+
+
+def with_items(*items, flags=None):
+    return {"room_type": "Living Room", "items": list(items), "complexity_flags": flags or {}}
+
+
+def sofa(quantity):
+    return {"name": "Three-seater fabric sofa", "quantity": quantity}
+
+
+def totals_only(estimate):
+    return {tier: {key: value for key, value in data.items() if key != "items"} for tier, data in estimate.items()}
+
+
+def assert_identical(actual, expected):
+    # Values and int/float types both match (NaN compares equal to NaN)
+    assert actual.keys() == expected.keys()
+    for tier in expected:
+        for key, value in expected[tier].items():
+            got = actual[tier][key]
+            assert type(got) is type(value), (tier, key, got, value)
+            assert got == value or (isinstance(value, float) and math.isnan(value) and math.isnan(got)), \
+                (tier, key, got, value)
+
+
+CASES = {
+    "int quantity": with_items(sofa(2)),
+    "string quantity": with_items(sofa("2")),
+    "string float quantity": with_items(sofa("1.5")),
+    "float quantity": with_items(sofa(2.5)),
+    "integral float quantity": with_items(sofa(2.0)),
+    "none quantity": with_items(sofa(None)),
+    "bool quantity": with_items(sofa(True)),
+    "garbage quantity": with_items(sofa("a couple")),
+    "string flags": with_items(sofa(1), flags={"false_ceiling": "false", "built_in_storage": "true",
+                                               "custom_carpentry": "yes"}),
+    "all flags": with_items(sofa(1), flags={"false_ceiling": True, "built_in_storage": 1, "custom_carpentry": True,
+                                            "extra_flag": True}),
+    "non-dict items": with_items("sofa", 3, None, sofa(1)),
+    "unnamed item": with_items({"quantity": 4}, {"name": "", "quantity": 2}, sofa(1)),
+    "unknown item": with_items({"name": "Antique spaceship", "quantity": 2}, sofa(1)),
+    "empty items": with_items(),
+    "items none": {"room_type": "Kitchen", "items": None},
+    "items missing": {"room_type": "Kitchen"},
+    "flags not a dict": {"items": [sofa(1)], "complexity_flags": ["false_ceiling"]},
+}
+
+
+@pytest.mark.parametrize("region, city_tier", [(None, None), ("mumbai", None), (None, "tier_3"), ("kolkata", "tier_1")])
+def test_batch_matches_calculate_estimate(catalog, vision, region, city_tier):
+    inputs = list(CASES.values()) + [vision]
+
+    batch = calculate_estimates_batch(inputs, catalog, chunk_size=4, region=region, city_tier=city_tier)
+
+    assert len(batch) == len(inputs)
+    for name, analysis, estimate in zip(list(CASES) + ["fixture"], inputs, batch):
+        expected = totals_only(calculate_estimate(analysis, catalog, region=region, city_tier=city_tier))
+        try:
+            assert_identical(estimate, expected)
+        except AssertionError as e:
+            raise AssertionError(f"{name}: {e}") from None
+
+
+def test_batch_accepts_typed_analyses(catalog, vision):
+    from utils.models import VisionAnalysis
+
+    typed = VisionAnalysis.from_dict(vision)
+    assert calculate_estimates_batch([typed], catalog) == calculate_estimates_batch([vision], catalog)
+
+
+def test_string_flag_false_adds_no_labor(catalog):
+    [estimate] = calculate_estimates_batch([CASES["string flags"]], catalog)
+    assert estimate["standard"]["labor_percent"] == pytest.approx(0.20)
+
+
+@pytest.mark.parametrize("name", ["fixture", "string quantity", "float quantity", "string flags", "non-dict items",
+                                  "items none"])
+@pytest.mark.parametrize("city_tier", [None, "tier_1"])
+def test_compare_regions_matches_calculate_estimate(catalog, vision, name, city_tier):
+    analysis = vision if name == "fixture" else CASES[name]
+    regions, _stack = catalog.region_stack(city_tier)
+
+    comparison = compare_regions(analysis, catalog, city_tier=city_tier)
+
+    assert sorted(comparison) == sorted(regions)
+    for region in regions:
+        expected = totals_only(calculate_estimate(analysis, catalog, region=region, city_tier=city_tier))
+        assert_identical(comparison[region], expected)
@@ -0,0 +1,182 @@
+import json
+import os
+
+import pytest
+
+from utils.catalog_store import Catalog, CatalogStore, UnknownRegionError, catalog_store
+from utils.pipeline import Pipeline
+
+PRICES = {
+    "sofa_3_seater": {"economy": 18000, "standard": 35000, "premium": 80000},
+    "area_rug": {"economy": 3000, "standard": 7000, "premium": 15000},
+}
+MULTIPLIERS = {"regions": {"mumbai": 1.25, "Delhi NCR": 1.15}, "city_tiers": {"tier_1": 1.1, "tier_3": 0.9}}
+
+
+def write_json(path, data, mtime=None):
+    path.write_text(json.dumps(data))
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def catalog():
+    return Catalog.from_dict(PRICES, regions=MULTIPLIERS["regions"], city_tiers=MULTIPLIERS["city_tiers"])
+
+
+def test_base_prices_without_a_region(catalog):
+    assert catalog.get_prices("sofa_3_seater") == (18000, 35000, 80000)
+    assert catalog.get_prices("unknown") is None
+    assert catalog.price("unknown", "standard", "mumbai") == 0
+
+
+def test_region_and_city_tier_multipliers_are_applied(catalog):
+    assert catalog.get_prices("sofa_3_seater", "mumbai") == (22500, 43750, 100000)
+    assert catalog.get_prices("sofa_3_seater", city_tier="tier_3") == (16200, 31500, 72000)
+    # base x region x tier, rounded to the rupee
+    assert catalog.get_prices("area_rug", "mumbai", "tier_1") == (4125, 9625, 20625)
+    assert catalog.price("area_rug", "premium", "delhi_ncr") == round(15000 * 1.15)
+
+
+def test_region_names_are_normalized(catalog):
+    assert catalog.get_prices("area_rug", "Delhi NCR") == catalog.get_prices("area_rug", "delhi-ncr")
+    assert catalog.get_prices("area_rug", " MUMBAI ", "Tier 1") == catalog.get_prices("area_rug", "mumbai", "tier_1")
+
+
+def test_integral_tiers_stay_integral_and_fractional_ones_keep_paise():
+    catalog = Catalog.from_dict({"paint": {"economy": 12.5, "standard": 20, "premium": 31.5}},
+                                regions={"mumbai": 1.1})
+
+    prices = catalog.get_prices("paint", "mumbai")
+    assert prices == pytest.approx((13.75, 22, 34.65))
+    assert [type(price) for price in prices] == [float, int, float]
+
+
+@pytest.mark.parametrize("region, city_tier, message", [
+    ("atlantis", None, "Unknown region 'atlantis'"),
+    ("atlantis", "tier_1", "Unknown region 'atlantis'"),
+    (None, "tier_9", "Unknown city tier 'tier_9'"),
+    ("mumbai", "tier_9", "Unknown city tier 'tier_9'"),
+])
+def test_unknown_region_or_city_tier(catalog, region, city_tier, message):
+    with pytest.raises(UnknownRegionError, match=message):
+        catalog.columns_for(region, city_tier)
+
+
+@pytest.fixture
+def files(tmp_path):
+    prices, regions = tmp_path / "catalog_prices.json", tmp_path / "region_multiplier.json"
+    write_json(prices, PRICES, mtime=1_000_000)
+    write_json(regions, MULTIPLIERS, mtime=1_000_000)
+    return prices, regions
+
+
+def test_store_reuses_the_snapshot_while_files_are_unchanged(files):
+    prices, regions = files
+    store = CatalogStore(str(prices), check_interval=0, region_path=str(regions))
+
+    assert store.get() is store.get()
+
+
+def test_store_reloads_when_the_catalog_changes(files):
+    prices, regions = files
+    store = CatalogStore(str(prices), check_interval=0, region_path=str(regions))
+    first = store.get()
+
+    write_json(prices, {**PRICES, "vase": {"economy": 500, "standard": 900, "premium": 2000}}, mtime=1_000_100)
+
+    assert store.get() is not first
+    assert "vase" in store.get()
+
+
+def test_store_reloads_when_the_multipliers_change(files):
+    prices, regions = files
+    store = CatalogStore(str(prices), check_interval=0, region_path=str(regions))
+    assert store.get().get_prices("sofa_3_seater", "mumbai")[0] == 22500
+
+    write_json(regions, {"regions": {"mumbai": 1.5}, "city_tiers": {}}, mtime=1_000_100)
+
+    assert store.get().get_prices("sofa_3_seater", "mumbai")[0] == 27000
+
+
+def test_store_checks_at_most_once_per_interval(files):
+    prices, regions = files
+    store = CatalogStore(str(prices), check_interval=3600, region_path=str(regions))
+    first = store.get()
+
+    write_json(prices, {}, mtime=1_000_100)
+
+    assert store.get() is first
+
+
+def test_store_keeps_the_last_good_snapshot_on_a_bad_file(files):
+    prices, regions = files
+    store = CatalogStore(str(prices), check_interval=0, region_path=str(regions))
+    first = store.get()
+
+    prices.write_text('{"sofa_3_seater": {"econ')
+    os.utime(prices, (1_000_100, 1_000_100))
+
+    assert store.get() is first
+
+
+def test_store_without_a_multiplier_file_serves_base_prices(files, tmp_path):
+    prices, _ = files
+    store = CatalogStore(str(prices), check_interval=0, region_path=str(tmp_path / "missing.json"))
+
+    assert store.get().get_prices("sofa_3_seater") == (18000, 35000, 80000)
+    with pytest.raises(UnknownRegionError):
+        store.get().columns_for("mumbai")
+
+
+@pytest.fixture
+def no_model_calls(monkeypatch):
+    """
+    Fails the test if a request gets as far as the pipeline or the vision model.
+    """
+    import agent.vision_reader
+
+    def called(*args, **kwargs):
+        raise AssertionError("model call made before the region was checked")
+
+    monkeypatch.setattr(Pipeline, "run", called)
+    monkeypatch.setattr(agent.vision_reader, "analyze_image", called)
+    monkeypatch.setattr(agent.vision_reader, "stream_analysis", called)
+
+
+@pytest.mark.parametrize("path", ["/api/v1/estimate", "/api/v1/full-analysis", "/api/v1/estimate/stream",
+                                  "/api/v1/batch-analysis"])
+@pytest.mark.parametrize("query", ["region=atlantis", "city_tier=tier_9"])
+def test_endpoints_reject_an_unknown_region_before_any_model_call(no_model_calls, path, query):
+    from fastapi.testclient import TestClient
+    import app_fastapi
+
+    response = TestClient(app_fastapi.app).post(f"{path}?{query}", files={"file": ("room.jpg", b"jpeg bytes")})
+
+    assert response.status_code == 400
+    assert "Unknown" in response.json()["detail"]
+
+
+def test_run_analysis_rejects_an_unknown_region_before_any_model_call(no_model_calls):
+    from utils.analysis_pipeline import run_analysis
+
+    with pytest.raises(UnknownRegionError):
+        run_analysis(b"jpeg bytes", region="atlantis")
+
+
+def test_region_comparison_rejects_an_unknown_city_tier():
+    from fastapi.testclient import TestClient
+    import app_fastapi
+
+    response = TestClient(app_fastapi.app).post("/api/v1/region-comparison",
+                                                json={"vision_analysis": {"items": []}, "city_tier": "tier_9"})
+
+    assert response.status_code == 400
+
+
+def test_shipped_multipliers_cover_every_region_and_tier():
+    catalog = catalog_store.get()
+
+    for region in catalog.regions:
+        for city_tier in [None, *catalog.city_tiers]:
+            assert catalog.columns_for(region, city_tier)
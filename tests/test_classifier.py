@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from utils import classifier
+from utils.result_cache import ResultCache
+
+ANALYSIS = {
+    "room_type": "Living Room",
+    "style_guess": "Modern",
+    "quality_tier_guess": {"tier": "mid", "confidence": 0.7},
+    "items": [{"name": "Sofa", "category": "furniture", "quantity": 1, "material_guess": "Linen"}],
+    "complexity_flags": {"false_ceiling": True},
+}
+
+ANSWER = {
+    "project_type": "Residential",
+    "complexity_level": "Medium",
+    "estimated_timeline_weeks": "4",
+    "risk_factors": ["Lead time on upholstery"],
+    "item_prioritization": [{"item_name": "Sofa", "priority": "High", "rationale": "Focal piece"}],
+}
+
+
+@pytest.fixture
+def model_calls(monkeypatch):
+    calls = []
+
+    def fake_generate_content(model_name, prompt, **kwargs):
+        calls.append(prompt)
+        return type("FakeResponse", (), {"text": "```json\n" + json.dumps(ANSWER) + "\n```"})()
+
+    monkeypatch.setattr(classifier, "generate_content", fake_generate_content)
+    monkeypatch.setattr(classifier, "classification_cache", ResultCache(db_path=None))
+    return calls
+
+
+def test_classify_project_returns_a_plain_dict(model_calls):
+    result = classifier.classify_project(ANALYSIS, api_key_override="test-key")
+
+    assert type(result) is dict
+    assert result["project_type"] == "Residential"
+    assert result["estimated_timeline_weeks"] == 4
+    assert json.loads(json.dumps(result)) == result
+
+
+def test_cache_hit_returns_an_equal_independent_dict(model_calls):
+    first = classifier.classify_project(ANALYSIS, api_key_override="test-key")
+    first["risk_factors"].append("mutated by the caller")
+
+    second = classifier.classify_project(ANALYSIS, api_key_override="test-key")
+
+    assert len(model_calls) == 1
+    assert type(second) is dict
+    assert second["risk_factors"] == ["Lead time on upholstery"]
+
+
+def test_malformed_answer_is_an_error_and_not_cached(model_calls, monkeypatch):
+    monkeypatch.setattr(classifier, "generate_content",
+                        lambda *args, **kwargs: type("FakeResponse", (), {"text": '{"project_type": "x"}'})())
+
+    result = classifier.classify_project(ANALYSIS, api_key_override="test-key")
+
+    assert "error" in result
+    assert classifier.classification_cache.get_stats()["memory_entries"] == 0
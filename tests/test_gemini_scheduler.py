@@ -0,0 +1,271 @@
+import pytest
+
+from tests.fakes import FakeClock, FakeGeminiProvider, RateLimitError
+from utils import gemini_scheduler as gemini_scheduler_module
+from utils.gemini_scheduler import GeminiScheduler, SchedulerDeadlineError, is_rate_limit, retry_after_seconds
+
+MODEL = "models/gemini-test"
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def make_scheduler(clock, **kwargs):
+    kwargs.setdefault("rpm", 60)
+    kwargs.setdefault("tpm", 1_000_000)
+    kwargs.setdefault("model_limits", {})
+    kwargs.setdefault("default_deadline", 600)
+    return GeminiScheduler(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_calls_within_quota_do_not_wait(clock):
+    scheduler = make_scheduler(clock, rpm=5)
+
+    for _ in range(5):
+        scheduler.call(lambda: "ok", "key", MODEL)
+
+    assert clock.sleeps == []
+    assert scheduler.stats["calls"] == 5
+
+
+def test_calls_over_the_rpm_quota_wait_their_turn(clock):
+    scheduler = make_scheduler(clock, rpm=2)
+
+    for _ in range(4):
+        scheduler.call(lambda: "ok", "key", MODEL)
+
+    # 2 requests per minute refill one every 30s
+    assert clock.sleeps == pytest.approx([30, 30])
+    assert scheduler.get_stats()["waited_s"] == pytest.approx(60)
+
+
+def test_token_quota_spaces_large_calls(clock):
+    scheduler = make_scheduler(clock, tpm=6000)
+
+    scheduler.call(lambda: "ok", "key", MODEL, estimated_tokens=6000)
+    scheduler.call(lambda: "ok", "key", MODEL, estimated_tokens=3000)
+
+    assert clock.sleeps == pytest.approx([30])
+
+
+def test_quotas_are_per_key_and_per_model(clock):
+    scheduler = make_scheduler(clock, rpm=1, model_limits={"models/other": {"rpm": 1}})
+
+    scheduler.call(lambda: "ok", "key-a", MODEL)
+    scheduler.call(lambda: "ok", "key-b", MODEL)
+    scheduler.call(lambda: "ok", "key-a", "models/other")
+
+    assert clock.sleeps == []
+    assert scheduler.get_stats()["buckets"] == 3
+
+
+def test_call_is_shed_when_the_quota_wait_passes_the_deadline(clock):
+    scheduler = make_scheduler(clock, rpm=1)
+    calls = []
+    scheduler.call(lambda: "ok", "key", MODEL)
+
+    with pytest.raises(SchedulerDeadlineError) as excinfo:
+        scheduler.call(lambda: calls.append(1), "key", MODEL, deadline=clock() + 10)
+
+    assert calls == []
+    assert excinfo.value.wait == pytest.approx(60)
+    assert scheduler.stats["shed"] == 1
+
+
+def test_429_waits_for_retry_after_then_succeeds(clock):
+    scheduler = make_scheduler(clock)
+    provider = FakeGeminiProvider(rpm=1, clock=clock, response="second")
+    scheduler.call(provider.generate_content, "key", MODEL)
+    clock.now = 45
+
+    response = scheduler.call(provider.generate_content, "key", MODEL)
+
+    assert response.text == "second"
+    assert provider.rejected == 1
+    assert scheduler.stats["rate_limited"] == 1
+    assert scheduler.stats["retries"] == 1
+    # Retry-After of 15s plus up to 25% jitter
+    assert 15 <= clock.sleeps[0] <= 15 + 0.25 * 15
+    assert provider.calls[-1] >= 60
+
+
+def test_429_without_a_hint_backs_off_exponentially(clock, monkeypatch):
+    monkeypatch.setattr("utils.gemini_scheduler.random.uniform", lambda low, high: high)
+    scheduler = make_scheduler(clock, backoff_base=2, backoff_max=5, max_retries=4)
+    failures = [RateLimitError()] * 3
+
+    def fn():
+        if failures:
+            raise failures.pop()
+        return "ok"
+
+    assert scheduler.call(fn, "key", MODEL) == "ok"
+    backoffs = [s for s in clock.sleeps if s >= 1]
+    assert backoffs == pytest.approx([2, 4, 5])
+
+
+def test_429_pauses_the_key_for_other_callers(clock, monkeypatch):
+    monkeypatch.setattr("utils.gemini_scheduler.random.uniform", lambda low, high: low)
+    scheduler = make_scheduler(clock, rpm=600)
+
+    def limited():
+        raise RateLimitError(retry_after=20)
+
+    with pytest.raises(SchedulerDeadlineError):
+        scheduler.call(limited, "key", MODEL, deadline=clock() + 5)
+
+    scheduler.call(lambda: "ok", "other-key", MODEL)
+    assert clock.sleeps == []
+    scheduler.call(lambda: "ok", "key", MODEL)
+    assert clock.sleeps == pytest.approx([20])
+
+
+def test_retry_that_would_pass_the_deadline_is_shed(clock):
+    scheduler = make_scheduler(clock)
+
+    def fn():
+        raise RateLimitError(retry_after=30)
+
+    with pytest.raises(SchedulerDeadlineError):
+        scheduler.call(fn, "key", MODEL, deadline=clock() + 10)
+    assert clock.sleeps == []
+
+
+def test_retries_stop_after_max_retries(clock):
+    scheduler = make_scheduler(clock, max_retries=2)
+    attempts = []
+
+    def fn():
+        attempts.append(1)
+        raise RateLimitError(retry_after=1)
+
+    with pytest.raises(RateLimitError):
+        scheduler.call(fn, "key", MODEL)
+    assert len(attempts) == 3
+    assert scheduler.stats["failed"] == 1
+
+
+def test_non_retryable_errors_are_raised_at_once(clock):
+    scheduler = make_scheduler(clock)
+    attempts = []
+
+    def fn():
+        attempts.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        scheduler.call(fn, "key", MODEL)
+    assert attempts == [1]
+    assert clock.sleeps == []
+
+
+def test_reconcile_returns_unused_tokens(clock):
+    scheduler = make_scheduler(clock, tpm=10_000)
+    provider = FakeGeminiProvider(rpm=100, clock=clock, total_tokens=1000)
+
+    scheduler.call(provider.generate_content, "key", MODEL, estimated_tokens=10_000)
+    scheduler.call(provider.generate_content, "key", MODEL, estimated_tokens=9000)
+
+    assert clock.sleeps == []
+
+
+def tokens_left(scheduler, api_key="key"):
+    return scheduler._buckets[scheduler._bucket_key(api_key, MODEL)][1].tokens
+
+
+@pytest.mark.parametrize("error", [ConnectionError("503 Service Unavailable"), RateLimitError(retry_after=1),
+                                   ValueError("400 Bad Request")])
+def test_failed_attempts_give_their_tokens_back(clock, error):
+    scheduler = make_scheduler(clock, tpm=10_000, max_retries=2, backoff_base=0)
+
+    def failing():
+        raise error
+
+    with pytest.raises(type(error)):
+        scheduler.call(failing, "key", MODEL, estimated_tokens=9000)
+
+    # None of the attempts, retried or final, keeps its 9000-token reservation
+    assert tokens_left(scheduler) == pytest.approx(10_000)
+
+
+def test_a_retried_call_is_charged_once(clock):
+    scheduler = make_scheduler(clock, tpm=10_000, backoff_base=0)
+    attempts = []
+
+    def flaky():
+        attempts.append(clock())
+        if len(attempts) < 3:
+            raise ConnectionError("503 Service Unavailable")
+        return "ok"
+
+    assert scheduler.call(flaky, "key", MODEL, estimated_tokens=4000) == "ok"
+
+    assert len(attempts) == 3
+    assert tokens_left(scheduler) == pytest.approx(6000)
+
+
+@pytest.mark.parametrize("error, expected", [
+    (RateLimitError(retry_after=7), 7.0),
+    (Exception("429 Quota exceeded. Please retry in 12.5s."), 12.5),
+    (Exception("429 quota exceeded retry_delay { seconds: 41 }"), 41.0),
+    (Exception("429 quota exceeded"), None),
+])
+def test_retry_after_seconds(error, expected):
+    assert retry_after_seconds(error) == expected
+
+
+def test_is_rate_limit():
+    assert is_rate_limit(RateLimitError())
+    assert is_rate_limit(type("ResourceExhausted", (Exception,), {})("quota"))
+    assert not is_rate_limit(ValueError("bad request"))
+
+
+def test_request_timeout_is_what_is_left_after_the_quota_wait(clock, monkeypatch):
+    scheduler = make_scheduler(clock, rpm=1)
+    seen = []
+
+    class FakeModel:
+        def generate_content(self, contents, **kwargs):
+            seen.append(kwargs.get("request_options"))
+            return type("FakeResponse", (), {"usage_metadata": None})()
+
+    monkeypatch.setattr(gemini_scheduler_module, "gemini_scheduler", scheduler)
+    monkeypatch.setattr(gemini_scheduler_module, "time", type("FakeTime", (), {"monotonic": staticmethod(clock)}))
+    monkeypatch.setattr(gemini_scheduler_module, "resolve_api_key", lambda override=None: "key")
+    monkeypatch.setattr(gemini_scheduler_module, "get_pooled_model", lambda name, override=None: FakeModel())
+
+    gemini_scheduler_module.generate_content(MODEL, "prompt", deadline=clock() + 100)
+    gemini_scheduler_module.generate_content(MODEL, "prompt", deadline=clock() + 100)
+
+    # The second call waited 60s for quota, so only 40s of its 100s remain for the request
+    assert [options["timeout"] for options in seen] == pytest.approx([100, 40])
+
+
+def test_abandoned_stream_still_reconciles_its_tokens(clock, monkeypatch):
+    scheduler = make_scheduler(clock, tpm=10_000)
+
+    class FakeStream:
+        usage_metadata = type("FakeUsage", (), {"total_token_count": 1000, "prompt_token_count": 900,
+                                                "candidates_token_count": 100})()
+
+        def __iter__(self):
+            for text in ('{"items": [', '{"name": "Sofa"}', "]}"):
+                yield type("FakeChunk", (), {"text": text})()
+
+    class FakeModel:
+        def generate_content(self, contents, **kwargs):
+            return FakeStream()
+
+    monkeypatch.setattr(gemini_scheduler_module, "gemini_scheduler", scheduler)
+    monkeypatch.setattr(gemini_scheduler_module, "resolve_api_key", lambda override=None: "key")
+    monkeypatch.setattr(gemini_scheduler_module, "get_pooled_model", lambda name, override=None: FakeModel())
+
+    stream = gemini_scheduler_module.stream_content(MODEL, "prompt", output_tokens=9000)
+    next(stream)
+    stream.close()  # what a client disconnect does to the generator
+
+    # Only 1000 of the ~9000 reserved tokens were used, so a second large call need not wait
+    scheduler.call(lambda: "ok", "key", MODEL, estimated_tokens=9000)
+    assert clock.sleeps == []
@@ -0,0 +1,41 @@
+import pytest
+
+from utils.genai_pool import GenaiInternals, ModelPool
+
+
+@pytest.mark.parametrize("version", ["0.3.0", "0.8.6"])
+def test_supported_versions_are_accepted(version):
+    GenaiInternals(version)
+
+
+@pytest.mark.parametrize("version", ["0.2.9", "0.9.0", "1.0.0"])
+def test_unsupported_versions_fail_loudly(version):
+    with pytest.raises(RuntimeError, match=version):
+        GenaiInternals(version)
+
+
+def test_models_are_bound_to_a_transport_per_key(monkeypatch):
+    monkeypatch.setenv("GOOGLE_API_KEY", "server-key")
+    pool = ModelPool(max_keys=4)
+
+    server = pool.get("models/test")
+    assert pool.get("models/test") is server
+    user = pool.get("models/test", "user-key")
+
+    assert user is not server
+    assert user._client is not server._client
+    assert pool.get("models/other", "user-key")._client is user._client
+    assert pool.get_stats() == {"hits": 1, "misses": 3, "evictions": 0, "keys": 2, "models": 3}
+
+
+def test_user_keys_are_evicted_but_the_server_key_is_kept(monkeypatch):
+    monkeypatch.setenv("GOOGLE_API_KEY", "server-key")
+    pool = ModelPool(max_keys=2)
+
+    server = pool.get("models/test")
+    pool.get("models/test", "user-a")
+    pool.get("models/test", "user-b")
+
+    assert pool.get("models/test") is server
+    assert pool.get_stats()["evictions"] == 1
+    assert pool.get_stats()["keys"] == 2
@@ -0,0 +1,138 @@
+import base64
+import json
+import threading
+
+import pytest
+
+from tests.fakes import StubBackend
+from utils import history, supabase_handler
+from utils.history import HistoryCache, InvalidCursorError, decode_cursor, encode_cursor
+from utils.persistence_queue import PersistenceQueue
+
+
+def raw_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def test_cursor_round_trip():
+    row = {"created_at": "2026-01-02T03:04:05.123456+00:00", "id": 42}
+
+    assert decode_cursor(encode_cursor(row)) == ("2026-01-02T03:04:05.123456+00:00", 42)
+    assert decode_cursor(None) is None
+    assert decode_cursor("") is None
+
+
+def test_cursor_timestamp_is_reserialized():
+    assert decode_cursor(raw_cursor(["2026-01-02 03:04:05", 7])) == ("2026-01-02T03:04:05", 7)
+
+
+@pytest.mark.parametrize("cursor", [
+    raw_cursor(["2026-01-02T03:04:05", "7"]),
+    raw_cursor(["2026-01-02T03:04:05", 7.0]),
+    raw_cursor(["2026-01-02T03:04:05", True]),
+    raw_cursor(["2026-01-02T03:04:05,id.gt.0", 7]),
+    raw_cursor(["yesterday", 7]),
+    raw_cursor([20260102, 7]),
+    raw_cursor(["2026-01-02T03:04:05"]),
+    raw_cursor({"created_at": "2026-01-02T03:04:05", "id": 7}),
+    encode_cursor({"created_at": "2026-01-02T03:04:05", "id": 7})[:-3],
+    "not base64 !",
+], ids=["string-id", "float-id", "bool-id", "filter-injection", "non-iso", "numeric-date",
+        "short", "object", "truncated", "garbage"])
+def test_tampered_cursors_are_rejected(cursor):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor)
+
+
+def test_cache_serves_repeat_reads():
+    cache = HistoryCache()
+    loads = []
+
+    for _ in range(3):
+        assert cache.get_or_load("u1", "page", lambda: loads.append(1) or {"items": []}) == {"items": []}
+
+    assert len(loads) == 1
+    assert cache.get_stats()["hits"] == 2
+
+
+def test_cache_entries_expire():
+    cache = HistoryCache(ttl=0)
+    loads = []
+
+    cache.get_or_load("u1", "page", lambda: loads.append(1))
+    cache.get_or_load("u1", "page", lambda: loads.append(1))
+
+    assert len(loads) == 2
+
+
+def test_cache_evicts_the_least_recently_read_user():
+    cache = HistoryCache(max_users=2)
+    for user_id in ("u1", "u2", "u1", "u3"):
+        cache.get_or_load(user_id, "page", lambda: "page")
+
+    assert cache.get_stats()["users"] == 2
+    assert cache.get_or_load("u2", "page", lambda: "reloaded") == "reloaded"
+
+
+def test_a_persisted_row_invalidates_only_its_users_pages(tmp_path):
+    cache = HistoryCache()
+    q = PersistenceQueue(StubBackend(), spool_path=str(tmp_path / "spool.jsonl"), sleep=lambda seconds: None)
+    q.add_listener(cache.invalidate_rows)
+    cache.get_or_load("u1", "page", lambda: "old u1")
+    cache.get_or_load("u2", "page", lambda: "old u2")
+
+    try:
+        q.enqueue({"user_id": "u1", "room_type": "kitchen"})
+        q.enqueue({"user_id": None, "room_type": "anonymous"})
+        assert q.flush(timeout=5)
+    finally:
+        q.close(timeout=5)
+
+    assert cache.get_or_load("u1", "page", lambda: "new u1") == "new u1"
+    assert cache.get_or_load("u2", "page", lambda: "new u2") == "old u2"
+    assert cache.get_stats()["invalidations"] == 1
+
+
+def test_a_read_racing_an_invalidation_is_not_cached():
+    cache = HistoryCache()
+    loading, invalidated = threading.Event(), threading.Event()
+    result = {}
+
+    def slow_load():
+        loading.set()
+        invalidated.wait(5)
+        return "fetched before the write"
+
+    reader = threading.Thread(target=lambda: result.update(page=cache.get_or_load("u1", "page", slow_load)))
+    reader.start()
+    loading.wait(5)
+    cache.invalidate_rows([{"user_id": "u1"}])
+    invalidated.set()
+    reader.join(5)
+
+    # The racing reader still gets its answer, but the next read goes back to the database
+    assert result["page"] == "fetched before the write"
+    assert cache.get_or_load("u1", "page", lambda: "fetched after the write") == "fetched after the write"
+
+
+def test_history_pages_follow_the_cursor(monkeypatch):
+    rows = [{"id": i, "created_at": f"2026-01-01T00:00:{59 - i:02d}+00:00", "room_type": "kitchen",
+             "standard_total": i * 100} for i in range(5)]
+    calls = []
+
+    def fake_page(user_id, limit, before):
+        calls.append(before)
+        start = 0 if before is None else next(i for i, row in enumerate(rows) if row["id"] == before[1]) + 1
+        return rows[start:start + limit + 1]
+
+    monkeypatch.setattr(history, "history_cache", HistoryCache())
+    monkeypatch.setattr(supabase_handler, "get_user_history_page", fake_page)
+
+    first = history.get_history_page("u1", limit=2)
+    second = history.get_history_page("u1", limit=2, cursor=first["next_cursor"])
+    last = history.get_history_page("u1", limit=2, cursor=second["next_cursor"])
+
+    assert [item["id"] for item in first["items"] + second["items"] + last["items"]] == [0, 1, 2, 3, 4]
+    assert last["next_cursor"] is None
+    assert first["items"][1]["totals"] == {"economy": None, "standard": 100, "premium": None}
+    assert calls[1] == ("2026-01-01T00:00:58+00:00", 1)
@@ -0,0 +1,160 @@
+import base64
+import os
+import threading
+
+import pytest
+
+import utils.image_store
+import utils.supabase_handler
+
+from utils.image_store import ImageStore
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+def chunked(data, size=16):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ImageStore(directory=str(tmp_path), max_bytes=10_000, max_stream_bytes=1_000)
+
+
+def test_put_is_content_addressed_and_deduplicated(store):
+    name = store.put(PNG)
+
+    assert name.endswith(".png")
+    assert store.put(PNG) == name
+    assert store.get_stats()["stored"] == 1
+    assert store.get_stats()["deduped"] == 1
+    with open(store.path_for(name), "rb") as f:
+        assert f.read() == PNG
+
+
+def test_put_stream_matches_put(store):
+    assert store.put_stream(chunked(PNG)) == store.put(PNG)
+    assert store.get_stats()["deduped"] == 1
+
+
+def test_put_stream_rejects_oversized_images_and_cleans_up(store, tmp_path):
+    read = []
+
+    def endless():
+        while True:
+            read.append(1)
+            yield PNG
+
+    with pytest.raises(ValueError):
+        store.put_stream(endless())
+
+    # Stopped right after passing the cap instead of draining the stream
+    assert len(read) * len(PNG) <= store.max_stream_bytes + len(PNG)
+    assert os.listdir(tmp_path) == []
+    assert store.get_stats()["oversized"] == 1
+
+
+def test_put_stream_rejects_empty_streams(store, tmp_path):
+    with pytest.raises(ValueError):
+        store.put_stream(iter([]))
+    assert os.listdir(tmp_path) == []
+
+
+def test_oldest_images_are_evicted_past_max_bytes(store):
+    names = [store.put(PNG + bytes([i]) * 3000) for i in range(4)]
+
+    assert store.path_for(names[0]) is None
+    assert all(store.path_for(name) for name in names[1:])
+    assert store.get_stats()["bytes"] <= store.max_bytes
+
+
+def test_index_is_rebuilt_from_the_directory(store, tmp_path):
+    name = store.put(PNG)
+
+    reopened = ImageStore(directory=str(tmp_path))
+    assert reopened.path_for(name) is not None
+    assert reopened.path_for("../etc/passwd") is None
+
+
+def test_put_writes_outside_the_store_lock(store, monkeypatch):
+    writing, release = threading.Event(), threading.Event()
+    real_open = open
+
+    class SlowFile:
+        def __init__(self, f):
+            self.f = f
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.f.close()
+
+        def write(self, data):
+            writing.set()
+            release.wait(5)
+            return self.f.write(data)
+
+    other = store.put(PNG + b"other")
+    monkeypatch.setattr(utils.image_store, "open", lambda path, mode: SlowFile(real_open(path, mode)),
+                        raising=False)
+    writer = threading.Thread(target=store.put, args=(PNG,))
+    writer.start()
+    assert writing.wait(5)
+
+    # Lookups and stats go ahead while the write is still in progress
+    assert store.path_for(other) is not None
+    assert store.get_stats()["files"] == 1
+
+    release.set()
+    writer.join(5)
+    assert store.get_stats()["files"] == 2
+
+
+def test_local_delivery_serves_from_this_process(tmp_path):
+    store = ImageStore(directory=str(tmp_path), delivery="local")
+    name = store.put(PNG)
+
+    assert store.public_url(name) == f"/api/v1/images/{name}"
+
+
+def test_vercel_without_supabase_inlines_images(tmp_path, monkeypatch):
+    monkeypatch.setenv("VERCEL", "1")
+    monkeypatch.setattr(utils.supabase_handler, "supabase", None)
+    store = ImageStore(directory=str(tmp_path))
+    name = store.put(PNG)
+
+    url = store.public_url(name)
+    assert store.delivery_mode() == "inline"
+    assert url.startswith("data:image/png;base64,")
+    assert base64.b64decode(url.split(",", 1)[1]) == PNG
+
+
+def test_vercel_with_supabase_uploads_once_by_content_hash(tmp_path, monkeypatch):
+    uploads = []
+
+    def upload(bucket, name, data, content_type):
+        uploads.append((bucket, name, data, content_type))
+        return f"https://storage.example/{bucket}/{name}"
+
+    monkeypatch.setenv("VERCEL", "1")
+    monkeypatch.setattr(utils.supabase_handler, "supabase", object())
+    monkeypatch.setattr(utils.supabase_handler, "upload_public_object", upload)
+    store = ImageStore(directory=str(tmp_path), bucket="images")
+    name = store.put(PNG)
+
+    assert store.public_url(name) == f"https://storage.example/images/{name}"
+    assert store.public_url(store.put(PNG)) == f"https://storage.example/images/{name}"
+    assert uploads == [("images", name, PNG, "image/png")]
+
+
+def test_failed_upload_falls_back_to_inline(tmp_path, monkeypatch):
+    def upload(*args):
+        raise ConnectionError("storage down")
+
+    monkeypatch.setattr(utils.supabase_handler, "upload_public_object", upload)
+    store = ImageStore(directory=str(tmp_path), delivery="supabase")
+    name = store.put(PNG)
+
+    assert store.public_url(name).startswith("data:image/png;base64,")
+    assert store.get_stats()["inlined"] == 1
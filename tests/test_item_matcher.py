@@ -0,0 +1,109 @@
+import json
+
+import pytest
+
+from utils.item_matcher import ITEM_RULES_PATH, ItemMatcher
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return ItemMatcher.from_file(ITEM_RULES_PATH)
+
+
+@pytest.mark.parametrize("name, key", [
+    ("Hydraulic door closer", "door_closer"),
+    ("Brass door handle", "hardware_set"),
+    ("Cabinet pull", "hardware_set"),
+    ("Glass door", "commercial_door"),
+    ("Sofa table", "sofa_3_seater"),
+    ("Coffee table", "coffee_table"),
+    ("Side table", None),
+    ("Carpet tiles", "area_rug"),
+    ("Floor lamp", "ceiling_light"),
+    ("Wooden flooring", "flooring_sqft"),
+    ("Ceiling light", "ceiling_light"),
+    ("False ceiling", "acoustic_ceiling_sqft"),
+    ("Wall cladding panels", "wall_paneling_sqft"),
+    ("Wall panel", "wall_paneling_sqft"),
+    ("Acoustic panel", None),
+    ("Projection screen", "projector_screen"),
+    ("Ceiling speaker", "acoustic_ceiling_sqft"),
+    ("Motion sensor", "sensor_device"),
+    ("VELVET SOFA", "sofa_3_seater"),
+    ("Bookshelf", None),
+    ("", None),
+    (None, None),
+])
+def test_catalog_rules_keep_the_original_priorities(matcher, name, key):
+    assert matcher.match(name)[0] == key
+
+
+def test_score_is_the_share_of_the_name_covered(matcher):
+    assert matcher.match("sofa") == ("sofa_3_seater", 1.0)
+    assert matcher.match("velvet sofa") == ("sofa_3_seater", round(4 / 11, 3))
+    assert matcher.match("vase") == (None, 0.0)
+
+
+def test_exclude_keywords_stop_a_rule_from_firing():
+    matcher = ItemMatcher([
+        {"key": "dining_table", "match": [["table"]], "exclude": ["coffee", "side"]},
+        {"key": "coffee_table", "match": [["table"], ["coffee"]]},
+    ])
+
+    assert matcher.match("Oak dining table")[0] == "dining_table"
+    assert matcher.match("Oak coffee table")[0] == "coffee_table"
+    # Excluded, and no other rule has all its groups
+    assert matcher.match("Oak side table")[0] is None
+
+
+def test_explicit_priority_overrides_file_order():
+    matcher = ItemMatcher([
+        {"key": "commercial_door", "match": [["door"]]},
+        {"key": "door_closer", "match": [["closer"]], "priority": -1},
+    ])
+
+    assert matcher.match("door closer")[0] == "door_closer"
+    assert matcher.match("door")[0] == "commercial_door"
+
+
+def test_overlapping_keywords_are_all_found():
+    # "ceiling" contains "ceil"; "lamp" and "lampshade" share a prefix
+    matcher = ItemMatcher([
+        {"key": "shade", "match": [["lampshade"]]},
+        {"key": "lamp", "match": [["lamp"]]},
+        {"key": "ceil", "match": [["ceil"], ["ing"]]},
+    ])
+
+    assert matcher.match("linen lampshade")[0] == "shade"
+    assert matcher.match("desk lamp")[0] == "lamp"
+    assert matcher.match("ceiling")[0] == "ceil"
+
+
+def test_memoized_and_cold_lookups_agree(tmp_path):
+    with open(ITEM_RULES_PATH) as f:
+        rules = json.load(f)["rules"]
+    rules += [{"key": f"sku_{i}", "match": [[f"sku{i:04d}x"]]} for i in range(500)]
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"rules": rules}))
+    matcher = ItemMatcher.from_file(str(path))
+    names = [f"{adjective} {noun} {n}" for adjective in ("Oak", "Brass", "Glass")
+             for noun in ("door closer", "door handle", "coffee table", "wall panel", "sku0042x", "vase")
+             for n in range(3)]
+
+    cold = [matcher._match(name) for name in names]
+    first = [matcher.match(name) for name in names]
+    memoized = [matcher.match(name) for name in names]
+
+    assert first == cold
+    assert memoized == cold
+    assert matcher.match("sku0042x")[0] == "sku_42"
+    assert matcher.match.cache_info().hits >= len(names)
+
+
+def test_cache_size_bounds_the_memo():
+    matcher = ItemMatcher([{"key": "sofa", "match": [["sofa"]]}], cache_size=2)
+
+    for name in ("sofa 1", "sofa 2", "sofa 3"):
+        matcher.match(name)
+
+    assert matcher.match.cache_info().currsize == 2
@@ -0,0 +1,150 @@
+import json
+import threading
+import time
+
+import pytest
+
+from tests.fakes import StubBackend
+from utils.persistence_queue import PersistenceQueue
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    queues = []
+
+    def make(backend, **kwargs):
+        kwargs.setdefault("spool_path", str(tmp_path / "spool.jsonl"))
+        kwargs.setdefault("sleep", lambda seconds: None)
+        q = PersistenceQueue(backend, **kwargs)
+        queues.append(q)
+        return q
+
+    yield make
+    for q in queues:
+        q.close(timeout=5)
+
+
+def spooled_rows(q):
+    try:
+        with open(q.spool_path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def test_rows_are_coalesced_into_batches(make_queue):
+    backend = StubBackend()
+    q = make_queue(backend, batch_size=5, flush_interval=5)
+
+    for i in range(12):
+        assert q.enqueue({"id": i})
+    assert q.flush(timeout=5)
+
+    assert backend.batches == [5, 5, 2]
+    assert [row["id"] for row in backend.rows] == list(range(12))
+    assert q.get_stats()["written"] == 12
+
+
+def test_failed_insert_is_retried_with_backoff(make_queue):
+    backend = StubBackend(fail_times=2)
+    delays = []
+    q = make_queue(backend, batch_size=1, max_retries=3, backoff_base=1, backoff_max=10, sleep=delays.append)
+
+    q.enqueue({"id": 1})
+    assert q.flush(timeout=5)
+
+    assert backend.rows == [{"id": 1}]
+    assert q.stats["retries"] == 2
+    # Jittered exponential backoff: 1s then 2s, each scaled into [0.5, 1.0]
+    assert 0.5 <= delays[0] <= 1.0
+    assert 1.0 <= delays[1] <= 2.0
+    assert spooled_rows(q) == []
+
+
+def test_batch_that_keeps_failing_is_spooled_then_replayed(make_queue):
+    backend = StubBackend()
+    backend.down = True
+    q = make_queue(backend, batch_size=10, flush_interval=5, max_retries=1)
+
+    for i in range(3):
+        q.enqueue({"id": i})
+    assert q.flush(timeout=5)
+
+    assert backend.rows == []
+    assert [row["id"] for row in spooled_rows(q)] == [0, 1, 2]
+    assert q.stats["failed_batches"] >= 1
+
+    backend.down = False
+    assert q.flush(timeout=5)
+
+    assert [row["id"] for row in backend.rows] == [0, 1, 2]
+    assert q.spool_size() == 0
+    assert q.stats["replayed"] == 3
+
+
+def test_spool_left_by_a_previous_process_is_replayed(make_queue, tmp_path):
+    spool = tmp_path / "spool.jsonl"
+    spool.write_text(json.dumps({"id": "old"}) + "\n")
+    backend = StubBackend()
+    q = make_queue(backend, batch_size=1, spool_path=str(spool))
+
+    q.enqueue({"id": "new"})
+    assert q.flush(timeout=5)
+
+    assert sorted(row["id"] for row in backend.rows) == ["new", "old"]
+    assert q.spool_size() == 0
+
+
+def test_full_queue_spools_instead_of_blocking(make_queue):
+    entered, release = threading.Event(), threading.Event()
+
+    class BlockedBackend(StubBackend):
+        def insert_many(self, rows):
+            entered.set()
+            release.wait(5)
+            super().insert_many(rows)
+
+    backend = BlockedBackend()
+    q = make_queue(backend, max_queue=1, batch_size=1)
+
+    assert q.enqueue({"id": 1})
+    assert entered.wait(5)  # the worker is stuck writing row 1
+    assert q.enqueue({"id": 2})  # fills the queue
+
+    started = time.monotonic()
+    assert q.enqueue({"id": 3}) is False
+    assert time.monotonic() - started < 0.5
+    assert spooled_rows(q) == [{"id": 3}]
+
+    release.set()
+    assert q.flush(timeout=5)
+    assert sorted(row["id"] for row in backend.rows) == [1, 2, 3]
+    assert q.spool_size() == 0
+
+
+def test_close_drains_pending_rows_and_spools_later_ones(make_queue):
+    backend = StubBackend()
+    q = make_queue(backend, batch_size=50, flush_interval=5)
+
+    for i in range(4):
+        q.enqueue({"id": i})
+    q.close(timeout=5)
+
+    assert [row["id"] for row in backend.rows] == [0, 1, 2, 3]
+    assert q.enqueue({"id": 4}) is False
+    assert spooled_rows(q) == [{"id": 4}]
+
+
+def test_listeners_see_written_rows(make_queue):
+    backend = StubBackend()
+    seen = []
+    q = make_queue(backend, batch_size=2, flush_interval=5)
+    q.add_listener(seen.extend)
+    q.add_listener(lambda rows: 1 / 0)  # a failing listener does not stop the write
+
+    q.enqueue({"id": 1})
+    q.enqueue({"id": 2})
+    assert q.flush(timeout=5)
+
+    assert seen == [{"id": 1}, {"id": 2}]
+    assert backend.rows == seen
@@ -0,0 +1,194 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.pipeline import FAIL, SKIP, Pipeline, PipelineError, Stage, StageError
+
+
+@pytest.fixture
+def executor():
+    pool = ThreadPoolExecutor(max_workers=8)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def test_stages_run_after_their_dependencies(executor):
+    order = []
+    lock = threading.Lock()
+
+    def stage(name, value):
+        def fn(ctx):
+            with lock:
+                order.append(name)
+            return value(ctx)
+        return fn
+
+    pipeline = Pipeline([
+        Stage("total", stage("total", lambda ctx: ctx["a"] + ctx["b"]), deps=("a", "b")),
+        Stage("a", stage("a", lambda ctx: ctx["x"] * 2)),
+        Stage("b", stage("b", lambda ctx: ctx["x"] * 3)),
+    ], executor)
+
+    result = pipeline.run({"x": 5})
+
+    assert result["total"] == 25
+    assert order[-1] == "total"
+    assert set(result.timings_snapshot()) == {"a", "b", "total"}
+
+
+def test_independent_stages_overlap(executor):
+    barrier = threading.Barrier(2, timeout=5)
+
+    def meet(ctx):
+        barrier.wait()
+        return True
+
+    result = Pipeline([Stage("a", meet), Stage("b", meet)], executor).run()
+
+    assert (result["a"], result["b"]) == (True, True)
+
+
+def test_a_stage_sees_only_what_was_done_when_it_started(executor):
+    pipeline = Pipeline([
+        Stage("a", lambda ctx: "a"),
+        Stage("b", lambda ctx: sorted(k for k in ctx if k != "input"), deps=("a",)),
+    ], executor)
+
+    assert pipeline.run({"input": 1})["b"] == ["a"]
+
+
+def test_unknown_dependencies_and_cycles_are_rejected(executor):
+    with pytest.raises(ValueError, match="unknown"):
+        Pipeline([Stage("a", lambda ctx: 1, deps=("missing",))], executor)
+
+    cyclic = Pipeline([Stage("a", lambda ctx: 1, deps=("b",)), Stage("b", lambda ctx: 1, deps=("a",))], executor)
+    with pytest.raises(ValueError, match="cycle"):
+        cyclic.run()
+
+
+def test_fail_stage_aborts_the_run(executor):
+    ran = []
+
+    def broken(ctx):
+        raise StageError("model returned nothing")
+
+    pipeline = Pipeline([
+        Stage("vision", broken, on_error=FAIL),
+        Stage("estimate", lambda ctx: ran.append(1), deps=("vision",)),
+    ], executor)
+
+    with pytest.raises(PipelineError) as info:
+        pipeline.run()
+
+    assert info.value.stage == "vision"
+    assert isinstance(info.value.error, StageError)
+    assert info.value.result.errors == {"vision": "model returned nothing"}
+    assert ran == []
+
+
+def test_skip_stage_uses_its_default_and_continues(executor):
+    def broken(ctx):
+        raise RuntimeError("classifier down")
+
+    pipeline = Pipeline([
+        Stage("classify", broken, on_error=SKIP, default={"tier": "unknown"}),
+        Stage("report", lambda ctx: ctx["classify"]["tier"], deps=("classify",)),
+    ], executor)
+
+    result = pipeline.run()
+
+    assert result["classify"] == {"tier": "unknown"}
+    assert result["report"] == "unknown"
+    assert result.errors == {"classify": "classifier down"}
+
+
+def test_a_timed_out_stage_keeps_its_timeout_entry(executor):
+    release = threading.Event()
+    finished = threading.Event()
+
+    def slow(ctx):
+        release.wait(5)
+        finished.set()
+        return "late"
+
+    result = Pipeline([Stage("slow", slow, timeout=0.05, on_error=SKIP, default="default")], executor).run()
+    release.set()
+    finished.wait(5)
+    executor.shutdown(wait=True)
+
+    # The late result neither replaces the default nor overwrites the timing
+    assert result["slow"] == "default"
+    assert result.timings_snapshot() == {"slow": 50.0}
+    assert "timed out" in result.errors["slow"]
+
+
+def test_a_fail_stage_timeout_raises(executor):
+    release = threading.Event()
+    pipeline = Pipeline([Stage("vision", lambda ctx: release.wait(5), timeout=0.05)], executor)
+
+    try:
+        with pytest.raises(PipelineError) as info:
+            pipeline.run()
+    finally:
+        release.set()
+
+    assert isinstance(info.value.error, TimeoutError)
+
+
+def test_background_stages_do_not_block_the_result(executor):
+    release = threading.Event()
+    persisted = []
+
+    def persist(ctx):
+        release.wait(5)
+        persisted.append(ctx["estimate"])
+
+    pipeline = Pipeline([
+        Stage("estimate", lambda ctx: 100),
+        Stage("persist", persist, deps=("estimate",), background=True),
+    ], executor)
+
+    start = time.monotonic()
+    result = pipeline.run()
+
+    assert time.monotonic() - start < 2
+    assert result["estimate"] == 100
+    assert persisted == []
+    release.set()
+    executor.shutdown(wait=True)
+    assert persisted == [100]
+    assert "persist" in result.timings_snapshot()
+
+
+def test_background_failures_are_contained(executor):
+    def broken(ctx):
+        raise RuntimeError("database down")
+
+    result = Pipeline([Stage("persist", broken, background=True)], executor).run()
+    executor.shutdown(wait=True)
+
+    assert result.errors == {}
+    assert "persist" in result.timings_snapshot()
+
+
+def test_timings_snapshot_is_safe_while_a_background_stage_writes(executor):
+    stop = threading.Event()
+    pipeline = Pipeline([Stage("estimate", lambda ctx: 1)] + [
+        Stage(f"persist_{i}", lambda ctx: stop.wait(0.001), background=True, deps=("estimate",))
+        for i in range(50)
+    ], executor)
+
+    result = pipeline.run()
+    snapshots = []
+    deadline = time.monotonic() + 5
+    while len(result.timings_snapshot()) < 51 and time.monotonic() < deadline:
+        snapshot = result.timings_snapshot()
+        # Iterating a snapshot never races the writers
+        snapshots.append(sum(1 for _ in snapshot.items()))
+    executor.shutdown(wait=True)
+
+    assert snapshots == sorted(snapshots)
+    assert result.summary().count("ms") == 51
+    assert result.server_timing().count("dur=") == 51
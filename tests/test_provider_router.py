@@ -0,0 +1,224 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+from agent.provider_router import PROVIDER_CALLS, NoProviderAvailableError, Provider, ProviderRouter
+from tests.fakes import FakeClock, FakeVisionProvider
+from utils.models import VisionAnalysis
+
+RATE_LIMIT = {"error": "RATE_LIMIT", "message": "Gemini is at its rate limit. Try again in 1 minute."}
+
+
+def analysis(room_type):
+    return VisionAnalysis.from_dict({"room_type": room_type, "items": []})
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def executor():
+    pool = ThreadPoolExecutor(max_workers=4)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def make_router(providers, clock, executor, **kwargs):
+    kwargs.setdefault("hedge_delay", 5)
+    kwargs.setdefault("cooldown", 30)
+    kwargs.setdefault("trip_failures", 3)
+    kwargs.setdefault("min_samples", 5)
+    return ProviderRouter(providers, is_valid=lambda answer: isinstance(answer, VisionAnalysis),
+                          clock=clock, executor=executor, **kwargs)
+
+
+class HeldExecutor:
+    """
+    Runs the first `run_first` submissions on their own threads and holds the
+    rest unstarted in `held`, so a queued hedge can be seen being cancelled.
+    """
+
+    def __init__(self, run_first=1):
+        self.run_first = run_first
+        self.held = []
+
+    def submit(self, fn):
+        future = Future()
+        if self.run_first:
+            self.run_first -= 1
+            threading.Thread(target=lambda: future.set_result(fn())).start()
+        else:
+            self.held.append(future)
+        return future
+
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "condition not reached"
+        time.sleep(0.005)
+
+
+def test_answers_from_the_first_provider_without_hedging(clock, executor):
+    primary, secondary = FakeVisionProvider(analysis("kitchen")), FakeVisionProvider(analysis("bedroom"))
+    router = make_router([Provider("primary", primary), Provider("secondary", secondary)], clock, executor)
+
+    answer, name = router.route(b"image")
+
+    assert (answer.room_type, name) == ("kitchen", "primary")
+    assert secondary.calls == []
+    assert router.stats["hedged"] == 0
+
+
+def test_hedges_once_the_primary_is_past_its_p95(clock, executor):
+    gate = threading.Event()
+    primary, secondary = FakeVisionProvider(analysis("kitchen"), gate), FakeVisionProvider(analysis("bedroom"))
+    router = make_router([Provider("hedge-primary", primary), Provider("hedge-secondary", secondary)],
+                         clock, executor)
+    # Five fast successes make the primary's own p95 (20ms) replace the 5s default delay
+    for _ in range(5):
+        router.profiles["hedge-primary"].record(0.02, True)
+    abandoned = PROVIDER_CALLS.value(provider="hedge-primary", outcome="abandoned")
+
+    start = time.monotonic()
+    answer, name = router.route(b"image")
+    elapsed = time.monotonic() - start
+    gate.set()
+
+    assert (answer.room_type, name) == ("bedroom", "hedge-secondary")
+    assert elapsed < 2
+    assert router.stats["hedged"] == 1
+    assert router.stats["hedge_wins"] == 1
+    # The primary was already running, so it is abandoned rather than cancelled
+    assert PROVIDER_CALLS.value(provider="hedge-primary", outcome="abandoned") == abandoned + 1
+    # ...and its late answer still lands in its profile
+    wait_for(lambda: router.profiles["hedge-primary"].get_stats()["samples"] == 6)
+
+
+def test_first_valid_answer_wins_and_the_queued_hedge_is_cancelled(clock):
+    executor = HeldExecutor(run_first=1)
+    gate = threading.Event()
+    primary, secondary = FakeVisionProvider(analysis("kitchen"), gate), FakeVisionProvider(analysis("bedroom"))
+    router = make_router([Provider("primary", primary), Provider("secondary", secondary)],
+                         clock, executor, hedge_delay=0.01)
+    result = {}
+
+    thread = threading.Thread(target=lambda: result.update(answer=router.route(b"image")))
+    thread.start()
+    wait_for(lambda: router.stats["hedged"] == 1)
+    gate.set()
+    thread.join(5)
+
+    answer, name = result["answer"]
+    assert (answer.room_type, name) == ("kitchen", "primary")
+    assert router.stats["hedge_wins"] == 0
+    assert [future.cancelled() for future in executor.held] == [True]
+    assert secondary.calls == []
+
+
+def test_fails_over_on_a_rate_limit_payload(clock, executor):
+    primary, secondary = FakeVisionProvider(RATE_LIMIT), FakeVisionProvider(analysis("bedroom"))
+    router = make_router([Provider("primary", primary), Provider("secondary", secondary)], clock, executor)
+
+    answer, name = router.route(b"image")
+
+    assert (answer.room_type, name) == ("bedroom", "secondary")
+    assert len(primary.calls) == 1
+    assert router.stats["failovers"] == 1
+    assert router.profiles["primary"].error_rate() == 1.0
+
+
+def test_fails_over_when_a_provider_raises(clock, executor):
+    primary, secondary = FakeVisionProvider(RuntimeError("503")), FakeVisionProvider(analysis("bedroom"))
+    router = make_router([Provider("primary", primary), Provider("secondary", secondary)], clock, executor)
+
+    assert router.route(b"image")[1] == "secondary"
+
+
+def test_returns_the_last_invalid_answer_when_every_provider_fails(clock, executor):
+    primary, secondary = FakeVisionProvider(None), FakeVisionProvider(RATE_LIMIT)
+    router = make_router([Provider("primary", primary), Provider("secondary", secondary)], clock, executor)
+
+    assert router.route(b"image") == (RATE_LIMIT, "secondary")
+    assert router.stats["failed"] == 1
+
+
+def test_trips_after_consecutive_failures_and_gives_one_trial_after_cooldown(clock, executor):
+    primary, secondary = FakeVisionProvider(None), FakeVisionProvider(analysis("bedroom"))
+    # The frozen clock measures every latency as 0; keep the p95 out of it so nothing hedges
+    router = make_router([Provider("primary", primary), Provider("secondary", secondary)], clock, executor,
+                         min_samples=50)
+
+    for _ in range(3):
+        assert router.route(b"image")[1] == "secondary"
+    assert len(primary.calls) == 3
+    assert not router.profiles["primary"].healthy()
+
+    # Tripped: routed around for the whole cooldown
+    clock.now += 29
+    router.route(b"image")
+    assert len(primary.calls) == 3
+
+    # After the cooldown it gets a single trial call, which fails and trips it again
+    clock.now += 1
+    assert router.route(b"image")[1] == "secondary"
+    assert len(primary.calls) == 4
+    router.route(b"image")
+    assert len(primary.calls) == 4
+
+    # A successful trial closes the switch
+    clock.now += 30
+    primary.answer = analysis("kitchen")
+    assert router.route(b"image")[1] == "primary"
+    assert router.route(b"image")[1] == "primary"
+    assert router.profiles["primary"].healthy()
+
+
+def test_trips_on_the_error_rate_over_the_window(clock, executor):
+    primary = FakeVisionProvider(analysis("kitchen"))
+    router = make_router([Provider("primary", primary)], clock, executor, min_samples=4, max_error_rate=0.5)
+    profile = router.profiles["primary"]
+
+    for ok in (True, False, True, False):
+        profile.record(0.1, ok)
+
+    assert not profile.healthy()
+
+
+def test_user_key_failures_do_not_trip_the_shared_profile(clock, executor):
+    gemini, hf = FakeVisionProvider(RATE_LIMIT), FakeVisionProvider(analysis("bedroom"))
+    router = make_router([Provider("gemini", gemini, uses_request_key=True), Provider("hf", hf)], clock, executor)
+
+    for _ in range(5):
+        # Never failed over onto server credentials either
+        assert router.route(b"image", api_key="user-key") == (RATE_LIMIT, "gemini")
+
+    assert gemini.calls == ["user-key"] * 5
+    assert hf.calls == []
+    assert router.profiles["gemini"].get_stats()["samples"] == 0
+    assert router.profiles["gemini"].healthy()
+
+    # The same failures with server credentials do count
+    for _ in range(3):
+        router.route(b"image")
+    assert not router.profiles["gemini"].healthy()
+
+
+def test_user_key_successes_are_recorded(clock, executor):
+    gemini = FakeVisionProvider(analysis("kitchen"))
+    router = make_router([Provider("gemini", gemini, uses_request_key=True)], clock, executor)
+
+    router.route(b"image", api_key="user-key")
+
+    assert router.profiles["gemini"].get_stats()["samples"] == 1
+
+
+def test_raises_without_a_configured_provider(clock, executor):
+    router = make_router([Provider("hf", FakeVisionProvider(None), lambda api_key: False)], clock, executor)
+
+    with pytest.raises(NoProviderAvailableError):
+        router.route(b"image")
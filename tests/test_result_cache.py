@@ -0,0 +1,157 @@
+import threading
+
+import pytest
+
+from tests.fakes import FakeClock
+from utils.result_cache import ResultCache, hash_bytes, make_key, prompt_version
+
+MODEL = "models/gemini-test"
+
+
+@pytest.fixture
+def clock():
+    return FakeClock(start=1_000_000.0)
+
+
+def make_cache(tmp_path, clock, **kwargs):
+    kwargs.setdefault("memory_size", 8)
+    kwargs.setdefault("ttl", 3600)
+    kwargs.setdefault("max_rows", 100)
+    return ResultCache(db_path=str(tmp_path / "cache.sqlite3"), clock=clock, **kwargs)
+
+
+def test_memory_hit(tmp_path, clock):
+    cache = make_cache(tmp_path, clock)
+
+    cache.set("k", {"items": [1, 2]})
+
+    assert cache.get("k") == {"items": [1, 2]}
+    assert cache.stats["memory_hits"] == 1
+    assert cache.stats["disk_hits"] == 0
+
+
+def test_disk_hit_from_a_new_process(tmp_path, clock):
+    make_cache(tmp_path, clock).set("k", {"items": [1]})
+    cache = make_cache(tmp_path, clock)
+
+    assert cache.get("k") == {"items": [1]}
+    assert cache.stats["disk_hits"] == 1
+    # ...and is promoted to the memory tier
+    assert cache.get("k") == {"items": [1]}
+    assert cache.stats["memory_hits"] == 1
+
+
+def test_miss(tmp_path, clock):
+    cache = make_cache(tmp_path, clock)
+
+    assert cache.get("absent") is None
+    assert cache.get_stats()["misses"] == 1
+
+
+def test_every_hit_is_a_fresh_copy(tmp_path, clock):
+    cache = make_cache(tmp_path, clock)
+    cache.set("k", {"items": [{"name": "sofa"}]})
+
+    first = cache.get("k")
+    first["items"][0]["name"] = "mutated"
+    first["items"].append("extra")
+
+    assert cache.get("k") == {"items": [{"name": "sofa"}]}
+    assert cache.get("k") is not cache.get("k")
+
+
+def test_memory_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = make_cache(tmp_path, clock, ttl=60)
+    cache.set("k", {"v": 1})
+
+    clock.now += 60
+    assert cache.get("k") == {"v": 1}
+
+    clock.now += 1
+    assert cache.get("k") is None
+    assert cache.get_stats()["memory_entries"] == 0
+    assert cache.stats["misses"] == 1
+
+
+def test_disk_entries_expire_after_the_ttl(tmp_path, clock):
+    make_cache(tmp_path, clock, ttl=60).set("k", {"v": 1})
+    clock.now += 61
+
+    assert make_cache(tmp_path, clock, ttl=60).get("k") is None
+
+
+def test_promotion_from_disk_keeps_the_original_age(tmp_path, clock):
+    make_cache(tmp_path, clock, ttl=60).set("k", {"v": 1})
+    cache = make_cache(tmp_path, clock, ttl=60)
+
+    clock.now += 50
+    assert cache.get("k") == {"v": 1}
+    clock.now += 11
+    assert cache.get("k") is None
+
+
+def test_memory_tier_is_an_lru(tmp_path, clock):
+    cache = ResultCache(db_path=None, memory_size=2, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    assert cache.stats["evictions"] == 1
+
+
+def test_disk_rows_are_trimmed_oldest_access_first(tmp_path, clock):
+    cache = make_cache(tmp_path, clock, memory_size=1, max_rows=3)
+    for key in ("a", "b", "c"):
+        cache.set(key, key)
+        clock.now += 1
+    cache.get("a")  # disk hit refreshes a's accessed_at
+    clock.now += 1
+
+    cache.set("d", "d")
+
+    fresh = make_cache(tmp_path, clock, max_rows=3)
+    assert [fresh.get(key) for key in ("a", "b", "c", "d")] == ["a", None, "c", "d"]
+    assert cache.stats["evictions"] >= 1
+
+
+def test_prompt_change_invalidates_cached_results(tmp_path, clock):
+    cache = make_cache(tmp_path, clock)
+    image_hash = hash_bytes(b"image bytes")
+    cache.set(make_key(image_hash, MODEL, prompt_version("system", "user v1")), {"v": 1})
+
+    assert cache.get(make_key(image_hash, MODEL, prompt_version("system", "user v1"))) == {"v": 1}
+    assert cache.get(make_key(image_hash, MODEL, prompt_version("system", "user v2"))) is None
+    assert prompt_version("ab", "c") != prompt_version("a", "bc")
+
+
+def test_disk_tier_failure_only_disables_the_disk(tmp_path, clock):
+    blocker = tmp_path / "file"
+    blocker.write_text("not a directory")
+    cache = ResultCache(db_path=str(blocker / "cache.sqlite3"), clock=clock)
+
+    cache.set("k", {"v": 1})
+
+    assert cache.get("k") == {"v": 1}
+    assert cache.get_stats()["disk_enabled"] is False
+
+
+def test_stats_are_exact_under_concurrency(tmp_path, clock):
+    cache = ResultCache(db_path=None, memory_size=64, clock=clock)
+    cache.set("hit", 1)
+
+    def worker():
+        for _ in range(500):
+            cache.get("hit")
+            cache.get("miss")
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = cache.get_stats()
+    assert (stats["memory_hits"], stats["misses"]) == (4000, 4000)
+    assert stats["hit_rate"] == 0.5
@@ -0,0 +1,56 @@
+import json
+import os
+
+import pytest
+
+import agent.vision_reader
+from utils.analysis_pipeline import stream_estimate
+from utils.catalog_store import catalog_store
+from utils.models import VisionAnalysis
+from utils.pricing_utils import price_analysis
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "fixtures", "gemini_responses.json")
+
+
+@pytest.fixture
+def vision():
+    with open(FIXTURE) as f:
+        return json.load(f)["vision"]
+
+
+def fake_stream(streamed, final):
+    def stream_analysis(image, api_key_override=None):
+        for item in streamed.items:
+            yield "item", item
+        yield "analysis", final
+    return stream_analysis
+
+
+def run(monkeypatch, streamed, final):
+    monkeypatch.setattr(agent.vision_reader, "stream_analysis", fake_stream(streamed, final))
+    events = list(stream_estimate(b"image", persist=False))
+    return events[-1]
+
+
+def test_done_event_matches_the_streamed_items(monkeypatch, vision):
+    analysis = VisionAnalysis.from_dict(vision)
+
+    done = run(monkeypatch, analysis, analysis)
+
+    expected = price_analysis(analysis, catalog_store.get()).to_dict()
+    assert done["cost_estimates"] == expected
+
+
+def test_final_answer_with_the_same_count_but_other_items_is_repriced(monkeypatch, vision):
+    streamed = VisionAnalysis.from_dict(vision)
+    changed = json.loads(json.dumps(vision))
+    changed["items"][0]["quantity"] = 7
+    changed["items"][1]["name"] = "Marble dining table"
+    final = VisionAnalysis.from_dict(changed)
+    assert len(final.items) == len(streamed.items)
+
+    done = run(monkeypatch, streamed, final)
+
+    expected = price_analysis(final, catalog_store.get()).to_dict()
+    assert done["cost_estimates"] == expected
+    assert done["vision_analysis"] == final.to_dict()
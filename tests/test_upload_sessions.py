@@ -0,0 +1,67 @@
+import io
+import os
+import threading
+
+import pytest
+
+from utils.upload_sessions import UploadSessionStore
+
+
+@pytest.fixture
+def store():
+    return UploadSessionStore(spool_bytes=1024, sweep_interval=0)
+
+
+def test_small_upload_stays_in_memory(store):
+    session = store.get(store.create(b"tiny", "a.jpg"))
+
+    assert session.in_memory
+    assert bytes(session.view()) == b"tiny"
+
+
+@pytest.mark.parametrize("as_stream", [False, True])
+def test_large_upload_spills_to_disk(store, as_stream):
+    data = os.urandom(300 * 1024)
+    session = store.get(store.create(io.BytesIO(data) if as_stream else data, "big.jpg"))
+
+    assert not session.in_memory
+    assert session.size == len(data)
+    assert bytes(session.view()) == data
+    assert store.get_stats()["spilled"] == 1
+
+
+def test_concurrent_views_of_a_spilled_upload_are_complete(store):
+    data = os.urandom(512 * 1024)
+    session = store.get(store.create(data, "big.jpg"))
+    bad = []
+
+    def read():
+        for _ in range(200):
+            if bytes(session.view()) != data:
+                bad.append(1)
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert bad == []
+
+
+def test_closed_session_refuses_to_read(store):
+    session_id = store.create(os.urandom(4096), "big.jpg")
+    session = store.get(session_id)
+    store.delete(session_id)
+
+    assert store.get(session_id) is None
+    with pytest.raises(ValueError):
+        session.view()
+
+
+def test_expired_session_is_not_served(store):
+    store.ttl = 0
+    session_id = store.create(b"tiny")
+
+    assert store.get(session_id) is None
+    assert store.get_stats()["expired"] == 1
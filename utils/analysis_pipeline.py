@@ -0,0 +1,264 @@
+import os
+import time
+import random
+
+from utils.pipeline import Pipeline, Stage, StageError, SKIP
+from utils.pricing_utils import price_analysis, RunningEstimate
+from utils.catalog_store import catalog_store
+from utils.classifier import classify_project
+from utils.supabase_handler import build_analysis_row
+from utils.persistence_queue import persistence_queue
+from utils.metrics import observe_stage
+
+# Vision provider when a request does not name one: "gemini" or "hf" pins one,
+# "auto" opts in to routing between them (agent/provider_router.py)
+VISION_PROVIDER = os.getenv("VISION_PROVIDER", "gemini")
+
+# Per-stage time limits in seconds (0 disables the limit)
+VISION_TIMEOUT = float(os.getenv("VISION_STAGE_TIMEOUT", "0")) or None
+CLASSIFY_TIMEOUT = float(os.getenv("CLASSIFY_STAGE_TIMEOUT", "45")) or None
+
+
+FALSE_WORDS = ("0", "off", "false", "no")
+TRUE_WORDS = ("1", "on", "true", "yes")
+
+
+def parse_flag(value):
+    """
+    True / False for a boolean or one of TRUE_WORDS / FALSE_WORDS (any case),
+    None for anything else (unset, or not a recognised word).
+    """
+    if value is None or isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in TRUE_WORDS:
+        return True
+    if value in FALSE_WORDS:
+        return False
+    return None
+
+
+def _fused_ratio(value):
+    flag = parse_flag(value)
+    if flag is not None:
+        return 1.0 if flag else 0.0
+    value = (value or "").strip()
+    if not value:
+        return 0.0
+    try:
+        return min(1.0, max(0.0, float(value)))
+    except ValueError:
+        print(f"⚠️ PIPELINE: Ignoring invalid FUSED_ANALYSIS={value!r}; fused analysis stays off")
+        return 0.0
+
+
+# Share of Gemini analyses that use one fused vision + classification call
+# instead of two: "off" (default), "on", or a fraction such as 0.5 for an A/B split
+FUSED_ANALYSIS_RATIO = _fused_ratio(os.getenv("FUSED_ANALYSIS"))
+
+
+def _vision_stage(ctx):
+    if ctx.get("provider") == "auto":
+        from agent.provider_router import vision_router, NoProviderAvailableError
+        try:
+            vision_data, provider = vision_router.route(ctx["image"], api_key=ctx.get("api_key"))
+        except NoProviderAvailableError as e:
+            raise StageError(str(e))
+        # Handed back to run_analysis through the per-run dict
+        ctx["route"]["provider"] = provider
+    elif ctx.get("provider") == "hf":
+        from agent.vision_reader import analyze_image_hf
+        vision_data = analyze_image_hf(ctx["image"])
+    else:
+        from agent.vision_reader import analyze_image
+        vision_data = analyze_image(ctx["image"], api_key_override=ctx.get("api_key"))
+
+    if not vision_data:
+        raise StageError("Vision extraction failed.")
+    return vision_data
+
+
+def _fused_vision_stage(ctx):
+    from agent.vision_reader import analyze_and_classify
+    vision_data, classification = analyze_and_classify(ctx["image"], api_key_override=ctx.get("api_key"))
+
+    if not vision_data:
+        raise StageError("Vision extraction failed.")
+    # Handed to the classify stage through the per-run dict from run_analysis
+    ctx["fused"]["classify"] = classification
+    return vision_data
+
+
+def _estimate_stage(ctx):
+    return price_analysis(ctx["vision"], catalog_store.get(), ctx.get("region"), ctx.get("city_tier"))
+
+
+def _classify_stage(ctx):
+    return classify_project(ctx["vision"], api_key_override=ctx.get("api_key"))
+
+
+def _fused_classify_stage(ctx):
+    classification = ctx["fused"].get("classify")
+    if classification is None:
+        # The fused answer had no usable classification: fall back to the second call
+        return classify_project(ctx["vision"], api_key_override=ctx.get("api_key"))
+    return classification
+
+
+def _persist_stage(ctx):
+    # Write-behind: the row is batched with others and inserted by the persistence worker
+    if not persistence_queue.backend.available:
+        print("Supabase client not initialized. Check URL and Key.")
+        return None
+    return persistence_queue.enqueue(build_analysis_row(ctx["vision"], ctx["estimate"], ctx.get("classify"),
+                                                         ctx.get("user_id")))
+
+
+def build_analysis_pipeline(classify=True, persist=True, fused=False):
+    """
+    vision -> estimate
+           -> classify   (overlaps with estimate, only needs the vision output)
+    estimate + classify -> persist (background, the response does not wait for it)
+
+    With `fused`, the vision stage gets the classification in the same model
+    call and the classify stage only unpacks it (or classifies separately if
+    the fused answer lacked one).
+    """
+    stages = [
+        Stage("vision", _fused_vision_stage if fused else _vision_stage, timeout=VISION_TIMEOUT),
+        Stage("estimate", _estimate_stage, deps=["vision"]),
+    ]
+    persist_deps = ["estimate"]
+    if classify:
+        stages.append(Stage("classify", _fused_classify_stage if fused else _classify_stage, deps=["vision"],
+                            timeout=CLASSIFY_TIMEOUT, on_error=SKIP,
+                            default={"error": "Classification unavailable"}))
+        persist_deps.append("classify")
+    if persist:
+        stages.append(Stage("persist", _persist_stage, deps=persist_deps, on_error=SKIP, background=True))
+    return Pipeline(stages)
+
+
+# Built once; the graphs are stateless and safe to share between requests
+_pipelines = {}
+
+
+def use_fused(provider="gemini", classify=True, fused=None):
+    """
+    Whether a run takes the fused path: only for Gemini runs that classify
+    (with provider=auto a fused run goes straight to Gemini, unrouted).
+    An explicit `fused` wins; otherwise FUSED_ANALYSIS_RATIO decides at random.
+    """
+    if provider == "hf" or not classify:
+        return False
+    if fused is not None:
+        return bool(fused)
+    return random.random() < FUSED_ANALYSIS_RATIO
+
+
+def run_analysis(image, provider=None, api_key=None, classify=True, persist=True,
+                 region=None, city_tier=None, user_id=None, fused=None):
+    """
+    Image -> Extraction -> Pricing (+ Classification) -> Persistence.
+    `image` is a file path, or bytes / memoryview of an in-memory upload.
+    `provider` is "auto", "gemini" or "hf" (default VISION_PROVIDER); the one
+    that produced the extraction is reported as result.provider.
+    `fused` forces (True) or disables (False) the single-call vision +
+    classification path; None follows the FUSED_ANALYSIS setting.
+    Returns a PipelineResult whose "vision", "estimate" and "classify" outputs
+    are typed models (utils.models; dump() gives the response JSON); raises
+    PipelineError if vision or pricing fails.
+    An unknown region raises UnknownRegionError before any model call is made.
+    """
+    # Fail fast on a bad region instead of after a multi-second vision call
+    catalog_store.get().columns_for(region, city_tier)
+
+    provider = provider or VISION_PROVIDER
+    fused = use_fused(provider, classify, fused)
+    key = (classify, persist, fused)
+    if key not in _pipelines:
+        _pipelines[key] = build_analysis_pipeline(classify, persist, fused)
+
+    route = {}
+    result = _pipelines[key].run({
+        "image": image, "provider": provider, "api_key": api_key,
+        "region": region, "city_tier": city_tier, "user_id": user_id, "fused": {}, "route": route
+    })
+    result.provider = route.get("provider", "gemini" if provider == "auto" else provider)
+    if classify:
+        result.variant = "fused" if fused else "split"
+    print(f"⏱️ PIPELINE: {result.summary()}")
+    return result
+
+
+def _tier_totals(estimate):
+    return {tier: {"subtotal": t.subtotal, "labor": t.labor, "contingency": t.contingency, "total": t.total}
+            for tier, t in estimate.tiers}
+
+
+def stream_estimate(image, api_key=None, region=None, city_tier=None, user_id=None, persist=True):
+    """
+    Image -> streamed extraction, pricing each item as it arrives. Yields
+    JSON-ready events:
+
+      {"event": "item", "index", "item", "unit_prices", "totals", "elapsed_ms"}
+          one per extracted item; `totals` are the running tier totals at the
+          base labor rate (complexity flags come after the items)
+      {"event": "done", "vision_analysis", "cost_estimates", "timings_ms"}
+          the same payload /estimate returns, once the answer is complete
+
+    Gemini only. Model errors are raised from the iteration; callers should
+    check the region (catalog.columns_for) before starting the stream.
+    """
+    from agent.vision_reader import stream_analysis
+
+    running = RunningEstimate(catalog_store.get(), region, city_tier)
+    start = time.perf_counter()
+    first_item_ms = None
+    index = 0
+    priced = []  # (name, quantity) of each streamed item, what the running totals were built from
+    analysis = None
+
+    for kind, value in stream_analysis(image, api_key_override=api_key):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if kind == "analysis":
+            analysis = value
+            break
+        if first_item_ms is None:
+            first_item_ms = elapsed_ms
+            observe_stage("vision_first_item", elapsed_ms / 1000)
+        lines = running.add(value)
+        priced.append((value.name, value.quantity))
+        running.apply_overheads()
+        yield {
+            "event": "item",
+            "index": index,
+            "item": value.to_dict(),
+            "unit_prices": {tier: line.unit_price for tier, line in zip(running.estimate.TIERS, lines)},
+            "totals": _tier_totals(running.estimate),
+            "elapsed_ms": round(elapsed_ms, 1),
+        }
+        index += 1
+
+    vision_ms = (time.perf_counter() - start) * 1000
+    observe_stage("vision", vision_ms / 1000)
+    if priced == [(item.name, item.quantity) for item in analysis.items]:
+        estimate = running.apply_overheads(analysis.complexity_flags)
+    else:
+        # The final decode disagrees with what the stream priced (items dropped, renamed or
+        # requantified): price it afresh so the totals match the returned analysis
+        estimate = price_analysis(analysis, catalog_store.get(), region, city_tier)
+
+    if persist and persistence_queue.backend.available:
+        persistence_queue.enqueue(build_analysis_row(analysis, estimate, None, user_id))
+
+    timings = {"vision": round(vision_ms, 1), "total": round((time.perf_counter() - start) * 1000, 1)}
+    if first_item_ms is not None:
+        timings["first_item"] = round(first_item_ms, 1)
+    print(f"⏱️ STREAM: {index} items, first after {first_item_ms or 0:.0f}ms, complete after {vision_ms:.0f}ms")
+    yield {
+        "event": "done",
+        "vision_analysis": analysis.to_dict(),
+        "cost_estimates": estimate.to_dict(),
+        "timings_ms": timings,
+    }
@@ -0,0 +1,51 @@
+import os
+
+import jwt
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# JWT secret of the Supabase project (Settings > API). Without it no request is
+# authenticated, and the per-user routes (history) are not served at all.
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+
+
+class AuthenticationError(Exception):
+    pass
+
+
+def auth_enabled():
+    return bool(SUPABASE_JWT_SECRET)
+
+
+def verified_user_id(authorization):
+    """
+    User id (the `sub` claim) of a Supabase access token sent as
+    "Authorization: Bearer <jwt>". The signature, expiry and audience are
+    checked; raises AuthenticationError otherwise.
+    """
+    if not auth_enabled():
+        raise AuthenticationError("Authentication is not configured")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        raise AuthenticationError("A bearer token is required")
+    try:
+        claims = jwt.decode(token.strip(), SUPABASE_JWT_SECRET, algorithms=["HS256"],
+                            audience=SUPABASE_JWT_AUDIENCE, options={"require": ["sub", "exp"]})
+    except jwt.PyJWTError as e:
+        raise AuthenticationError(f"Invalid token: {e}")
+    return claims["sub"]
+
+
+def request_user_id(authorization):
+    """
+    The verified user id for attributing a saved analysis, or None for
+    anonymous requests (no token, an invalid one, or auth not configured).
+    """
+    if not authorization or not auth_enabled():
+        return None
+    try:
+        return verified_user_id(authorization)
+    except AuthenticationError:
+        return None
@@ -0,0 +1,341 @@
+import os
+import json
+import shutil
+import asyncio
+import zipfile
+import tempfile
+
+import anyio
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+
+from utils.analysis_pipeline import run_analysis
+from utils.pipeline import PipelineError
+from utils.models import dump
+
+# Images analysed at once per batch request
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "4"))
+# Uploaded images waiting for a worker; once full, reading the upload pauses
+BATCH_QUEUE_SIZE = int(os.getenv("BATCH_QUEUE_SIZE", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "200"))
+BATCH_MAX_FILE_MB = float(os.getenv("BATCH_MAX_FILE_MB", "20"))
+# Zip uploads are spooled to disk past this size (the member index sits at the end of the file)
+BATCH_ZIP_SPOOL_MB = float(os.getenv("BATCH_ZIP_SPOOL_MB", "8"))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".heic")
+
+
+class BatchUploadError(ValueError):
+    pass
+
+
+def _write_temp(dest_dir, filename):
+    suffix = os.path.splitext(filename or "")[1].lower() or ".img"
+    fd, path = tempfile.mkstemp(prefix="batch_", suffix=suffix, dir=dest_dir)
+    return os.fdopen(fd, "wb"), path
+
+
+class _MultipartFiles:
+    """
+    Feeds request chunks through python-multipart and writes each file part
+    straight to its own temp file, so only one chunk is in memory at a time.
+    Completed parts are collected as (filename, path, error) tuples.
+    """
+
+    def __init__(self, boundary, dest_dir, max_bytes):
+        self.dest_dir = dest_dir
+        self.max_bytes = max_bytes
+        self.ready = []
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+        self._file = None
+        self._path = None
+        self._filename = None
+        self._size = 0
+        self._error = None
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._file = self._path = self._filename = self._error = None
+        self._size = 0
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        filename = options.get(b"filename")
+        if filename is None:
+            # Plain form fields are ignored; options travel as query parameters
+            return
+        self._filename = os.path.basename(filename.decode("utf-8", "replace"))
+        self._file, self._path = _write_temp(self.dest_dir, self._filename)
+
+    def _on_part_data(self, data, start, end):
+        if self._file is None or self._error:
+            return
+        self._size += end - start
+        if self._size > self.max_bytes:
+            self._error = f"File exceeds {self.max_bytes // (1024 * 1024)} MB limit"
+            return
+        self._file.write(data[start:end])
+
+    def _on_part_end(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self.ready.append((self._filename, self._path, self._error))
+        self._file = None
+
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+            os.remove(self._path)
+            self._file = None
+        for _, path, _ in self.ready:
+            if os.path.exists(path): os.remove(path)
+        self.ready = []
+
+
+async def iter_multipart_files(request, dest_dir, max_bytes):
+    """
+    Yields (filename, temp_path, error) for each file part as soon as that part
+    has been fully received. The caller owns (and must remove) each temp file.
+    """
+    _, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise BatchUploadError("Missing multipart boundary.")
+
+    parts = _MultipartFiles(boundary, dest_dir, max_bytes)
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                parts.parser.write(chunk)
+            while parts.ready:
+                yield parts.ready.pop(0)
+        parts.parser.finalize()
+        while parts.ready:
+            yield parts.ready.pop(0)
+    except Exception as e:
+        if isinstance(e, BatchUploadError):
+            raise
+        raise BatchUploadError(f"Malformed multipart body: {e}")
+    finally:
+        parts.abort()
+
+
+def _extract_member(archive, info, dest_dir):
+    out, path = _write_temp(dest_dir, info.filename)
+    with out, archive.open(info) as src:
+        shutil.copyfileobj(src, out)
+    return path
+
+
+async def iter_zip_files(request, dest_dir, max_bytes):
+    """
+    Yields (filename, temp_path, error) for each image in an uploaded zip.
+    The archive is spooled (to disk once large) and members are extracted one
+    at a time, so at most one member is held outside the spool.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=int(BATCH_ZIP_SPOOL_MB * 1024 * 1024), dir=dest_dir)
+    try:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        try:
+            archive = zipfile.ZipFile(spool)
+        except zipfile.BadZipFile as e:
+            raise BatchUploadError(f"Invalid zip archive: {e}")
+
+        with archive:
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith("."):
+                    continue
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                if info.file_size > max_bytes:
+                    yield name, None, f"File exceeds {max_bytes // (1024 * 1024)} MB limit"
+                    continue
+                path = await run_in_threadpool(_extract_member, archive, info, dest_dir)
+                yield name, path, None
+    finally:
+        spool.close()
+
+
+def analyze_batch_item(image_path, provider=None, api_key=None, region=None, city_tier=None):
+    """
+    Runs the full analysis for one batch image and returns its NDJSON payload;
+    failures are reported in the payload instead of aborting the batch.
+    """
+    try:
+        result = run_analysis(image_path, provider, api_key, region=region, city_tier=city_tier)
+    except PipelineError as e:
+        return {"status": "error", "stage": e.stage, "error": str(e.error)}
+    except Exception as e:
+        return {"status": "error", "stage": None, "error": str(e)}
+    return {
+        "status": "ok",
+        "vision_analysis": dump(result["vision"]),
+        "cost_estimates": dump(result["estimate"]),
+        "business_classification": dump(result["classify"]),
+        "provider": result.provider,
+        "timings_ms": {name: round(ms, 1) for name, ms in result.timings_snapshot().items()},
+    }
+
+
+class BatchRun:
+    """
+    Bounded worker pool for one batch request.
+
+    feed() reads the upload and submits each image as it lands on disk; a
+    fixed number of workers analyse them (each in the threadpool) and push
+    one result per image, in completion order, to be streamed back as NDJSON
+    by lines(). Both queues are bounded: a client reading the results slowly
+    makes the workers wait, which fills the job queue, which pauses reading
+    the upload, so memory does not grow with the batch size.
+    """
+
+    def __init__(self, analyze, workers=BATCH_MAX_WORKERS, queue_size=BATCH_QUEUE_SIZE, max_items=BATCH_MAX_ITEMS):
+        self.analyze = analyze
+        self.max_items = max_items
+        self.submitted = 0
+        self.upload_error = None
+        # Set once the request body has been read (or abandoned); see BatchResponse
+        self.upload_done = asyncio.Event()
+        self._jobs = asyncio.Queue(maxsize=queue_size)
+        self._results = asyncio.Queue(maxsize=queue_size)
+        self._closed = False
+        self._live_workers = max(1, workers)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._live_workers)]
+
+    async def _worker(self):
+        while True:
+            job = await self._jobs.get()
+            if job is None:
+                self._live_workers -= 1
+                if self._live_workers == 0:
+                    # Last worker out: every result is in the queue
+                    await self._results.put(None)
+                return
+            index, filename, path = job
+            try:
+                payload = await run_in_threadpool(self.analyze, path)
+            finally:
+                if os.path.exists(path): os.remove(path)
+            await self._results.put({"index": index, "filename": filename, **payload})
+
+    async def submit(self, filename, path, error=None):
+        index = self.submitted
+        self.submitted += 1
+        if error is None and index >= self.max_items:
+            error = f"Batch limit of {self.max_items} images exceeded"
+        if error is not None:
+            if path and os.path.exists(path): os.remove(path)
+            await self._results.put({"index": index, "filename": filename, "status": "error", "stage": "upload",
+                                     "error": error})
+            return
+        await self._jobs.put((index, filename, path))
+
+    async def feed(self, files):
+        """
+        Submits every (filename, path, error) from `files`, then closes the
+        run. A broken upload ends the batch early; its error is reported in
+        the summary line.
+        """
+        try:
+            async for filename, path, error in files:
+                await self.submit(filename, path, error)
+            if self.submitted == 0:
+                self.upload_error = "No images found in upload."
+        except BatchUploadError as e:
+            self.upload_error = str(e)
+        self.upload_done.set()
+        await self.close()
+
+    async def close(self):
+        if not self._closed:
+            self._closed = True
+            for _ in self._workers:
+                await self._jobs.put(None)
+
+    async def cancel(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        while not self._jobs.empty():
+            job = self._jobs.get_nowait()
+            if job and os.path.exists(job[2]): os.remove(job[2])
+
+    async def lines(self, files):
+        """
+        Reads the upload from `files` while streaming NDJSON lines, one per
+        image as soon as it is done, then a summary line.
+        """
+        reader = asyncio.create_task(self.feed(files))
+        total = ok = 0
+        try:
+            while True:
+                result = await self._results.get()
+                if result is None:
+                    break
+                total += 1
+                ok += result.get("status") == "ok"
+                yield json.dumps(result) + "\n"
+            summary = {"done": True, "total": total, "succeeded": ok, "failed": total - ok}
+            if self.upload_error:
+                summary["error"] = self.upload_error
+            yield json.dumps(summary) + "\n"
+        finally:
+            # Finished, or the client went away mid-stream: stop reading, stop the workers, drop queued uploads
+            with anyio.CancelScope(shield=True):
+                reader.cancel()
+                await asyncio.gather(reader, return_exceptions=True)
+                self.upload_done.set()
+                await self.cancel()
+
+
+class BatchResponse(StreamingResponse):
+    """
+    NDJSON response for a BatchRun that is still reading its request body.
+
+    Starlette's StreamingResponse listens on `receive` for a client
+    disconnect while it streams, which would swallow the upload's body
+    messages. This one only starts listening once the batch has finished
+    reading the upload.
+    """
+
+    def __init__(self, batch, files):
+        super().__init__(batch.lines(files), media_type="application/x-ndjson")
+        self.batch = batch
+
+    async def __call__(self, scope, receive, send):
+        async with anyio.create_task_group() as task_group:
+            async def stream():
+                await self.stream_response(send)
+                task_group.cancel_scope.cancel()
+
+            task_group.start_soon(stream)
+            await self.batch.upload_done.wait()
+            await self.listen_for_disconnect(receive)
+            task_group.cancel_scope.cancel()
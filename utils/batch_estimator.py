@@ -0,0 +1,218 @@
+import os
+
+import numpy as np
+
+from utils.catalog_store import TIERS, as_catalog
+from utils.pricing_utils import _map_item_to_catalog
+from utils.models import as_vision_analysis
+
+# Analyses priced per vectorized block; bounds the size of the item x tier matrices
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "5000"))
+
+CONTINGENCY_PERCENT = 0.10
+LABOR_BASE_PERCENT = 0.10
+LABOR_STEP_PERCENT = 0.05
+LABOR_CAP_PERCENT = 0.25
+LABOR_FLAGS = ("false_ceiling", "built_in_storage", "custom_carpentry")
+
+
+def calculate_estimates_batch(vision_jsons, catalog_prices, chunk_size=BATCH_CHUNK_SIZE, region=None, city_tier=None):
+    """
+    Re-quotes many vision results at once, totals only.
+
+    Returns a list with one estimate per input, identical (values and int/float
+    types) to calling calculate_estimate on each one minus the per-item lists.
+    Inputs are VisionAnalysis objects or raw vision dicts; dicts go through
+    as_vision_analysis, so drifted types are coerced exactly as in the single path.
+    Item names are matched in Python (memoized); quantities, prices, subtotals,
+    labor, contingency and totals are computed on item x tier matrices per
+    chunk. Itemized estimates are one dict per item and tier however they are
+    computed, so they gain nothing here: use calculate_estimate for those.
+    """
+    catalog = as_catalog(catalog_prices)
+    table = catalog.columns_for(region, city_tier)
+    columns = _catalog_columns(table)
+
+    results = []
+    for start in range(0, len(vision_jsons), chunk_size):
+        results.extend(_estimate_chunk(vision_jsons[start:start + chunk_size], catalog, columns))
+    return results
+
+
+def _catalog_columns(table):
+    """
+    Float64 (and, for integral tiers, int64) views of one set of price columns.
+    """
+    columns = {}
+    for tier in TIERS:
+        column = table[tier]
+        is_int = column.typecode == "q"
+        columns[tier] = (
+            np.asarray(column, dtype=np.float64),
+            np.asarray(column, dtype=np.int64) if is_int else None,
+            is_int,
+        )
+    return columns
+
+
+def labor_percentages(complexity_flags_list):
+    """
+    Vectorized labor percentage per analysis, from VisionAnalysis.complexity_flags
+    (already coerced to bools). The additions are applied in the same order as
+    calculate_estimate so the floats match bit for bit.
+    """
+    labor = np.full(len(complexity_flags_list), LABOR_BASE_PERCENT)
+    for flag in LABOR_FLAGS:
+        present = np.fromiter((bool(flags.get(flag)) for flags in complexity_flags_list),
+                              dtype=bool, count=len(complexity_flags_list))
+        labor = np.where(present, labor + LABOR_STEP_PERCENT, labor)
+    return np.minimum(labor, LABOR_CAP_PERCENT)
+
+
+def _estimate_chunk(chunk, catalog, columns):
+    n = len(chunk)
+    analyses = [as_vision_analysis(vision_json) for vision_json in chunk]
+    items_per = [analysis.items for analysis in analyses]
+    width = max((len(items) for items in items_per), default=0)
+
+    # Flat coordinates of every catalog-matched item, scattered into the matrices in one go
+    hit_a, hit_j, hit_row, hit_qty, hit_int = [], [], [], [], []
+    for a, items in enumerate(items_per):
+        for j, item in enumerate(items):
+            catalog_key = _map_item_to_catalog(item.name)
+            row = catalog.row(catalog_key) if catalog_key else None
+            if row is None:
+                continue
+            quantity = item.quantity
+            hit_a.append(a)
+            hit_j.append(j)
+            hit_row.append(row)
+            hit_qty.append(quantity)
+            hit_int.append(isinstance(quantity, int))
+
+    # item matrices (padded to the widest analysis in the chunk)
+    rows = np.full((n, width), -1, dtype=np.int64)
+    qty_f = np.zeros((n, width), dtype=np.float64)
+    qty_is_int = np.ones((n, width), dtype=bool)
+    if hit_a:
+        coords = (np.asarray(hit_a), np.asarray(hit_j))
+        rows[coords] = hit_row
+        qty_f[coords] = hit_qty
+        qty_is_int[coords] = hit_int
+    # Non-integral quantities are never read from the int matrix
+    qty_i = np.where(qty_is_int, qty_f, 0).astype(np.int64)
+
+    matched = rows >= 0
+    safe_rows = np.where(matched, rows, 0)
+    labor_percent = labor_percentages([analysis.complexity_flags for analysis in analyses])
+    labor_list = labor_percent.tolist()
+
+    tiers = {}
+    for tier in TIERS:
+        col_f, col_i, col_is_int = columns[tier]
+        price_f = np.where(matched, col_f[safe_rows], 0.0) if len(col_f) else np.zeros((n, width))
+        cost_f = price_f * qty_f
+
+        # An item keeps int costs only if both its quantity and its price are ints
+        item_is_int = matched & qty_is_int & col_is_int
+        analysis_is_int = ~(matched & ~item_is_int).any(axis=1)
+        if col_is_int and len(col_i):
+            cost_i = np.where(item_is_int, col_i[safe_rows] * qty_i, 0)
+        else:
+            cost_i = np.zeros((n, width), dtype=np.int64)
+
+        # Sequential column sums reproduce Python's left-to-right float addition
+        subtotal_f = np.zeros(n)
+        for j in range(width):
+            subtotal_f = subtotal_f + cost_f[:, j]
+        subtotal_i = cost_i.sum(axis=1)
+
+        labor = np.trunc(subtotal_f * labor_percent)
+        contingency = np.trunc(subtotal_f * CONTINGENCY_PERCENT)
+        total_f = (subtotal_f + labor) + contingency
+        total_i = subtotal_i + labor.astype(np.int64) + contingency.astype(np.int64)
+
+        # Usual case: every price and quantity is an int, so plain int64 lists suffice.
+        # Otherwise an object array keeps Python int/float per analysis, matching the scalar path.
+        all_int = bool(analysis_is_int.all())
+        if all_int:
+            subtotal, total = subtotal_i, total_i
+        else:
+            subtotal = np.where(analysis_is_int, subtotal_i.astype(object), subtotal_f.astype(object))
+            total = np.where(analysis_is_int, total_i.astype(object), total_f.astype(object))
+        tier_data = {
+            "subtotal": subtotal.tolist(),
+            "labor": labor.astype(np.int64).tolist(),
+            "contingency": contingency.astype(np.int64).tolist(),
+            "total": total.tolist(),
+        }
+        tiers[tier] = tier_data
+
+    results = []
+    for a in range(n):
+        estimates = {}
+        for tier in TIERS:
+            t = tiers[tier]
+            estimates[tier] = {
+                "subtotal": t["subtotal"][a],
+                "labor": t["labor"][a],
+                "contingency": t["contingency"][a],
+                "total": t["total"][a],
+                "labor_percent": labor_list[a],
+                "contingency_percent": CONTINGENCY_PERCENT,
+            }
+        results.append(estimates)
+    return results
+
+
+
+def compare_regions(vision_json, catalog_prices, city_tier=None):
+    """
+    Prices one analysis for every region in a single pass.
+
+    Items are matched once, then the precomputed region x SKU x tier price stack
+    is gathered for the matched rows and multiplied by the quantities, so the
+    cost does not grow with one calculate_estimate call per region. Returns
+    {region: {tier: {subtotal, labor, contingency, total, ...}}} with the same
+    totals calculate_estimate(..., region=region) produces.
+    """
+    catalog = as_catalog(catalog_prices)
+    regions, stack = catalog.region_stack(city_tier)
+    analysis = as_vision_analysis(vision_json)
+
+    rows, quantities = [], []
+    for item in analysis.items:
+        catalog_key = _map_item_to_catalog(item.name)
+        row = catalog.row(catalog_key) if catalog_key else None
+        if row is not None:
+            rows.append(row)
+            quantities.append(item.quantity)
+
+    is_int = stack.dtype == np.int64 and all(isinstance(q, int) for q in quantities)
+    prices = stack[:, rows, :]
+    # Item-by-item accumulation keeps the float additions in calculate_estimate's order
+    subtotal = np.zeros((len(regions), len(TIERS)), dtype=np.int64 if is_int else np.float64)
+    for j, quantity in enumerate(quantities):
+        subtotal = subtotal + prices[:, j, :] * quantity
+
+    labor_percent = labor_percentages([analysis.complexity_flags])[0]
+    labor = np.trunc(subtotal * labor_percent).astype(np.int64)
+    contingency = np.trunc(subtotal * CONTINGENCY_PERCENT).astype(np.int64)
+    total = subtotal + labor + contingency if is_int else (subtotal + labor) + contingency
+
+    subtotal, labor, contingency, total = subtotal.tolist(), labor.tolist(), contingency.tolist(), total.tolist()
+    labor_percent = float(labor_percent)
+    comparison = {}
+    for r, region in enumerate(regions):
+        comparison[region] = {
+            tier: {
+                "subtotal": subtotal[r][t],
+                "labor": labor[r][t],
+                "contingency": contingency[r][t],
+                "total": total[r][t],
+                "labor_percent": labor_percent,
+                "contingency_percent": CONTINGENCY_PERCENT,
+            }
+            for t, tier in enumerate(TIERS)
+        }
+    return comparison
@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import threading
+from array import array
+
+TIERS = ("economy", "standard", "premium")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATALOG_PATH = os.getenv("CATALOG_PATH", os.path.join(BASE_DIR, "data", "catalog_prices.json"))
+REGION_MULTIPLIER_PATH = os.getenv("REGION_MULTIPLIER_PATH", os.path.join(BASE_DIR, "data", "region_multiplier.json"))
+# How often (seconds) the source file's mtime is checked for changes
+CATALOG_CHECK_INTERVAL = float(os.getenv("CATALOG_CHECK_INTERVAL", "2"))
+
+
+class UnknownRegionError(ValueError):
+    pass
+
+
+def normalize_region(name):
+    if not name:
+        return None
+    return name.strip().lower().replace(" ", "_").replace("-", "_")
+
+
+def _scale_column(column, multiplier):
+    if column.typecode == "q":
+        return array("q", (int(round(v * multiplier)) for v in column))
+    return array("d", (round(v * multiplier, 2) for v in column))
+
+
+class Catalog:
+    """
+    Compiled, read-only price catalog.
+
+    Prices are stored column-wise (one packed array per tier) with a key -> row
+    index, so a lookup is one dict hit plus three array reads and a large
+    catalog costs 8 bytes per price instead of a dict per SKU.
+
+    Regional prices are folded in at compile time: every (region, city tier)
+    combination gets its own set of columns, so a regional lookup costs exactly
+    the same as a base one.
+    """
+    __slots__ = ("keys", "index", "columns", "tables", "regions", "city_tiers", "mtime", "path", "_stacks")
+
+    def __init__(self, keys, columns, mtime=None, path=None, regions=None, city_tiers=None):
+        self.keys = keys
+        self.index = {key: row for row, key in enumerate(keys)}
+        self.columns = columns
+        self.mtime = mtime
+        self.path = path
+        self.regions = {normalize_region(k): v for k, v in (regions or {}).items()}
+        self.city_tiers = {normalize_region(k): v for k, v in (city_tiers or {}).items()}
+        self._stacks = {}
+
+        self.tables = {(None, None): columns}
+        for tier_name, tier_multiplier in self.city_tiers.items():
+            self.tables[(None, tier_name)] = {t: _scale_column(c, tier_multiplier) for t, c in columns.items()}
+        for region, region_multiplier in self.regions.items():
+            for tier_name in [None, *self.city_tiers]:
+                multiplier = region_multiplier * (self.city_tiers[tier_name] if tier_name else 1.0)
+                self.tables[(region, tier_name)] = {t: _scale_column(c, multiplier) for t, c in columns.items()}
+
+    @classmethod
+    def from_dict(cls, raw, mtime=None, path=None, regions=None, city_tiers=None):
+        keys = list(raw)
+        columns = {}
+        for tier in TIERS:
+            values = [raw[key].get(tier, 0) for key in keys]
+            # Keep integer prices integral so estimates serialise exactly as before
+            typecode = "q" if all(isinstance(v, int) for v in values) else "d"
+            columns[tier] = array(typecode, values)
+        return cls(keys, columns, mtime, path, regions, city_tiers)
+
+    def columns_for(self, region=None, city_tier=None):
+        """
+        Price columns for a region / city tier (both optional).
+        Raises UnknownRegionError for names not in region_multiplier.json.
+        """
+        if region is None and city_tier is None:
+            return self.columns
+        key = (normalize_region(region), normalize_region(city_tier))
+        columns = self.tables.get(key)
+        if columns is None:
+            if key[0] is not None and key[0] not in self.regions:
+                raise UnknownRegionError(f"Unknown region '{region}'. Available: {sorted(self.regions)}")
+            raise UnknownRegionError(f"Unknown city tier '{city_tier}'. Available: {sorted(self.city_tiers)}")
+        return columns
+
+    def region_stack(self, city_tier=None):
+        """
+        (regions, stack) where stack[r, row, t] is the price of `row` in tier t
+        for regions[r]. Built on first use and kept for the life of the snapshot.
+        """
+        import numpy as np
+
+        city_tier = normalize_region(city_tier)
+        stack = self._stacks.get(city_tier)
+        if stack is None:
+            regions = sorted(self.regions)
+            tables = [self.columns_for(region, city_tier) for region in regions]
+            is_int = all(table[t].typecode == "q" for table in tables for t in TIERS)
+            dtype = np.int64 if is_int else np.float64
+            data = np.zeros((len(regions), len(self.keys), len(TIERS)), dtype=dtype)
+            for r, table in enumerate(tables):
+                for t, tier in enumerate(TIERS):
+                    data[r, :, t] = np.asarray(table[tier], dtype=dtype)
+            stack = (regions, data)
+            self._stacks[city_tier] = stack
+        return stack
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def row(self, key):
+        return self.index.get(key)
+
+    def get_prices(self, key, region=None, city_tier=None):
+        """
+        Returns the (economy, standard, premium) unit prices for a key, or None.
+        """
+        row = self.index.get(key)
+        if row is None:
+            return None
+        columns = self.columns if region is None and city_tier is None else self.columns_for(region, city_tier)
+        return tuple(columns[tier][row] for tier in TIERS)
+
+    def price(self, key, tier, region=None, city_tier=None):
+        row = self.index.get(key)
+        if row is None:
+            return 0
+        return self.columns_for(region, city_tier)[tier][row]
+
+
+EMPTY_CATALOG = Catalog([], {tier: array("q") for tier in TIERS})
+
+
+def as_catalog(catalog):
+    """
+    Accepts a compiled Catalog or a legacy {key: {tier: price}} dict.
+    """
+    if isinstance(catalog, Catalog):
+        return catalog
+    return Catalog.from_dict(catalog or {})
+
+
+class CatalogStore:
+    """
+    Loads the catalog once and swaps in a freshly compiled copy only when the
+    catalog's or the region multipliers' mtime changes. Readers always get a
+    complete snapshot.
+    """
+
+    def __init__(self, path=CATALOG_PATH, check_interval=CATALOG_CHECK_INTERVAL,
+                 region_path=REGION_MULTIPLIER_PATH):
+        self.path = path
+        self.region_path = region_path
+        self.check_interval = check_interval
+        self._catalog = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _load_regions(self):
+        # The multiplier file is optional; without it only national base prices exist
+        try:
+            with open(self.region_path, "r") as f:
+                content = f.read().strip()
+            data = json.loads(content) if content else {}
+        except FileNotFoundError:
+            return {}, {}
+        return data.get("regions", {}), data.get("city_tiers", {})
+
+    def _load(self, mtime):
+        with open(self.path, "r") as f:
+            raw = json.load(f)
+        regions, city_tiers = self._load_regions()
+        catalog = Catalog.from_dict(raw, mtime=mtime, path=self.path, regions=regions, city_tiers=city_tiers)
+        print(f"📒 CATALOG: Loaded {len(catalog)} keys and {len(regions)} regions from {os.path.basename(self.path)}")
+        return catalog
+
+    def _mtime(self):
+        try:
+            region_mtime = os.stat(self.region_path).st_mtime
+        except OSError:
+            region_mtime = None
+        return (os.stat(self.path).st_mtime, region_mtime)
+
+    def _refresh(self):
+        try:
+            mtime = self._mtime()
+        except OSError as e:
+            if self._catalog is None:
+                print(f"Error loading catalog at {self.path}: {e}")
+                self._catalog = EMPTY_CATALOG
+            return
+
+        if self._catalog is not None and self._catalog.mtime == mtime:
+            return
+        try:
+            self._catalog = self._load(mtime)
+        except Exception as e:
+            # Keep serving the previous snapshot if the new file is half-written or invalid
+            print(f"Error loading catalog at {self.path}: {e}")
+            if self._catalog is None:
+                self._catalog = EMPTY_CATALOG
+
+    def get(self):
+        now = time.monotonic()
+        if self._catalog is None or now - self._last_check >= self.check_interval:
+            with self._lock:
+                if self._catalog is None or now - self._last_check >= self.check_interval:
+                    self._refresh()
+                    self._last_check = now
+        return self._catalog
+
+
+catalog_store = CatalogStore()
@@ -2,49 +2,155 @@
 import os
 import json
 import google.generativeai as genai
+from utils.genai_pool import resolve_api_key, key_fingerprint
+from utils.gemini_scheduler import generate_content, estimate_tokens
+from utils.single_flight import model_calls, fingerprint
+from utils.result_cache import classification_cache, prompt_version, make_key
+from utils.metrics import metrics
+from utils.models import Classification, ModelDecodeError, as_vision_analysis, decode_classification, dump
 
-def classify_project(analysis_data, api_key_override=None):
-    """
-    Uses Gemini to classify the interior design project into business categories,
-    risk tiers, and complexity levels.
-    """
-    try:
-        api_key = api_key_override or os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            return {"error": "API Key not found"}
-
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("models/gemini-flash-latest")
+CLASSIFIER_MODEL_NAME = "models/gemini-flash-latest"
 
-        prompt = f"""
-        Given the following interior design vision analysis, classify the project into:
+# Shared with the fused vision + classification prompt in agent/vision_reader.py
+CLASSIFICATION_TASKS = """
         1. Project Type (e.g., Commercial, Residential, Hospitality, Industrial)
         2. Complexity Level (Low, Medium, High)
         3. Estimated Timeline (Weeks)
         4. Main Risk Factors
         5. Priority Ranking of items (Which items are critical vs optional)
+"""
 
-        Analysis Data:
-        {json.dumps(analysis_data, indent=2)}
-
-        Output MUST be valid JSON with the following structure:
-        {{
+CLASSIFICATION_SCHEMA = """
+        {
             "project_type": "",
             "complexity_level": "",
             "estimated_timeline_weeks": 0,
             "risk_factors": [],
             "item_prioritization": [
-                {{"item_name": "", "priority": "Critical|High|Medium|Low", "rationale": ""}}
+                {"item_name": "", "priority": "Critical|High|Medium|Low", "rationale": ""}
             ]
-        }}
+        }
+"""
+
+def is_valid_classification(data):
+    """
+    True if `data` (a Classification or a plain dict) has every classifier
+    field with the expected type, i.e. it can be returned as
+    business_classification as-is.
+    """
+    if isinstance(data, Classification):
+        return True
+    try:
+        Classification.from_dict(data)
+    except ModelDecodeError:
+        return False
+    return True
+
+
+def compact_analysis(analysis_data):
+    """
+    Just the parts of a vision analysis the classifier uses: room, style,
+    quality tier, the complexity flags that are set, and each item's name,
+    category, quantity and material. Notes, confidences, cost-saving points
+    and buying recommendations are left out. Items are in a canonical order,
+    so the same content always gives the same prompt.
+    """
+    analysis = as_vision_analysis(analysis_data)
+    items = []
+    for item in analysis.items:
+        entry = {"name": item.name, "category": item.category, "qty": item.quantity}
+        if item.material_guess:
+            entry["material"] = item.material_guess
+        items.append(entry)
+    items.sort(key=lambda entry: json.dumps(entry, sort_keys=True, ensure_ascii=False))
+    return {
+        "room_type": analysis.room_type,
+        "style": analysis.style_guess,
+        "quality_tier": analysis.quality_tier_guess.tier,
+        "flags": sorted(flag for flag, on in analysis.complexity_flags.items() if on),
+        "items": items,
+    }
+
+
+def classification_fingerprint(compact):
+    """
+    Key for a compact analysis: all of it, as canonical JSON. Everything the
+    prompt sends is covered, so a cached classification is only reused for
+    an identical prompt; analyses that differ only in the fields
+    compact_analysis drops (or in item order) still share one.
+    """
+    return fingerprint(json.dumps(compact, sort_keys=True, separators=(",", ":"), ensure_ascii=False))
+
+
+CLASSIFIER_PROMPT_TEMPLATE = """
+        Given the following interior design vision analysis, classify the project into:
+{tasks}
+        Analysis Data (items: name, category, qty, material; flags: complexity features present):
+        {analysis}
+
+        Output MUST be valid JSON with the following structure:
+{schema}
         """
 
+# Part of the cache key, so editing the prompt retires classifications made with the old one
+CLASSIFIER_PROMPT_VERSION = prompt_version(CLASSIFIER_PROMPT_TEMPLATE, CLASSIFICATION_TASKS, CLASSIFICATION_SCHEMA)
+
+CLASSIFIER_TOKENS_SAVED = metrics.counter(
+    "classifier_prompt_tokens_saved_total", "Estimated input tokens saved by the compact classifier prompt")
+
+
+def build_classifier_prompt(analysis):
+    return CLASSIFIER_PROMPT_TEMPLATE.format(tasks=CLASSIFICATION_TASKS, analysis=analysis, schema=CLASSIFICATION_SCHEMA)
+
+
+def _report_tokens(analysis_data, prompt):
+    # What the prompt cost when the whole analysis was inlined as indented JSON
+    full = estimate_tokens(build_classifier_prompt(json.dumps(dump(analysis_data), indent=2)), output_tokens=0)
+    compact = estimate_tokens(prompt, output_tokens=0)
+    CLASSIFIER_TOKENS_SAVED.inc(max(0, full - compact))
+    saved = (1 - compact / full) * 100 if full else 0.0
+    print(f"🧮 CLASSIFY: ~{compact} prompt tokens instead of ~{full} for the full analysis ({saved:.0f}% fewer)")
+
+
+def classify_project(analysis_data, api_key_override=None):
+    """
+    Uses Gemini to classify the interior design project into business categories,
+    risk tiers, and complexity levels.
+    Only a compact projection of the analysis is sent, and classifications are
+    cached by its fingerprint, so analyses identical in substance reuse one.
+    Returns the classification as a dict (the business_classification JSON),
+    or an {"error": ...} dict.
+    """
+    try:
+        compact = compact_analysis(analysis_data)
+        cache_key = make_key(classification_fingerprint(compact), CLASSIFIER_MODEL_NAME, CLASSIFIER_PROMPT_VERSION)
+        cached = classification_cache.get(cache_key)
+        if cached is not None:
+            print(f"⚡ CACHE HIT: Reusing classification for {compact['room_type']}")
+            return cached
+
+        try:
+            resolve_api_key(api_key_override)
+        except ValueError:
+            return {"error": "API Key not found"}
+
+        prompt = build_classifier_prompt(json.dumps(compact, separators=(",", ":"), ensure_ascii=False))
+        _report_tokens(analysis_data, prompt)
+
         generation_config = genai.GenerationConfig(
             response_mime_type="application/json"
         )
 
-        response = model.generate_content(prompt, generation_config=generation_config)
-        return json.loads(response.text.strip())
+        def call():
+            response = generate_content(CLASSIFIER_MODEL_NAME, prompt, api_key_override=api_key_override,
+                                        label="classify", generation_config=generation_config)
+            # Malformed answers raise ModelDecodeError here and are never cached
+            classification = decode_classification(response.text).to_dict()
+            classification_cache.set(cache_key, classification)
+            return classification
+
+        # Analyses identical in substance that are classified concurrently share one call
+        return model_calls.do(("classify", cache_key, key_fingerprint(api_key_override)), call)
 
     except Exception as e:
         print(f"Error in Classification: {e}")
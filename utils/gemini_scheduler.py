@@ -0,0 +1,348 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+
+from utils.genai_pool import get_pooled_model, resolve_api_key
+from utils.metrics import metrics, GEMINI_SECONDS, GEMINI_ERRORS, record_gemini_usage
+
+# Default per-key, per-model quotas (free tier for the flash models). Override
+# per model with GEMINI_MODEL_LIMITS='{"models/x": {"rpm": 10, "tpm": 250000}}'.
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "15"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_MODEL_LIMITS = json.loads(os.getenv("GEMINI_MODEL_LIMITS", "{}") or "{}")
+# How long a call may wait (queue + retries) when the caller gives no deadline
+GEMINI_DEFAULT_DEADLINE = float(os.getenv("GEMINI_DEFAULT_DEADLINE", "45"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "1.0"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "30"))
+# Output tokens assumed per call when reserving TPM ahead of the response
+GEMINI_OUTPUT_TOKENS = int(os.getenv("GEMINI_OUTPUT_TOKENS", "1024"))
+# Gemini bills an image as 258 tokens per 768px tile; uploads are capped at 1536px
+IMAGE_TOKEN_ESTIMATE = 1032
+
+_RETRY_IN_RE = re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE)
+_RETRY_DELAY_RE = re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)")
+
+
+class SchedulerDeadlineError(Exception):
+    """
+    Raised instead of calling Gemini when the quota (or a retry delay) means
+    the request cannot complete before its deadline.
+    """
+
+    def __init__(self, message, wait=None):
+        super().__init__(message)
+        self.wait = wait
+
+
+def is_rate_limit(error):
+    code = getattr(error, "code", None)
+    return code == 429 or "429" in str(error) or type(error).__name__ in ("ResourceExhausted", "TooManyRequests")
+
+
+def is_transient(error):
+    code = getattr(error, "code", None)
+    return code in (500, 502, 503, 504) or type(error).__name__ in (
+        "ServiceUnavailable", "InternalServerError", "DeadlineExceeded", "ConnectionError")
+
+
+def retry_after_seconds(error):
+    """
+    Server-suggested delay from a rate-limit error: an explicit retry_after,
+    a Retry-After header, or the RetryInfo / "retry in Ns" text Gemini puts in
+    the error message. None when the error carries no hint.
+    """
+    value = getattr(error, "retry_after", None)
+    if value is not None:
+        return float(value)
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("Retry-After"):
+        try:
+            return float(headers["Retry-After"])
+        except ValueError:
+            pass
+    text = str(error)
+    match = _RETRY_IN_RE.search(text) or _RETRY_DELAY_RE.search(text)
+    return float(match.group(1)) if match else None
+
+
+def estimate_tokens(contents, output_tokens=GEMINI_OUTPUT_TOKENS):
+    """
+    Rough token count for a generate_content payload (~4 chars per token for
+    text, a fixed cost per inline image) plus the expected output.
+    """
+    if not isinstance(contents, (list, tuple)):
+        contents = [contents]
+    total = output_tokens
+    for part in contents:
+        if isinstance(part, str):
+            total += len(part) // 4
+        elif isinstance(part, dict) and "data" in part:
+            total += IMAGE_TOKEN_ESTIMATE
+    return total
+
+
+class TokenBucket:
+    """
+    Continuous-refill bucket in "reservation" style: the balance may go
+    negative, so each take() pushes the next caller's wait_time() further out
+    and concurrent callers are spaced in arrival order without a separate queue.
+    """
+
+    def __init__(self, per_minute, clock):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def block_until(self, until, now):
+        # Drain the bucket so the next single-token take() is not ready before `until`
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - (until - now) * self.rate)
+
+
+class GeminiScheduler:
+    """
+    Central gate for Gemini calls.
+
+    Every (api key, model) pair has a requests-per-minute and a tokens-per-minute
+    bucket. A call reserves one request and its estimated tokens, waits its turn,
+    then runs; actual usage (usage_metadata) is reconciled afterwards, and a
+    failed attempt gives its estimated tokens back. A 429 or transient error
+    is retried with jittered exponential backoff, using the server's
+    Retry-After when given, and a 429 also pauses that key/model for everyone. A call is only refused (SchedulerDeadlineError) when its wait or
+    retry delay would run past its deadline.
+
+    `clock` and `sleep` are injectable so the scheduler can be driven by a fake
+    clock (see tests/test_gemini_scheduler.py).
+    """
+
+    def __init__(self, rpm=GEMINI_RPM, tpm=GEMINI_TPM, model_limits=None, max_retries=GEMINI_MAX_RETRIES,
+                 backoff_base=GEMINI_BACKOFF_BASE, backoff_max=GEMINI_BACKOFF_MAX,
+                 default_deadline=GEMINI_DEFAULT_DEADLINE, clock=time.monotonic, sleep=time.sleep):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.model_limits = model_limits if model_limits is not None else GEMINI_MODEL_LIMITS
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.default_deadline = default_deadline
+        self.clock = clock
+        self.sleep = sleep
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "waited_s": 0.0, "retries": 0, "rate_limited": 0, "shed": 0, "failed": 0}
+
+    def _bucket_key(self, api_key, model_name):
+        # Only a fingerprint of the key is kept
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12], model_name
+
+    def _buckets_for(self, key):
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            limits = self.model_limits.get(key[1], {})
+            buckets = (TokenBucket(limits.get("rpm", self.rpm), self.clock),
+                       TokenBucket(limits.get("tpm", self.tpm), self.clock))
+            self._buckets[key] = buckets
+        return buckets
+
+    def _reserve(self, key, tokens, deadline, label):
+        with self._lock:
+            now = self.clock()
+            requests_bucket, tokens_bucket = self._buckets_for(key)
+            wait = max(requests_bucket.wait_time(1, now), tokens_bucket.wait_time(tokens, now))
+            if now + wait > deadline:
+                self.stats["shed"] += 1
+                raise SchedulerDeadlineError(
+                    f"{label}: quota frees up in {wait:.1f}s, after the request deadline", wait)
+            requests_bucket.take(1, now)
+            tokens_bucket.take(tokens, now)
+            self.stats["waited_s"] += wait
+        return wait
+
+    def _reconcile(self, key, estimated, response):
+        usage = getattr(response, "usage_metadata", None)
+        actual = getattr(usage, "total_token_count", None) if usage is not None else None
+        if not actual:
+            return
+        with self._lock:
+            tokens_bucket = self._buckets_for(key)[1]
+            if actual < estimated:
+                tokens_bucket.give_back(estimated - actual)
+            else:
+                tokens_bucket.take(actual - estimated, self.clock())
+
+    def _refund(self, key, tokens):
+        # A failed attempt was not billed against the token quota; its request slot stays used
+        with self._lock:
+            self._buckets_for(key)[1].give_back(tokens)
+
+    def _backoff(self, attempt, error):
+        hinted = retry_after_seconds(error)
+        if hinted is not None:
+            return hinted + random.uniform(0, 0.25 * max(hinted, 1.0))
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    def call(self, fn, api_key, model_name, estimated_tokens=GEMINI_OUTPUT_TOKENS, deadline=None, label="gemini",
+             reconcile=True):
+        """
+        Runs fn() under the quota for (api_key, model_name) and returns its result.
+        `deadline` is a clock() timestamp; defaults to now + default_deadline.
+        With reconcile=False the caller reports actual usage itself via
+        reconcile() (streamed responses only know it after the last chunk).
+        """
+        if deadline is None:
+            deadline = self.clock() + self.default_deadline
+        key = self._bucket_key(api_key, model_name)
+
+        for attempt in range(self.max_retries + 1):
+            wait = self._reserve(key, estimated_tokens, deadline, label)
+            if wait > 0:
+                self.sleep(wait)
+            self.stats["calls"] += 1
+            try:
+                response = fn()
+            except Exception as e:
+                self._refund(key, estimated_tokens)
+                rate_limited = is_rate_limit(e)
+                if not (rate_limited or is_transient(e)) or attempt == self.max_retries:
+                    self.stats["failed"] += 1
+                    raise
+                delay = self._backoff(attempt, e)
+                if rate_limited:
+                    self.stats["rate_limited"] += 1
+                    with self._lock:
+                        now = self.clock()
+                        self._buckets_for(key)[0].block_until(now + delay, now)
+                if self.clock() + delay > deadline:
+                    self.stats["shed"] += 1
+                    raise SchedulerDeadlineError(
+                        f"{label}: retry needed in {delay:.1f}s, after the request deadline", delay) from e
+                print(f"🔁 GEMINI: {label} {'rate limited' if rate_limited else 'failed'} ({e}), "
+                      f"retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                self.stats["retries"] += 1
+                self.sleep(delay)
+                continue
+            if reconcile:
+                self._reconcile(key, estimated_tokens, response)
+            return response
+
+    def reconcile(self, api_key, model_name, estimated_tokens, response):
+        self._reconcile(self._bucket_key(api_key, model_name), estimated_tokens, response)
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "waited_s": round(self.stats["waited_s"], 2), "buckets": len(self._buckets)}
+
+
+gemini_scheduler = GeminiScheduler()
+metrics.add_collector("gemini_scheduler", gemini_scheduler.get_stats)
+
+
+def _request_kwargs(kwargs, deadline, label):
+    """
+    generate_content kwargs with the HTTP request bounded by the time left
+    before `deadline`, measured when the scheduler admits the attempt (after
+    any quota wait or retry delay). An explicit request_options wins.
+    """
+    if deadline is None or "request_options" in kwargs:
+        return kwargs
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise SchedulerDeadlineError(f"{label}: request deadline passed before the call started")
+    return {**kwargs, "request_options": {"timeout": remaining}}
+
+
+def generate_content(model_name, contents, api_key_override=None, deadline=None, label=None,
+                     output_tokens=GEMINI_OUTPUT_TOKENS, **kwargs):
+    """
+    Pooled model + scheduler: the way every Gemini generate_content call should be made.
+    `deadline` is a time.monotonic() timestamp; it also bounds each attempt's
+    HTTP request by the time left when that attempt starts. Raises ValueError if no API key is
+    available, SchedulerDeadlineError if the call cannot fit before the deadline.
+    """
+    api_key = resolve_api_key(api_key_override)
+    model = get_pooled_model(model_name, api_key_override)
+    label = label or model_name.rsplit("/", 1)[-1]
+    # "image 2" -> "image", keeping the metric's label set small
+    kind = label.split(" ", 1)[0]
+    try:
+        with GEMINI_SECONDS.time(model=model_name, label=kind):
+            response = gemini_scheduler.call(
+                lambda: model.generate_content(contents, **_request_kwargs(kwargs, deadline, label)),
+                api_key, model_name,
+                estimated_tokens=estimate_tokens(contents, output_tokens), deadline=deadline, label=label,
+            )
+    except Exception as e:
+        GEMINI_ERRORS.inc(model=model_name, error=type(e).__name__)
+        raise
+    record_gemini_usage(model_name, response)
+    return response
+
+
+def stream_content(model_name, contents, api_key_override=None, deadline=None, label=None,
+                   output_tokens=GEMINI_OUTPUT_TOKENS, **kwargs):
+    """
+    Streaming counterpart of generate_content: yields the response text chunk
+    by chunk as the model produces it.
+
+    The scheduler gates and retries the call up to its first chunk; an error
+    after that is raised from the iteration, since part of the answer has
+    already been consumed. Token usage is reconciled once the stream ends,
+    is abandoned or fails.
+    """
+    api_key = resolve_api_key(api_key_override)
+    model = get_pooled_model(model_name, api_key_override)
+    label = label or model_name.rsplit("/", 1)[-1]
+    kind = label.split(" ", 1)[0]
+    estimated = estimate_tokens(contents, output_tokens)
+    response = None
+    try:
+        with GEMINI_SECONDS.time(model=model_name, label=kind):
+            response = gemini_scheduler.call(
+                lambda: model.generate_content(contents, stream=True, **_request_kwargs(kwargs, deadline, label)),
+                api_key, model_name,
+                estimated_tokens=estimated, deadline=deadline, label=label, reconcile=False,
+            )
+            for chunk in response:
+                text = chunk.text
+                if text:
+                    yield text
+    except Exception as e:
+        GEMINI_ERRORS.inc(model=model_name, error=type(e).__name__)
+        raise
+    finally:
+        # Also when the consumer stops early (client disconnect closes the generator): the call
+        # reserved its estimated tokens, and whatever usage arrived is settled against them
+        if response is not None:
+            try:
+                gemini_scheduler.reconcile(api_key, model_name, estimated, response)
+                record_gemini_usage(model_name, response)
+            except Exception as e:
+                print(f"⚠️ GEMINI: Could not reconcile {label} usage: {e}")
+
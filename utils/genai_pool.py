@@ -0,0 +1,155 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+
+from utils.metrics import metrics
+
+# How many distinct user keys (X-Gemini-API-Key) keep a live transport; the server key is never evicted
+GENAI_POOL_MAX_KEYS = int(os.getenv("GENAI_POOL_MAX_KEYS", "32"))
+
+
+def resolve_api_key(api_key_override=None):
+    """
+    Returns the key to use for a request: the caller's override, else GOOGLE_API_KEY.
+    """
+    api_key = api_key_override or os.getenv("GOOGLE_API_KEY")
+
+    # If not in env, try reloading .env just in case we are in a sub-process
+    if not api_key:
+        from dotenv import load_dotenv
+        load_dotenv()
+        api_key = os.getenv("GOOGLE_API_KEY")
+
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY is missing. Use 'X-Gemini-API-Key' header to provide one.")
+    return api_key
+
+
+def key_fingerprint(api_key_override=None):
+    """
+    Short hash of the key a request will use, for keying per-key state
+    (single-flight calls, quota buckets) without keeping the key itself.
+    """
+    return hashlib.sha256(resolve_api_key(api_key_override).encode("utf-8")).hexdigest()[:12]
+
+
+class GenaiInternals:
+    """
+    The one place that reaches into google-generativeai internals.
+
+    The library only supports a process-wide key (genai.configure), so a
+    per-key transport needs its private client._ClientManager, and binding a
+    model to that transport needs GenerativeModel._client. Both are checked
+    against the release range they are known to work with (SUPPORTED, also
+    pinned in requirements.txt) before first use, so an upgrade fails loudly
+    instead of silently sending every request with the global key.
+    """
+
+    SUPPORTED = ((0, 3), (0, 9))  # [min, max) (major, minor) of google-generativeai
+
+    def __init__(self, version=genai.__version__):
+        parsed = tuple(int(part) for part in re.findall(r"\d+", version)[:2])
+        low, high = self.SUPPORTED
+        if not low <= parsed < high or not hasattr(genai_client, "_ClientManager"):
+            raise RuntimeError(f"google-generativeai {version} is not supported by the model pool "
+                               f"(needs >={low[0]}.{low[1]},<{high[0]}.{high[1]})")
+
+    def transport(self, api_key):
+        """
+        A GenerativeServiceClient using `api_key`, independent of genai.configure().
+        """
+        manager = genai_client._ClientManager()
+        manager.configure(api_key=api_key)
+        return manager.get_default_client("generative")
+
+    def model(self, model_name, transport):
+        """
+        GenerativeModel bound to `transport` (it would otherwise bind lazily to the global default client).
+        """
+        model = genai.GenerativeModel(model_name)
+        if not hasattr(model, "_client"):
+            raise RuntimeError("GenerativeModel no longer has a _client to bind a per-key transport to")
+        model._client = transport
+        return model
+
+
+_internals = None
+
+
+def genai_internals():
+    global _internals
+    if _internals is None:
+        _internals = GenaiInternals()
+    return _internals
+
+
+class ModelPool:
+    """
+    Thread-safe cache of GenerativeModel objects keyed by (api key, model name).
+
+    Each api key gets its own client manager, so the transport (and its
+    connections) is shared by every model using that key and nothing touches
+    the process-wide genai.configure() state. Rarely used user keys are evicted
+    LRU once more than `max_keys` are live.
+    """
+
+    def __init__(self, max_keys=GENAI_POOL_MAX_KEYS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._transports = OrderedDict()   # api_key -> GenerativeServiceClient
+        self._models = {}                  # (api_key, model_name) -> GenerativeModel
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _make_transport(self, api_key):
+        return genai_internals().transport(api_key)
+
+    def _evict(self, pinned_key):
+        while len(self._transports) > self.max_keys:
+            victim = next((k for k in self._transports if k != pinned_key), None)
+            if victim is None:
+                return
+            self._transports.pop(victim)
+            for model_key in [mk for mk in self._models if mk[0] == victim]:
+                self._models.pop(model_key)
+            self.stats["evictions"] += 1
+
+    def get(self, model_name, api_key_override=None):
+        api_key = resolve_api_key(api_key_override)
+        model_key = (api_key, model_name)
+
+        with self._lock:
+            model = self._models.get(model_key)
+            if model is not None:
+                self._transports.move_to_end(api_key)
+                self.stats["hits"] += 1
+                return model
+
+            self.stats["misses"] += 1
+            transport = self._transports.get(api_key)
+            if transport is None:
+                transport = self._make_transport(api_key)
+                self._transports[api_key] = transport
+            self._transports.move_to_end(api_key)
+
+            model = genai_internals().model(model_name, transport)
+            self._models[model_key] = model
+
+            self._evict(pinned_key=os.getenv("GOOGLE_API_KEY"))
+            return model
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "keys": len(self._transports), "models": len(self._models)}
+
+
+model_pool = ModelPool()
+metrics.add_collector("model_pool", model_pool.get_stats)
+
+
+def get_pooled_model(model_name, api_key_override=None):
+    return model_pool.get(model_name, api_key_override)
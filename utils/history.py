@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import base64
+import threading
+from datetime import datetime
+from collections import OrderedDict
+
+from utils import supabase_handler
+from utils.persistence_queue import persistence_queue
+from utils.metrics import metrics
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", "100"))
+HISTORY_CACHE_TTL = float(os.getenv("HISTORY_CACHE_TTL", "300"))
+# Users whose pages are kept in memory (least recently read evicted first)
+HISTORY_CACHE_USERS = int(os.getenv("HISTORY_CACHE_USERS", "1000"))
+
+TIERS = ("economy", "standard", "premium")
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(row):
+    payload = json.dumps([row["created_at"], row["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    (created_at, id) from a cursor made by encode_cursor. Both end up in a
+    PostgREST filter string, so the id must be an int and created_at an ISO
+    timestamp (returned re-serialized, never as the client sent it).
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        if type(row_id) is not int or not isinstance(created_at, str):
+            raise ValueError("Unexpected cursor types")
+        created_at = datetime.fromisoformat(created_at).isoformat()
+    except Exception:
+        raise InvalidCursorError("Invalid history cursor")
+    return created_at, row_id
+
+
+def _summary(row):
+    return {
+        "id": row.get("id"),
+        "created_at": row.get("created_at"),
+        "room_type": row.get("room_type"),
+        "style_guess": row.get("style_guess"),
+        "totals": {tier: row.get(f"{tier}_total") for tier in TIERS},
+    }
+
+
+class HistoryCache:
+    """
+    Per-user read-through cache for history pages and full analyses.
+
+    Entries live for `ttl` seconds, but the persistence queue invalidates a
+    user's entries as soon as a new row for that user is written, so a fresh
+    analysis shows up on the next read rather than after the TTL. A generation
+    counter per user stops a read that started before an invalidation from
+    caching what it fetched.
+    """
+
+    def __init__(self, ttl=HISTORY_CACHE_TTL, max_users=HISTORY_CACHE_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> {key: (expires_at, value)}
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get_or_load(self, user_id, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entries = self._users.get(user_id)
+            if entries is not None:
+                self._users.move_to_end(user_id)
+                hit = entries.get(key)
+                if hit is not None and hit[0] > now:
+                    self.stats["hits"] += 1
+                    return hit[1]
+            self.stats["misses"] += 1
+            generation = self._generations.get(user_id, 0)
+
+        value = loader()
+
+        with self._lock:
+            if self._generations.get(user_id, 0) == generation:
+                self._users.setdefault(user_id, {})[key] = (time.monotonic() + self.ttl, value)
+                self._users.move_to_end(user_id)
+                while len(self._users) > self.max_users:
+                    evicted, _ = self._users.popitem(last=False)
+                    self._generations.pop(evicted, None)
+        return value
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self.stats["invalidations"] += 1
+
+    def invalidate_rows(self, rows):
+        for user_id in {row.get("user_id") for row in rows}:
+            if user_id is not None:
+                self.invalidate(user_id)
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "users": len(self._users)}
+
+
+history_cache = HistoryCache()
+persistence_queue.add_listener(history_cache.invalidate_rows)
+metrics.add_collector("history_cache", history_cache.get_stats)
+
+
+def get_history_page(user_id, limit=None, cursor=None):
+    """
+    {"items": [summary, ...], "next_cursor": str | None} for one page of a
+    user's analyses, newest first. Pass next_cursor back to get the next page.
+    Raises InvalidCursorError for a malformed cursor.
+    """
+    limit = max(1, min(int(limit or HISTORY_PAGE_SIZE), HISTORY_PAGE_MAX))
+    before = decode_cursor(cursor)
+
+    def load():
+        rows = supabase_handler.get_user_history_page(user_id, limit, before)
+        items = [_summary(row) for row in rows[:limit]]
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return {"items": items, "next_cursor": next_cursor}
+
+    return history_cache.get_or_load(user_id, ("page", limit, cursor), load)
+
+
+def get_history_item(user_id, analysis_id):
+    """
+    Full stored payload for one analysis (None if not found for this user).
+    """
+    return history_cache.get_or_load(
+        user_id, ("item", str(analysis_id)), lambda: supabase_handler.get_analysis(user_id, analysis_id)
+    )
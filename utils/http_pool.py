@@ -0,0 +1,158 @@
+import os
+import threading
+
+import httpx
+
+from utils.metrics import metrics
+
+# HTTP/2 needs the optional h2 package (pip install httpx[http2]); without it the pools speak HTTP/1.1
+try:
+    import h2  # noqa: F401
+    _HAS_H2 = True
+except ImportError:
+    _HAS_H2 = False
+
+HTTP2_ENABLED = os.getenv("HTTP2", "on").lower() not in ("0", "off", "false") and _HAS_H2
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+# Per upstream host: connections open at once, and how many idle ones are kept warm between requests
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "90"))
+# Read size when streaming a download to its destination
+HTTP_DOWNLOAD_CHUNK = int(os.getenv("HTTP_DOWNLOAD_CHUNK_KB", "64")) * 1024
+
+
+def timeout(read=HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT):
+    """
+    httpx.Timeout with the pool's connect timeout; `read` also bounds writes
+    and waiting for a free connection. Pass read=None for no read limit.
+    """
+    if read is not None and connect is not None:
+        connect = min(connect, read)
+    return httpx.Timeout(read, connect=connect)
+
+
+def client_options(module=httpx):
+    """
+    Keyword arguments for a pooled client of `module` (httpx, or an
+    API-compatible fork such as the one huggingface_hub uses).
+    """
+    return {
+        "http2": HTTP2_ENABLED,
+        "limits": module.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY),
+        "timeout": module.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    }
+
+
+def _open_connections(client):
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    return len(getattr(pool, "connections", ()))
+
+
+class HttpPool:
+    """
+    Process-wide outbound HTTP clients, one per upstream service.
+
+    Each service (Pollinations, Supabase, ...) talks to a single host, so
+    giving each its own httpx.Client makes the connection limits per host:
+    a slow image host cannot use up the connections Supabase needs.
+    Connections are kept alive between requests (and multiplexed over
+    HTTP/2 where the server offers it), so only the first request to a host
+    pays the TCP + TLS handshake.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._external = {}  # name -> zero-arg callable returning a client created elsewhere
+        self._lock = threading.Lock()
+        self.stats = {"clients": 0, "requests": 0}
+
+    def _count_request(self, request):
+        with self._lock:
+            self.stats["requests"] += 1
+
+    def client(self, name):
+        """
+        Shared httpx.Client for the `name` upstream, created on first use.
+        Do not close it.
+        """
+        client = self._clients.get(name)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(name)
+            if client is None:
+                client = httpx.Client(follow_redirects=True, event_hooks={"request": [self._count_request]},
+                                      **client_options())
+                self._clients[name] = client
+                self.stats["clients"] += 1
+        return client
+
+    def register(self, name, get_client):
+        """
+        Reports a client owned by a library (e.g. huggingface_hub's shared
+        session) alongside the pool's own in get_stats().
+        """
+        with self._lock:
+            self._external[name] = get_client
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            client.close()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            clients = dict(self._clients)
+            external = dict(self._external)
+        for name, client in clients.items():
+            stats[f"{name}_connections"] = _open_connections(client)
+        for name, get_client in external.items():
+            stats[f"{name}_connections"] = _open_connections(get_client())
+        stats["http2"] = HTTP2_ENABLED
+        return stats
+
+
+http_pool = HttpPool()
+metrics.add_collector("http_pool", http_pool.get_stats)
+
+_hf_configured = False
+_hf_lock = threading.Lock()
+
+
+def configure_huggingface():
+    """
+    Makes huggingface_hub's process-wide session use the pool's limits and
+    timeouts (it otherwise has no read timeout). Safe to call repeatedly.
+
+    Uses huggingface_hub's client factory hook (utils._http), available from
+    1.0 on, the minimum pinned in requirements.txt; where the hook is missing
+    the library's own session is left alone.
+    """
+    global _hf_configured
+    if _hf_configured:
+        return
+    with _hf_lock:
+        if _hf_configured:
+            return
+        try:
+            from huggingface_hub.utils import _http as hf_http
+        except ImportError:
+            _hf_configured = True
+            return
+        if not all(hasattr(hf_http, attr) for attr in ("set_client_factory", "get_session", "hf_request_event_hook")):
+            _hf_configured = True
+            return
+        module = hf_http.httpx2 if hasattr(hf_http, "httpx2") else httpx
+
+        def factory():
+            return module.Client(event_hooks={"request": [hf_http.hf_request_event_hook]}, follow_redirects=True,
+                                 **client_options(module))
+
+        hf_http.set_client_factory(factory)
+        _hf_configured = True
+    http_pool.register("huggingface", hf_http.get_session)
@@ -0,0 +1,147 @@
+import io
+import os
+import time
+
+from PIL import Image, ImageOps
+
+from utils.metrics import STAGE_SECONDS
+
+# Tunables (env so they can be changed per deployment without a code push)
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1536"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+# Assumed client->Gemini uplink, only used to estimate the upload time saved
+IMAGE_UPLINK_MBPS = float(os.getenv("IMAGE_UPLINK_MBPS", "20"))
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+def detect_mime_type(data):
+    """
+    Detects the real image format from the file's magic bytes.
+    Returns None when the bytes are not a format we recognise.
+    """
+    header = bytes(data[:12])
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if header[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1", b"ftypmsf1"):
+        return "image/heic"
+    if header.startswith(b"BM"):
+        return "image/bmp"
+    return None
+
+
+class PreparedImage:
+    """
+    Normalized image bytes ready to hand to a provider, plus size/latency stats.
+    """
+    __slots__ = ("data", "mime_type", "original_bytes", "width", "height", "elapsed_ms")
+
+    def __init__(self, data, mime_type, original_bytes, width=None, height=None, elapsed_ms=0.0):
+        self.data = data
+        self.mime_type = mime_type
+        self.original_bytes = original_bytes
+        self.width = width
+        self.height = height
+        self.elapsed_ms = elapsed_ms
+
+    @property
+    def bytes_saved(self):
+        return self.original_bytes - len(self.data)
+
+    @property
+    def upload_ms_saved(self):
+        """
+        Estimated upload time saved at IMAGE_UPLINK_MBPS, net of the time spent preprocessing.
+        """
+        bytes_per_ms = IMAGE_UPLINK_MBPS * 1_000_000 / 8 / 1000
+        return self.bytes_saved / bytes_per_ms - self.elapsed_ms
+
+    def as_part(self):
+        """
+        Returns the inline-data part that genai.generate_content expects.
+        """
+        return {"mime_type": self.mime_type, "data": self.data}
+
+    def report(self, label="image"):
+        print(
+            f"🗜️ PREPROCESS: {label} {self.original_bytes / 1024:.0f}KB -> {len(self.data) / 1024:.0f}KB "
+            f"(saved {self.bytes_saved / 1024:.0f}KB, {self.elapsed_ms:.0f}ms, "
+            f"est. upload delta {-self.upload_ms_saved:+.0f}ms)"
+        )
+
+
+def prepare_image(data, max_edge=None, quality=None, image_format=None):
+    """
+    Fixes EXIF orientation, downsizes to `max_edge` and re-encodes to JPEG/WebP.
+
+    If the bytes cannot be decoded by Pillow they are passed through untouched
+    with the mime type sniffed from the magic bytes, so the provider can still
+    reject or accept them itself.
+    """
+    prepared = _prepare_image(data, max_edge, quality, image_format)
+    STAGE_SECONDS.observe(prepared.elapsed_ms / 1000, stage="preprocess")
+    return prepared
+
+
+def _prepare_image(data, max_edge, quality, image_format):
+    max_edge = max_edge or IMAGE_MAX_EDGE
+    quality = quality or IMAGE_QUALITY
+    image_format = (image_format or IMAGE_FORMAT).upper()
+    if image_format not in ("JPEG", "WEBP"):
+        image_format = "JPEG"
+
+    start = time.perf_counter()
+    original_bytes = len(data)
+    sniffed_mime = detect_mime_type(data) or "image/jpeg"
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            rotated = img.getexif().get(0x0112, 1) != 1
+            img = ImageOps.exif_transpose(img)
+            if max(img.size) > max_edge:
+                img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+
+            buffer = io.BytesIO()
+            img.save(buffer, format=image_format, quality=quality, optimize=True)
+            width, height = img.size
+    except Exception as e:
+        print(f"⚠️ PREPROCESS: Could not decode image ({e}), sending original bytes")
+        return PreparedImage(bytes(data), sniffed_mime, original_bytes,
+                             elapsed_ms=(time.perf_counter() - start) * 1000)
+
+    encoded = buffer.getvalue()
+    # Small, already-compressed uploads can grow when re-encoded; keep the original then
+    if len(encoded) >= original_bytes and not rotated \
+            and sniffed_mime in ("image/jpeg", "image/png", "image/webp"):
+        return PreparedImage(bytes(data), sniffed_mime, original_bytes, width, height,
+                             (time.perf_counter() - start) * 1000)
+
+    return PreparedImage(encoded, MIME_TYPES[image_format], original_bytes, width, height,
+                         (time.perf_counter() - start) * 1000)
+
+
+def read_image_source(source):
+    """
+    Accepts a file path or in-memory bytes / bytearray / memoryview and returns
+    (data, label). In-memory buffers are returned as-is, without a copy.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return source, f"upload ({len(source) / 1024:.0f}KB)"
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"Image not found at {source}")
+    with open(source, "rb") as f:
+        return f.read(), os.path.basename(source)
+
+
+def prepare_image_file(image_path, **kwargs):
+    with open(image_path, "rb") as f:
+        return prepare_image(f.read(), **kwargs)
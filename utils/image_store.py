@@ -0,0 +1,266 @@
+import os
+import re
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+
+from utils.result_cache import hash_bytes
+from utils.image_preprocess import detect_mime_type
+from utils.metrics import metrics
+
+# Store location: Vercel only allows writes under /tmp
+if os.getenv("VERCEL"):
+    DEFAULT_STORE_DIR = "/tmp/image_store"
+else:
+    DEFAULT_STORE_DIR = os.path.join("temp", "image_store")
+
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", DEFAULT_STORE_DIR)
+IMAGE_STORE_MAX_MB = float(os.getenv("IMAGE_STORE_MAX_MB", "256"))
+# Largest single image accepted from a stream (e.g. a fallback download); bigger ones are aborted mid-transfer
+IMAGE_MAX_DOWNLOAD_MB = float(os.getenv("IMAGE_MAX_DOWNLOAD_MB", "20"))
+IMAGE_URL_PREFIX = "/api/v1/images/"
+# How a stored image reaches the browser:
+#   local    - served by this process from IMAGE_URL_PREFIX
+#   supabase - uploaded to a public Supabase Storage bucket, keyed by its content-addressed name
+#   inline   - a data: URI carrying the bytes
+# Unset means local, except on Vercel: instances do not share /tmp, so a local URL can 404 when the
+# browser's request lands on another instance. There it is supabase when configured, else inline.
+IMAGE_DELIVERY = os.getenv("IMAGE_DELIVERY", "").strip().lower()
+IMAGE_STORAGE_BUCKET = os.getenv("IMAGE_STORAGE_BUCKET", "generated-images")
+DELIVERY_MODES = ("local", "supabase", "inline")
+
+# 96 bits of sha256 is plenty to address a few thousand images and keeps URLs short
+DIGEST_LENGTH = 24
+
+EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/webp": "webp",
+    "image/gif": "gif",
+}
+MIME_TYPES = {ext: mime for mime, ext in EXTENSIONS.items()}
+_NAME_RE = re.compile(r"^[0-9a-f]{%d}\.(png|jpg|webp|gif)$" % DIGEST_LENGTH)
+
+
+class ImageStore:
+    """
+    Content-addressed store for generated images.
+
+    Files are named by the hash of their bytes, so identical outputs are stored
+    once and a name never changes meaning (safe to cache forever). Total size
+    is capped at `max_bytes`; the least recently stored or served files are
+    evicted first. The index is rebuilt from the directory on startup.
+    """
+
+    def __init__(self, directory=IMAGE_STORE_DIR, max_bytes=int(IMAGE_STORE_MAX_MB * 1024 * 1024),
+                 max_stream_bytes=int(IMAGE_MAX_DOWNLOAD_MB * 1024 * 1024), delivery=IMAGE_DELIVERY,
+                 bucket=IMAGE_STORAGE_BUCKET):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_stream_bytes = max_stream_bytes
+        if delivery and delivery not in DELIVERY_MODES:
+            print(f"⚠️ IMAGES: Unknown IMAGE_DELIVERY {delivery!r}, choosing automatically")
+            delivery = ""
+        self.delivery = delivery
+        self.bucket = bucket
+        self._entries = OrderedDict()  # name -> size, oldest first
+        self._published = {}  # name -> public Storage URL
+        self._total = 0
+        self._lock = threading.Lock()
+        self.stats = {"stored": 0, "deduped": 0, "evicted": 0, "served": 0, "oversized": 0,
+                      "published": 0, "inlined": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not _NAME_RE.match(name):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._entries[name] = size
+            self._total += size
+
+    def put(self, data):
+        """
+        Stores image bytes and returns their file name ("<digest>.<ext>").
+        """
+        ext = EXTENSIONS.get(detect_mime_type(data), "png")
+        name = f"{hash_bytes(data)[:DIGEST_LENGTH]}.{ext}"
+        path = os.path.join(self.directory, name)
+
+        if self._dedupe(name):
+            return name
+
+        # Write then rename so a concurrent reader never sees a partial file. The write happens
+        # outside the lock, so a large image does not hold up every other put and lookup.
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            with self._lock:
+                if not self._dedupe_locked(name):
+                    self._commit(name, tmp_path, len(data))
+                    return name
+            os.remove(tmp_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name
+
+    def put_stream(self, chunks):
+        """
+        Stores an image arriving as an iterable of byte chunks (e.g. a
+        download) without holding it in memory; returns its file name.
+        The chunks are hashed as they are written to a temporary file, which
+        is renamed to its content address at the end. Raises ValueError (and
+        stops reading) once the stream passes `max_stream_bytes`.
+        """
+        digest = hashlib.sha256()  # same content address as hash_bytes()
+        header = b""
+        size = 0
+        tmp_path = os.path.join(self.directory, f"incoming.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_stream_bytes:
+                        with self._lock:
+                            self.stats["oversized"] += 1
+                        raise ValueError(f"Image stream exceeds {self.max_stream_bytes} bytes")
+                    if len(header) < 12:
+                        header += chunk[:12 - len(header)]
+                    digest.update(chunk)
+                    f.write(chunk)
+            if not size:
+                raise ValueError("Empty image stream")
+
+            ext = EXTENSIONS.get(detect_mime_type(header), "png")
+            name = f"{digest.hexdigest()[:DIGEST_LENGTH]}.{ext}"
+            with self._lock:
+                if not self._dedupe_locked(name):
+                    self._commit(name, tmp_path, size)
+                    return name
+            os.remove(tmp_path)
+            return name
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _dedupe(self, name):
+        with self._lock:
+            return self._dedupe_locked(name)
+
+    def _dedupe_locked(self, name):
+        # True (and the entry refreshed) if `name` is already stored
+        if name in self._entries and os.path.exists(os.path.join(self.directory, name)):
+            self._entries.move_to_end(name)
+            self.stats["deduped"] += 1
+            return True
+        return False
+
+    def _commit(self, name, tmp_path, size):
+        # Caller holds the lock
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        self._total += size - self._entries.pop(name, 0)
+        self._entries[name] = size
+        self.stats["stored"] += 1
+        self._evict(keep=name)
+
+    def _evict(self, keep=None):
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            name, size = next(iter(self._entries.items()))
+            if name == keep:
+                break
+            del self._entries[name]
+            self._published.pop(name, None)
+            self._total -= size
+            self.stats["evicted"] += 1
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def path_for(self, name):
+        """
+        Absolute path of a stored image, or None for unknown / malformed names.
+        """
+        if not _NAME_RE.match(name or ""):
+            return None
+        path = os.path.abspath(os.path.join(self.directory, name))
+        with self._lock:
+            if name not in self._entries:
+                if not os.path.exists(path):
+                    return None
+                # Written by another worker process sharing the directory
+                size = os.path.getsize(path)
+                self._entries[name] = size
+                self._total += size
+            self._entries.move_to_end(name)
+            self.stats["served"] += 1
+        return path
+
+    def delivery_mode(self):
+        if self.delivery:
+            return self.delivery
+        if not os.getenv("VERCEL"):
+            return "local"
+        from utils.supabase_handler import supabase
+        return "supabase" if supabase is not None else "inline"
+
+    def public_url(self, name):
+        """
+        URL the browser should load a stored image from (see IMAGE_DELIVERY).
+        A failed Storage upload falls back to a data: URI, which always renders.
+        """
+        mode = self.delivery_mode()
+        if mode == "local":
+            return image_url(name)
+        if mode == "supabase":
+            url = self._published.get(name)
+            if url is not None:
+                return url
+            try:
+                from utils.supabase_handler import upload_public_object
+                url = upload_public_object(self.bucket, name, self._read(name), mime_type_for(name))
+            except Exception as e:
+                print(f"⚠️ IMAGES: Could not upload {name} to Supabase Storage, inlining it: {e}")
+            else:
+                with self._lock:
+                    self._published[name] = url
+                    self.stats["published"] += 1
+                return url
+        data_uri = f"data:{mime_type_for(name)};base64,{base64.b64encode(self._read(name)).decode('ascii')}"
+        with self._lock:
+            self.stats["inlined"] += 1
+        return data_uri
+
+    def _read(self, name):
+        with open(os.path.join(self.directory, name), "rb") as f:
+            return f.read()
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "files": len(self._entries), "bytes": self._total, "max_bytes": self.max_bytes,
+                    "delivery": self.delivery_mode()}
+
+
+def image_url(name):
+    return f"{IMAGE_URL_PREFIX}{name}"
+
+
+def etag_for(name):
+    return name.split(".", 1)[0]
+
+
+def mime_type_for(name):
+    return MIME_TYPES.get(name.rsplit(".", 1)[-1], "application/octet-stream")
+
+
+image_store = ImageStore()
+metrics.add_collector("image_store", image_store.get_stats)
@@ -0,0 +1,140 @@
+import os
+import json
+import threading
+from functools import lru_cache
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ITEM_RULES_PATH = os.getenv("ITEM_RULES_PATH", os.path.join(BASE_DIR, "data", "catalog_rules.json"))
+ITEM_MATCH_CACHE_SIZE = int(os.getenv("ITEM_MATCH_CACHE_SIZE", "8192"))
+
+
+class ItemMatcher:
+    """
+    Maps free-text item names to catalog keys in a single pass.
+
+    All rule keywords are compiled into one Aho-Corasick automaton, so a name is
+    scanned once regardless of how many rules exist; only rules that share a
+    keyword with the name are looked at afterwards. Keywords match as substrings
+    (like the original `in` checks), rules are ranked by priority (file order by
+    default) and a rule never fires if any of its `exclude` keywords is present.
+    """
+
+    def __init__(self, rules, cache_size=ITEM_MATCH_CACHE_SIZE):
+        self.rules = []
+        patterns = {}
+        # pattern id -> list of (rule index, group index); group -1 marks an exclusion
+        self._hits = []
+
+        def pattern_id(word):
+            word = word.lower()
+            if word not in patterns:
+                patterns[word] = len(patterns)
+                self._hits.append([])
+            return patterns[word]
+
+        for position, rule in enumerate(rules):
+            groups = rule.get("match") or []
+            index = len(self.rules)
+            self.rules.append((rule.get("priority", position), rule["key"], len(groups)))
+            for group_index, group in enumerate(groups):
+                for word in group:
+                    self._hits[pattern_id(word)].append((index, group_index))
+            for word in rule.get("exclude", []):
+                self._hits[pattern_id(word)].append((index, -1))
+
+        self._patterns = list(patterns)
+        self._build_automaton()
+        self.match = lru_cache(maxsize=cache_size)(self._match)
+
+    @classmethod
+    def from_file(cls, path=ITEM_RULES_PATH):
+        with open(path, "r") as f:
+            return cls(json.load(f)["rules"])
+
+    def _build_automaton(self):
+        goto = [{}]
+        outputs = [[]]
+        for pid, word in enumerate(self._patterns):
+            state = 0
+            for ch in word:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    outputs.append([])
+                state = nxt
+            outputs[state].append(pid)
+
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for state in queue:
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0) if goto[f].get(ch, 0) != nxt else 0
+                outputs[nxt] = outputs[nxt] + outputs[fail[nxt]]
+
+        self._goto = goto
+        self._fail = fail
+        self._outputs = outputs
+
+    def _scan(self, text):
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+        return found
+
+    def _match(self, item_name):
+        """
+        Returns (catalog_key, score) or (None, 0.0). The score is the share of
+        the name covered by the keywords that made the winning rule fire.
+        """
+        if not item_name:
+            return None, 0.0
+        text = item_name.lower()
+
+        satisfied = {}
+        excluded = set()
+        matched_chars = {}
+        for pid in self._scan(text):
+            for rule_index, group_index in self._hits[pid]:
+                if group_index < 0:
+                    excluded.add(rule_index)
+                    continue
+                satisfied.setdefault(rule_index, set()).add(group_index)
+                matched_chars[rule_index] = matched_chars.get(rule_index, 0) + len(self._patterns[pid])
+
+        best = None
+        for rule_index, groups in satisfied.items():
+            priority, key, group_count = self.rules[rule_index]
+            if rule_index in excluded or len(groups) < group_count:
+                continue
+            if best is None or priority < self.rules[best][0]:
+                best = rule_index
+
+        if best is None:
+            return None, 0.0
+        score = min(1.0, matched_chars[best] / len(text))
+        return self.rules[best][1], round(score, 3)
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def get_item_matcher():
+    global _matcher
+    if _matcher is None:
+        with _matcher_lock:
+            if _matcher is None:
+                _matcher = ItemMatcher.from_file()
+    return _matcher
@@ -0,0 +1,89 @@
+from utils.models import ModelDecodeError, decode_json
+
+
+class ArrayItemStream:
+    """
+    Incremental scanner for a JSON object arriving in chunks (a streamed model
+    answer). feed() returns each element of the top-level `key` array as soon
+    as its closing brace has been seen, decoded to a dict, without waiting
+    for the rest of the document.
+
+    Only object elements are reported; anything before the first '{' (a code
+    fence, a sentence of prose) is skipped. Each character is looked at once,
+    and the full text is kept in `text` for the final decode.
+    """
+    __slots__ = ("key", "text", "_pos", "_depth", "_in_string", "_escape", "_string_start", "_last_string",
+                 "_current_key", "_in_array", "_element_start")
+
+    def __init__(self, key="items"):
+        self.key = key
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._current_key = None
+        self._in_array = False
+        self._element_start = None
+
+    def feed(self, chunk):
+        """
+        Adds a chunk of text; returns the list of array elements it completed.
+        Elements that are not valid JSON are skipped (the final decode decides
+        what to do with them).
+        """
+        self.text += chunk
+        text = self.text
+        depth, in_string, escape = self._depth, self._in_string, self._escape
+        completed = []
+
+        for index in range(self._pos, len(text)):
+            char = text[index]
+            if in_string:
+                if escape:
+                    escape = False
+                elif char == "\\":
+                    escape = True
+                elif char == '"':
+                    in_string = False
+                    if depth == 1:
+                        self._last_string = text[self._string_start + 1:index]
+                continue
+            if depth == 0:
+                # Not inside the document yet (or past its end)
+                if char == "{":
+                    depth = 1
+                continue
+            if char == '"':
+                in_string = True
+                self._string_start = index
+            elif depth == 1 and char == ":":
+                self._current_key = self._last_string
+            elif depth == 1 and char == ",":
+                self._current_key = None
+            elif char == "{" or char == "[":
+                if depth == 1 and char == "[" and self._current_key == self.key:
+                    self._in_array = True
+                elif depth == 2 and self._in_array and char == "{":
+                    self._element_start = index
+                depth += 1
+            elif char == "}" or char == "]":
+                depth -= 1
+                if depth == 2 and self._in_array and self._element_start is not None:
+                    element = text[self._element_start:index + 1]
+                    self._element_start = None
+                    try:
+                        completed.append(decode_json(element))
+                    except ModelDecodeError:
+                        pass
+                elif depth == 1:
+                    self._in_array = False
+                elif depth == 0:
+                    # Document closed: ignore trailing text such as a closing code fence
+                    self._current_key = None
+
+        self._pos = len(text)
+        self._depth, self._in_string, self._escape = depth, in_string, escape
+        return completed
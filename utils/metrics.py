@@ -0,0 +1,237 @@
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+METRICS_PREFIX = os.getenv("METRICS_PREFIX", "instaspace")
+
+# Seconds; spans sub-millisecond stages (estimate, cache) up to slow image generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                                for key, value in items]
+
+
+class Histogram(_Metric):
+    """
+    Fixed-bucket histogram. observe() is a bisect plus two additions under a
+    lock, cheap enough to leave on for every stage of every request.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        series = self._values.get(self._key(labels))
+        return series[2] if series else 0
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, (list(series[0]), series[1], series[2])) for key, series in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Process-wide metrics in Prometheus text format.
+
+    Counters and histograms are updated inline by the code being measured.
+    Components that already keep their own stats (caches, pools, queues)
+    register a collector instead: a callable returning a flat dict of
+    numbers, read only when /api/v1/metrics is scraped, so they pay nothing
+    per request.
+    """
+
+    def __init__(self, prefix=METRICS_PREFIX):
+        self.prefix = prefix
+        self._metrics = []
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(f"{self.prefix}_{name}", documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(f"{self.prefix}_{name}", documentation, labelnames, buckets))
+
+    def add_collector(self, component, get_stats):
+        with self._lock:
+            self._collectors[component] = get_stats
+
+    def _render_collectors(self):
+        name = f"{self.prefix}_component_stat"
+        lines = [f"# HELP {name} Counters and gauges reported by caches, pools and queues",
+                 f"# TYPE {name} gauge"]
+        with self._lock:
+            collectors = sorted(self._collectors.items())
+        for component, get_stats in collectors:
+            try:
+                stats = get_stats()
+            except Exception as e:
+                print(f"⚠️ METRICS: Collector '{component}' failed: {e}")
+                continue
+            for stat, value in sorted(stats.items()):
+                # Booleans become 0/1; nested or text values are skipped
+                if isinstance(value, (bool, int, float)):
+                    labels = _format_labels(("component", "stat"), (component, stat))
+                    lines.append(f"{name}{labels} {_format_value(value)}")
+        return lines
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        lines.extend(self._render_collectors())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    "stage_seconds", "Latency of each processing stage (upload, preprocess, vision, estimate, ...)", ["stage"])
+STAGE_ERRORS = metrics.counter(
+    "stage_errors_total", "Stage failures by exception class", ["stage", "error"])
+GEMINI_SECONDS = metrics.histogram(
+    "gemini_call_seconds", "Gemini generate_content latency including quota waits and retries", ["model", "label"])
+MODEL_TOKENS = metrics.counter(
+    "model_tokens_total", "Input / output tokens reported by the model provider", ["model", "direction"])
+GEMINI_ERRORS = metrics.counter(
+    "gemini_errors_total", "Gemini calls that failed after retries, by exception class", ["model", "error"])
+FALLBACKS = metrics.counter(
+    "fallbacks_total", "Times a degraded path was taken instead of the primary one", ["kind"])
+
+
+def observe_stage(stage, seconds, error=None):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if error is not None:
+        STAGE_ERRORS.inc(stage=stage, error=type(error).__name__)
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Records the block's latency under `stage`, and its exception class if it raises.
+    """
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start, error)
+
+
+def record_fallback(kind):
+    FALLBACKS.inc(kind=kind)
+
+
+def record_tokens(model_name, input_tokens, output_tokens):
+    if input_tokens:
+        MODEL_TOKENS.inc(input_tokens, model=model_name, direction="input")
+    if output_tokens:
+        MODEL_TOKENS.inc(output_tokens, model=model_name, direction="output")
+
+
+def record_gemini_usage(model_name, response):
+    """
+    Adds the prompt / output token counts from a response's usage_metadata, if present.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        record_tokens(model_name, getattr(usage, "prompt_token_count", None) or 0,
+                      getattr(usage, "candidates_token_count", None) or 0)
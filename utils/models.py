@@ -0,0 +1,415 @@
+"""
+Typed results passed between the pipeline stages: the vision analysis, cost
+estimates and business classification.
+
+Model output is decoded and checked once, at the boundary (decode_vision /
+decode_classification); everything downstream reads attributes instead of
+re-walking dicts with .get() chains. Each class is slotted and to_dict()
+reproduces the response JSON the API has always returned.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # in requirements.txt for speed; the stdlib parser gives the same results
+    orjson = None
+
+
+class ModelDecodeError(ValueError):
+    """
+    Model output that is not JSON, or not the shape the prompt asked for.
+    """
+
+
+def _loads(text):
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
+def strip_code_fences(text):
+    """
+    Removes a Markdown code fence (```json ... ``` or ``` ... ```) around the text, if any.
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        newline = text.find("\n")
+        text = text[newline + 1:] if newline != -1 else text[3:]
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+        text = text.strip()
+    return text
+
+
+def decode_json(text):
+    """
+    Parses a model's JSON answer, tolerating code fences and stray prose
+    around the object. Raises ModelDecodeError if no JSON can be read.
+    """
+    if isinstance(text, (bytes, bytearray, memoryview)):
+        text = bytes(text).decode("utf-8", errors="replace")
+    body = strip_code_fences(text or "")
+    try:
+        return _loads(body)
+    except ValueError:
+        pass
+    # "Here is the analysis: {...}" - keep just the outermost object
+    start, end = body.find("{"), body.rfind("}")
+    if 0 <= start < end:
+        try:
+            return _loads(body[start:end + 1])
+        except ValueError:
+            pass
+    raise ModelDecodeError(f"Model output is not valid JSON: {body[:80]!r}")
+
+
+# -- coercion helpers: models drift on types ("2" for 2, "true" for true) --
+
+def _text(value, default=""):
+    if value.__class__ is str:
+        return value
+    return default if value is None else str(value)
+
+
+def _fraction(value, default=0.0):
+    if value.__class__ is float or value.__class__ is int:
+        return value
+    if isinstance(value, bool):
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def quantity(value, default=1):
+    """
+    An item quantity as a number. Ints and floats pass through untouched (the
+    pricing paths keep int/float costs apart); numeric strings are parsed.
+    """
+    if value.__class__ is int or value.__class__ is float:
+        return value
+    if isinstance(value, bool):
+        return default
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return default
+    return int(number) if number.is_integer() else number
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "yes", "1")
+    return bool(value)
+
+
+def _extra(data, known):
+    if data.keys() <= known:
+        return None
+    return {key: value for key, value in data.items() if key not in known}
+
+
+def _with_extra(out, extra):
+    if extra:
+        out.update(extra)
+    return out
+
+
+# -- vision analysis --------------------------------------------------------
+
+class VisionItem:
+    __slots__ = ("category", "name", "quantity", "material_guess", "notes", "confidence", "extra")
+
+    FIELDS = frozenset(__slots__)
+
+    def __init__(self, name, category="", quantity=1, material_guess="", notes="", confidence=0.0, extra=None):
+        self.category = category
+        self.name = name
+        self.quantity = quantity
+        self.material_guess = material_guess
+        self.notes = notes
+        self.confidence = confidence
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Returns None for entries that are not objects or have no name: they
+        cannot be priced or prioritized.
+        """
+        if not isinstance(data, dict) or not data.get("name"):
+            return None
+        return cls(_text(data["name"]), _text(data.get("category")), quantity(data.get("quantity", 1)),
+                   _text(data.get("material_guess")), _text(data.get("notes")),
+                   _fraction(data.get("confidence")), _extra(data, cls.FIELDS))
+
+    def to_dict(self):
+        return _with_extra({"category": self.category, "name": self.name, "quantity": self.quantity,
+                            "material_guess": self.material_guess, "notes": self.notes,
+                            "confidence": self.confidence}, self.extra)
+
+
+class QualityTier:
+    __slots__ = ("tier", "confidence")
+
+    def __init__(self, tier="", confidence=0.0):
+        self.tier = tier
+        self.confidence = confidence
+
+    @classmethod
+    def from_dict(cls, data):
+        if isinstance(data, dict):
+            return cls(_text(data.get("tier")), _fraction(data.get("confidence")))
+        # Some models answer with the bare tier name
+        return cls(_text(data))
+
+    def to_dict(self):
+        return {"tier": self.tier, "confidence": self.confidence}
+
+
+class BuyingRecommendation:
+    __slots__ = ("item_category", "store_suggestion", "price_tip")
+
+    def __init__(self, item_category="", store_suggestion="", price_tip=""):
+        self.item_category = item_category
+        self.store_suggestion = store_suggestion
+        self.price_tip = price_tip
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            return None
+        return cls(_text(data.get("item_category")), _text(data.get("store_suggestion")),
+                   _text(data.get("price_tip")))
+
+    def to_dict(self):
+        return {"item_category": self.item_category, "store_suggestion": self.store_suggestion,
+                "price_tip": self.price_tip}
+
+
+class VisionAnalysis:
+    """
+    The vision agent's extraction (see USER_PROMPT_TEMPLATE in agent/vision_reader.py).
+    Keys the schema does not know are kept in `extra` and written back by to_dict().
+    """
+    __slots__ = ("room_type", "style_guess", "quality_tier_guess", "items", "complexity_flags",
+                 "cost_saving_points", "buying_recommendations", "extra")
+
+    FIELDS = frozenset(__slots__)
+
+    def __init__(self, room_type="", style_guess="", quality_tier_guess=None, items=None, complexity_flags=None,
+                 cost_saving_points=None, buying_recommendations=None, extra=None):
+        self.room_type = room_type
+        self.style_guess = style_guess
+        self.quality_tier_guess = quality_tier_guess or QualityTier()
+        self.items = items or []
+        self.complexity_flags = complexity_flags or {}
+        self.cost_saving_points = cost_saving_points or []
+        self.buying_recommendations = buying_recommendations or []
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data, require_items=False):
+        """
+        Builds an analysis from decoded JSON, coercing drifted types. Raises
+        ModelDecodeError if `data` is not an object or `items` is not a list
+        (or, with require_items, is missing).
+        """
+        if not isinstance(data, dict):
+            raise ModelDecodeError(f"Vision analysis must be an object, got {type(data).__name__}")
+        raw_items = data.get("items")
+        if raw_items is None and not require_items:
+            raw_items = []
+        if not isinstance(raw_items, list):
+            raise ModelDecodeError("Vision analysis has no 'items' list")
+
+        items = [item for item in map(VisionItem.from_dict, raw_items) if item is not None]
+        if len(items) < len(raw_items):
+            print(f"⚠️ VISION: Dropped {len(raw_items) - len(items)} unnamed or malformed item(s)")
+        flags = data.get("complexity_flags")
+        points = data.get("cost_saving_points")
+        recommendations = data.get("buying_recommendations")
+        return cls(
+            _text(data.get("room_type")),
+            _text(data.get("style_guess")),
+            QualityTier.from_dict(data.get("quality_tier_guess")),
+            items,
+            {_text(flag): _flag(on) for flag, on in flags.items()} if isinstance(flags, dict) else {},
+            [_text(point) for point in points if point] if isinstance(points, list) else [],
+            [rec for rec in map(BuyingRecommendation.from_dict, recommendations) if rec is not None]
+            if isinstance(recommendations, list) else [],
+            _extra(data, cls.FIELDS),
+        )
+
+    def to_dict(self):
+        return _with_extra({
+            "room_type": self.room_type,
+            "style_guess": self.style_guess,
+            "quality_tier_guess": self.quality_tier_guess.to_dict(),
+            "items": [item.to_dict() for item in self.items],
+            "complexity_flags": dict(self.complexity_flags),
+            "cost_saving_points": list(self.cost_saving_points),
+            "buying_recommendations": [rec.to_dict() for rec in self.buying_recommendations],
+        }, self.extra)
+
+
+def decode_vision(text):
+    """
+    Model text -> VisionAnalysis; raises ModelDecodeError on malformed output.
+    """
+    return VisionAnalysis.from_dict(decode_json(text), require_items=True)
+
+
+def as_vision_analysis(value):
+    """
+    Accepts a VisionAnalysis or a plain dict (API request bodies, stored rows,
+    error payloads) and returns a VisionAnalysis.
+    """
+    return value if isinstance(value, VisionAnalysis) else VisionAnalysis.from_dict(value or {})
+
+
+# -- cost estimate ----------------------------------------------------------
+
+class EstimateLine:
+    __slots__ = ("name", "quantity", "unit_price", "cost")
+
+    def __init__(self, name, quantity, unit_price, cost):
+        self.name = name
+        self.quantity = quantity
+        self.unit_price = unit_price
+        self.cost = cost
+
+    def to_dict(self):
+        return {"name": self.name, "quantity": self.quantity, "unit_price": self.unit_price, "cost": self.cost}
+
+
+class TierEstimate:
+    __slots__ = ("items", "subtotal", "labor", "contingency", "total", "labor_percent", "contingency_percent")
+
+    def __init__(self, items=None, subtotal=0, labor=0, contingency=0, total=0, labor_percent=0.0,
+                 contingency_percent=0.0):
+        self.items = items if items is not None else []
+        self.subtotal = subtotal
+        self.labor = labor
+        self.contingency = contingency
+        self.total = total
+        self.labor_percent = labor_percent
+        self.contingency_percent = contingency_percent
+
+    def to_dict(self):
+        return {"items": [line.to_dict() for line in self.items], "subtotal": self.subtotal, "labor": self.labor,
+                "contingency": self.contingency, "total": self.total, "labor_percent": self.labor_percent,
+                "contingency_percent": self.contingency_percent}
+
+
+class Estimate:
+    """
+    One TierEstimate per pricing tier (economy, standard, premium).
+    """
+    __slots__ = ("economy", "standard", "premium")
+
+    TIERS = ("economy", "standard", "premium")
+
+    def __init__(self, economy=None, standard=None, premium=None):
+        self.economy = economy or TierEstimate()
+        self.standard = standard or TierEstimate()
+        self.premium = premium or TierEstimate()
+
+    @property
+    def tiers(self):
+        """
+        (tier name, TierEstimate) pairs, cheapest first.
+        """
+        return ((tier, getattr(self, tier)) for tier in self.TIERS)
+
+    def to_dict(self):
+        return {tier: estimate.to_dict() for tier, estimate in self.tiers}
+
+
+# -- business classification ------------------------------------------------
+
+class PriorityItem:
+    __slots__ = ("item_name", "priority", "rationale", "extra")
+
+    FIELDS = frozenset(__slots__)
+
+    def __init__(self, item_name, priority="", rationale="", extra=None):
+        self.item_name = item_name
+        self.priority = priority
+        self.rationale = rationale
+        self.extra = extra
+
+    def to_dict(self):
+        return _with_extra({"item_name": self.item_name, "priority": self.priority, "rationale": self.rationale},
+                           self.extra)
+
+
+class Classification:
+    """
+    The classifier's answer (see CLASSIFICATION_SCHEMA in utils/classifier.py).
+    """
+    __slots__ = ("project_type", "complexity_level", "estimated_timeline_weeks", "risk_factors",
+                 "item_prioritization", "extra")
+
+    FIELDS = frozenset(__slots__)
+
+    def __init__(self, project_type, complexity_level, estimated_timeline_weeks, risk_factors=None,
+                 item_prioritization=None, extra=None):
+        self.project_type = project_type
+        self.complexity_level = complexity_level
+        self.estimated_timeline_weeks = estimated_timeline_weeks
+        self.risk_factors = risk_factors or []
+        self.item_prioritization = item_prioritization or []
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Raises ModelDecodeError unless every schema field is present with a
+        usable type; an incomplete classification is never served as-is.
+        """
+        if not isinstance(data, dict) or "error" in data:
+            raise ModelDecodeError("Classification must be an object without an 'error' key")
+        project_type, complexity_level = data.get("project_type"), data.get("complexity_level")
+        if not isinstance(project_type, str) or not isinstance(complexity_level, str):
+            raise ModelDecodeError("Classification is missing project_type or complexity_level")
+        weeks = data.get("estimated_timeline_weeks")
+        if isinstance(weeks, str):
+            weeks = quantity(weeks, default=None)
+        if not isinstance(weeks, (int, float)) or isinstance(weeks, bool):
+            raise ModelDecodeError("Classification has no numeric estimated_timeline_weeks")
+        risks, priorities = data.get("risk_factors"), data.get("item_prioritization")
+        if not isinstance(risks, list) or not isinstance(priorities, list):
+            raise ModelDecodeError("Classification risk_factors / item_prioritization must be lists")
+        if not all(isinstance(item, dict) and item.get("item_name") for item in priorities):
+            raise ModelDecodeError("Every prioritized item needs an item_name")
+        return cls(
+            project_type, complexity_level, weeks, [_text(risk) for risk in risks],
+            [PriorityItem(_text(item["item_name"]), _text(item.get("priority")), _text(item.get("rationale")),
+                          _extra(item, PriorityItem.FIELDS)) for item in priorities],
+            _extra(data, cls.FIELDS),
+        )
+
+    def to_dict(self):
+        return _with_extra({
+            "project_type": self.project_type,
+            "complexity_level": self.complexity_level,
+            "estimated_timeline_weeks": self.estimated_timeline_weeks,
+            "risk_factors": list(self.risk_factors),
+            "item_prioritization": [item.to_dict() for item in self.item_prioritization],
+        }, self.extra)
+
+
+def decode_classification(text):
+    """
+    Model text -> Classification; raises ModelDecodeError on malformed output.
+    """
+    return Classification.from_dict(decode_json(text))
+
+
+def dump(value):
+    """
+    JSON-ready form of a pipeline output: models via to_dict(), anything else
+    (error payloads, None) unchanged.
+    """
+    to_dict = getattr(value, "to_dict", None)
+    return to_dict() if to_dict is not None else value
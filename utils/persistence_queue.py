@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import queue
+import atexit
+import random
+import threading
+
+from utils.metrics import metrics, stage_timer
+
+# Spool location: Vercel only allows writes under /tmp
+if os.getenv("VERCEL"):
+    DEFAULT_SPOOL_DIR = "/tmp"
+else:
+    DEFAULT_SPOOL_DIR = "temp"
+
+PERSIST_QUEUE_SIZE = int(os.getenv("PERSIST_QUEUE_SIZE", "1000"))
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "50"))
+# Longest a row waits for more rows to share its insert
+PERSIST_FLUSH_INTERVAL = float(os.getenv("PERSIST_FLUSH_INTERVAL", "1.0"))
+PERSIST_MAX_RETRIES = int(os.getenv("PERSIST_MAX_RETRIES", "3"))
+PERSIST_BACKOFF_BASE = float(os.getenv("PERSIST_BACKOFF_BASE", "0.5"))
+PERSIST_BACKOFF_MAX = float(os.getenv("PERSIST_BACKOFF_MAX", "10"))
+# Minimum gap between attempts to replay the spool file
+PERSIST_REPLAY_INTERVAL = float(os.getenv("PERSIST_REPLAY_INTERVAL", "30"))
+PERSIST_SPOOL_PATH = os.getenv("PERSIST_SPOOL_PATH", os.path.join(DEFAULT_SPOOL_DIR, "persist_spool.jsonl"))
+
+
+class SupabaseBackend:
+    """
+    Writes batches to the Supabase 'analyses' table with one bulk insert each.
+    """
+
+    @property
+    def available(self):
+        from utils.supabase_handler import supabase
+        return supabase is not None
+
+    def insert_many(self, rows):
+        from utils.supabase_handler import insert_analyses
+        insert_analyses(rows)
+
+
+class _Flush:
+    __slots__ = ("done",)
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+_STOP = object()
+
+
+class PersistenceQueue:
+    """
+    Write-behind persistence: callers enqueue rows and return immediately; one
+    worker thread coalesces them into bulk inserts of up to `batch_size` rows,
+    or whatever arrived within `flush_interval` seconds of the first one.
+
+    - Backpressure: enqueue() never blocks the request thread; when the queue
+      is full the row goes straight to the spool rather than being dropped.
+    - Retries: a failed insert is retried `max_retries` times with jittered
+      exponential backoff.
+    - Spool: batches that still fail are appended to an append-only JSONL file
+      and replayed (at most every `replay_interval` seconds) once inserts
+      succeed again, including after a restart.
+    - Shutdown: close() (registered with atexit for the shared queue) drains
+      the queue and writes or spools everything still pending.
+    """
+
+    def __init__(self, backend, max_queue=PERSIST_QUEUE_SIZE, batch_size=PERSIST_BATCH_SIZE,
+                 flush_interval=PERSIST_FLUSH_INTERVAL, max_retries=PERSIST_MAX_RETRIES,
+                 backoff_base=PERSIST_BACKOFF_BASE, backoff_max=PERSIST_BACKOFF_MAX, spool_path=PERSIST_SPOOL_PATH,
+                 replay_interval=PERSIST_REPLAY_INTERVAL, sleep=time.sleep):
+        self.backend = backend
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.spool_path = spool_path
+        self.replay_interval = replay_interval
+        self._sleep = sleep
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spool_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._worker = None
+        self._closed = False
+        self._last_replay = 0.0
+        self._listeners = []
+        self.stats = {"enqueued": 0, "written": 0, "batches": 0, "retries": 0,
+                      "failed_batches": 0, "spooled": 0, "replayed": 0}
+
+    # -- producer side -----------------------------------------------------
+
+    def enqueue(self, row):
+        """
+        Queues one row for writing. Returns True if queued, False if the queue
+        was full (or is closed) and the row was spooled instead.
+        """
+        if self._closed:
+            self._spool([row])
+            return False
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            print(f"⚠️ PERSIST: Queue full, spooling row to {self.spool_path}")
+            self._spool([row])
+            return False
+        self.stats["enqueued"] += 1
+        return True
+
+    def add_listener(self, callback):
+        """
+        Registers callback(rows), called on the worker thread after every
+        successful insert (e.g. to invalidate caches of the affected users).
+        """
+        self._listeners.append(callback)
+
+    def flush(self, timeout=None):
+        """
+        Blocks until everything queued before this call has been written or spooled.
+        """
+        if self._worker is None:
+            return True
+        marker = _Flush()
+        self._queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def close(self, timeout=30):
+        if self._closed:
+            return
+        self._closed = True
+        if self._worker is not None:
+            self._queue.put(_STOP)
+            self._worker.join(timeout)
+
+    # -- worker side -------------------------------------------------------
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="persistence-queue", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            if isinstance(item, _Flush):
+                self._maybe_replay(force=True)
+                item.done.set()
+                continue
+
+            batch = [item]
+            control = None
+            window_ends = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = window_ends - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    nxt = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if nxt is _STOP or isinstance(nxt, _Flush):
+                    control = nxt
+                    break
+                batch.append(nxt)
+
+            if self._write(batch):
+                self._maybe_replay()
+            else:
+                self._spool(batch)
+
+            if control is _STOP:
+                return
+            if control is not None:
+                self._maybe_replay(force=True)
+                control.done.set()
+
+    def _write(self, rows):
+        for attempt in range(self.max_retries + 1):
+            try:
+                with stage_timer("persist_write"):
+                    self.backend.insert_many(rows)
+                self.stats["written"] += len(rows)
+                self.stats["batches"] += 1
+                self._notify(rows)
+                return True
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"❌ PERSIST: Insert of {len(rows)} rows failed after {attempt + 1} attempts: {e}")
+                    break
+                self.stats["retries"] += 1
+                delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+                self._sleep(delay * random.uniform(0.5, 1.0))
+        self.stats["failed_batches"] += 1
+        return False
+
+    def _notify(self, rows):
+        for callback in self._listeners:
+            try:
+                callback(rows)
+            except Exception as e:
+                print(f"⚠️ PERSIST: Write listener failed: {e}")
+
+    # -- spool -------------------------------------------------------------
+
+    def _spool(self, rows, requeue=False):
+        with self._spool_lock:
+            os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+            with open(self.spool_path, "a") as f:
+                for row in rows:
+                    f.write(json.dumps(row, default=str) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            if not requeue:
+                self.stats["spooled"] += len(rows)
+
+    def spool_size(self):
+        try:
+            return os.path.getsize(self.spool_path)
+        except OSError:
+            return 0
+
+    def _maybe_replay(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_replay < self.replay_interval:
+            return
+        self._last_replay = now
+        replaying = self.spool_path + ".replay"
+        with self._spool_lock:
+            # A leftover .replay file means a previous replay was interrupted; finish it first
+            if not os.path.exists(replaying):
+                if not self.spool_size():
+                    return
+                os.replace(self.spool_path, replaying)
+
+        with open(replaying) as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+        replayed = 0
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            if not self._write(batch):
+                # Backend is still down: put the rest back and try again later
+                self._spool(rows[start:], requeue=True)
+                break
+            replayed += len(batch)
+        os.remove(replaying)
+        self.stats["replayed"] += replayed
+        if replayed:
+            print(f"♻️ PERSIST: Replayed {replayed} spooled rows")
+
+    def get_stats(self):
+        return {**self.stats, "queued": self._queue.qsize(), "spool_bytes": self.spool_size()}
+
+
+persistence_queue = PersistenceQueue(SupabaseBackend())
+atexit.register(persistence_queue.close)
+metrics.add_collector("persistence", persistence_queue.get_stats)
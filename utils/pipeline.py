@@ -0,0 +1,197 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from utils.metrics import observe_stage, record_fallback, STAGE_ERRORS
+
+PIPELINE_MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", "16"))
+
+# Shared by every pipeline run in the process; stages never submit to it themselves
+stage_executor = ThreadPoolExecutor(max_workers=PIPELINE_MAX_WORKERS, thread_name_prefix="pipeline")
+
+# Error policies
+FAIL = "fail"   # abort the run and raise PipelineError
+SKIP = "skip"   # record the error, use the stage default and keep going
+
+
+class StageError(Exception):
+    """
+    Raised by a stage to report a handled failure (e.g. the model returned nothing).
+    """
+
+
+class PipelineError(Exception):
+    def __init__(self, stage, error, result=None):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+        self.error = error
+        self.result = result
+
+
+class Stage:
+    """
+    One node of the pipeline graph.
+
+    `fn` receives a dict with the run inputs plus the outputs of every stage that
+    has finished so far, and returns this stage's output. Stages whose `deps` are
+    all done run concurrently. `background` stages are started when ready but the
+    run does not wait for them (used for persistence).
+    """
+
+    def __init__(self, name, fn, deps=(), timeout=None, on_error=FAIL, default=None, background=False):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.on_error = on_error
+        self.default = default
+        self.background = background
+
+
+class PipelineResult:
+    """
+    Outputs, stage timings and errors of one run. Background stages and
+    timed-out workers record their timings from other threads, so read
+    them through timings_snapshot().
+    """
+
+    def __init__(self):
+        self.outputs = {}
+        self.timings = {}
+        self.errors = {}
+        # Which graph produced the result (e.g. "fused" / "split"), for A/B comparisons
+        self.variant = None
+        # Which vision provider answered (e.g. "gemini" / "hf"), when the run records it
+        self.provider = None
+        self._timed_out = set()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        return self.outputs.get(name)
+
+    def record_timing(self, stage_name, ms):
+        # A stage that already timed out keeps its timeout as its timing
+        with self._lock:
+            if stage_name not in self._timed_out:
+                self.timings[stage_name] = ms
+
+    def record_timeout(self, stage_name, ms):
+        with self._lock:
+            self._timed_out.add(stage_name)
+            self.timings[stage_name] = ms
+
+    def timings_snapshot(self):
+        with self._lock:
+            return dict(self.timings)
+
+    def server_timing(self):
+        """
+        Stage timings formatted for the Server-Timing response header.
+        """
+        entries = [f"{name};dur={ms:.1f}" for name, ms in self.timings_snapshot().items()]
+        if self.variant:
+            entries.append(f'variant;desc="{self.variant}"')
+        if self.provider:
+            entries.append(f'provider;desc="{self.provider}"')
+        return ", ".join(entries)
+
+    def summary(self):
+        text = " | ".join(f"{name} {ms:.0f}ms" for name, ms in self.timings_snapshot().items())
+        tags = "/".join(tag for tag in (self.provider, self.variant) if tag)
+        return f"[{tags}] {text}" if tags else text
+
+
+class Pipeline:
+    def __init__(self, stages, executor=None):
+        self.stages = list(stages)
+        self.executor = executor or stage_executor
+
+        names = {stage.name for stage in self.stages}
+        for stage in self.stages:
+            missing = [dep for dep in stage.deps if dep not in names]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage(s): {missing}")
+
+    def _timed(self, stage, context, result):
+        start = time.perf_counter()
+        error = None
+        try:
+            return stage.fn(context)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            result.record_timing(stage.name, elapsed * 1000)
+            observe_stage(stage.name, elapsed, error)
+
+    def _run_background(self, stage, context, result):
+        def job():
+            try:
+                self._timed(stage, context, result)
+            except Exception as e:
+                print(f"❌ ERROR: Background stage '{stage.name}' failed: {e}")
+        self.executor.submit(job)
+
+    def run(self, inputs=None):
+        """
+        Runs every stage in dependency order, overlapping independent ones.
+        Raises PipelineError if a FAIL-policy stage errors or times out.
+        """
+        result = PipelineResult()
+        context = dict(inputs or {})
+        done = set()
+        pending = list(self.stages)
+        running = {}
+
+        def finish(stage, output=None, error=None):
+            if error is not None:
+                result.errors[stage.name] = str(error)
+                if stage.on_error == FAIL:
+                    raise PipelineError(stage.name, error, result)
+                print(f"⚠️ PIPELINE: Stage '{stage.name}' skipped: {error}")
+                record_fallback(f"{stage.name}_default")
+                output = stage.default
+            context[stage.name] = output
+            result.outputs[stage.name] = output
+            done.add(stage.name)
+
+        while pending or running:
+            for stage in [s for s in pending if all(dep in done for dep in s.deps)]:
+                pending.remove(stage)
+                snapshot = dict(context)
+                if stage.background:
+                    self._run_background(stage, snapshot, result)
+                    done.add(stage.name)
+                    continue
+                future = self.executor.submit(self._timed, stage, snapshot, result)
+                deadline = time.monotonic() + stage.timeout if stage.timeout else None
+                running[future] = (stage, deadline)
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Pipeline has a dependency cycle: {[s.name for s in pending]}")
+                break
+
+            deadlines = [d for _, d in running.values() if d is not None]
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            completed, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in completed:
+                stage, _ = running.pop(future)
+                error = future.exception()
+                finish(stage, None if error else future.result(), error)
+
+            now = time.monotonic()
+            for future, (stage, deadline) in list(running.items()):
+                if deadline is not None and now >= deadline:
+                    # The worker thread keeps going; its late result is simply ignored
+                    running.pop(future)
+                    future.cancel()
+                    result.record_timeout(stage.name, stage.timeout * 1000)
+                    # Its latency is still observed when the worker eventually returns
+                    STAGE_ERRORS.inc(stage=stage.name, error="TimeoutError")
+                    finish(stage, error=TimeoutError(f"timed out after {stage.timeout}s"))
+
+        return result
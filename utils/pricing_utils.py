@@ -1,108 +1,120 @@
 
-import json
+import time
+from utils.catalog_store import TIERS, as_catalog
+from utils.item_matcher import get_item_matcher
+from utils.metrics import STAGE_SECONDS
+from utils.models import Estimate, EstimateLine, as_vision_analysis
 
-def calculate_estimate(vision_json, catalog_prices):
+def calculate_estimate(vision_json, catalog_prices, region=None, city_tier=None):
     """
     Calculates the cost estimate based on the vision extracted JSON and catalog prices.
     
     Args:
-        vision_json (dict): The JSON output from the vision agent.
-        catalog_prices (dict): The catalog prices for items.
+        vision_json (VisionAnalysis | dict): The output from the vision agent.
+        catalog_prices (Catalog): The compiled catalog (a raw {key: {tier: price}} dict is also accepted).
+        region (str): Optional region from region_multiplier.json; national base prices if omitted.
+        city_tier (str): Optional city tier multiplier (e.g. "tier_1").
         
     Returns:
         dict: A dictionary containing itemized costs, subtotals, and totals for each tier.
     """
-    
-    estimates = {
-        "economy": {"items": [], "subtotal": 0, "labor": 0, "contingency": 0, "total": 0},
-        "standard": {"items": [], "subtotal": 0, "labor": 0, "contingency": 0, "total": 0},
-        "premium": {"items": [], "subtotal": 0, "labor": 0, "contingency": 0, "total": 0}
-    }
+    return price_analysis(vision_json, catalog_prices, region, city_tier).to_dict()
 
-    items = vision_json.get("items", [])
-    complexity_flags = vision_json.get("complexity_flags", {})
-    
-    # Calculate base item costs
-    for item in items:
+def price_analysis(vision_json, catalog_prices, region=None, city_tier=None):
+    """
+    Same as calculate_estimate, but returns the typed Estimate the pipeline passes around.
+    """
+    analysis = as_vision_analysis(vision_json)
+    running = RunningEstimate(catalog_prices, region, city_tier)
+
+    mapping_start = time.perf_counter()
+    for item in analysis.items:
+        running.add(item)
+    STAGE_SECONDS.observe(time.perf_counter() - mapping_start, stage="catalog_mapping")
+
+    return running.apply_overheads(analysis.complexity_flags)
+
+class RunningEstimate:
+    """
+    An Estimate built up one item at a time, so a streamed extraction can be
+    priced while the model is still writing it. price_analysis uses the same
+    steps, so the final figures are identical either way.
+    """
+    __slots__ = ("estimate", "catalog", "_tiers")
+
+    def __init__(self, catalog_prices, region=None, city_tier=None):
+        self.estimate = Estimate()
+        self.catalog = as_catalog(catalog_prices)
+        # Resolve the precomputed regional columns once (raises UnknownRegionError for bad names)
+        columns = self.catalog.columns_for(region, city_tier)
+        self._tiers = [(getattr(self.estimate, tier), columns[tier]) for tier in TIERS]
+
+    def add(self, item):
+        """
+        Prices one VisionItem in every tier. Returns the EstimateLine per tier.
+        """
         # Normalize item name to match catalog keys (simple mapping for demo)
         # In a real app, this would be more robust (fuzzy match or LLM mapping)
-        catalog_key = _map_item_to_catalog(item.get("name"))
-        quantity = item.get("quantity", 1)
+        catalog_key = _map_item_to_catalog(item.name)
+        quantity = item.quantity
         
-        if catalog_key and catalog_key in catalog_prices:
-            prices = catalog_prices[catalog_key]
-            
-            for tier in ["economy", "standard", "premium"]:
-                cost = prices.get(tier, 0) * quantity
-                estimates[tier]["items"].append({
-                    "name": item.get("name"),
-                    "quantity": quantity,
-                    "unit_price": prices.get(tier, 0),
-                    "cost": cost
-                })
-                estimates[tier]["subtotal"] += cost
-        else:
+        row = self.catalog.row(catalog_key) if catalog_key else None
+        if row is None:
              # Item not in catalog, maybe log or add a default placeholder?
              # For now, just adding with 0 cost but listing it
-             for tier in ["economy", "standard", "premium"]:
-                estimates[tier]["items"].append({
-                    "name": item.get("name") + " (Not in catalog)",
-                    "quantity": quantity,
-                    "unit_price": 0,
-                    "cost": 0
-                })
+             missing = EstimateLine(item.name + " (Not in catalog)", quantity, 0, 0)
+             for estimate, _column in self._tiers:
+                estimate.items.append(missing)
+             return [missing] * len(self._tiers)
 
-    # Calculate Labor & Contingency
-    # Labor: 10-25% based on complexity
-    labor_percent = 0.10
-    if complexity_flags.get("false_ceiling"): labor_percent += 0.05
-    if complexity_flags.get("built_in_storage"): labor_percent += 0.05
-    if complexity_flags.get("custom_carpentry"): labor_percent += 0.05
-    
-    # Cap at 25%
-    labor_percent = min(labor_percent, 0.25)
-    
-    # Contingency: 5-10% (Using 10% for safety)
-    contingency_percent = 0.10
-    
-    for tier in ["economy", "standard", "premium"]:
-        subtotal = estimates[tier]["subtotal"]
+        lines = []
+        for estimate, column in self._tiers:
+            unit_price = column[row]
+            cost = unit_price * quantity
+            line = EstimateLine(item.name, quantity, unit_price, cost)
+            estimate.items.append(line)
+            estimate.subtotal += cost
+            lines.append(line)
+        return lines
+
+    def apply_overheads(self, complexity_flags=None):
+        """
+        (Re)computes labor, contingency and totals from the current subtotals
+        and returns the Estimate. Mid-stream, before the complexity flags are
+        known, this gives the base labor rate.
+        """
+        # Calculate Labor & Contingency
+        # Labor: 10-25% based on complexity
+        complexity_flags = complexity_flags or {}
+        labor_percent = 0.10
+        if complexity_flags.get("false_ceiling"): labor_percent += 0.05
+        if complexity_flags.get("built_in_storage"): labor_percent += 0.05
+        if complexity_flags.get("custom_carpentry"): labor_percent += 0.05
+        
+        # Cap at 25%
+        labor_percent = min(labor_percent, 0.25)
         
-        labor_cost = int(subtotal * labor_percent)
-        contingency_cost = int(subtotal * contingency_percent)
+        # Contingency: 5-10% (Using 10% for safety)
+        contingency_percent = 0.10
         
-        estimates[tier]["labor"] = labor_cost
-        estimates[tier]["contingency"] = contingency_cost
-        estimates[tier]["total"] = subtotal + labor_cost + contingency_cost
-        estimates[tier]["labor_percent"] = labor_percent # Store for display
-        estimates[tier]["contingency_percent"] = contingency_percent
+        for estimate, _column in self._tiers:
+            subtotal = estimate.subtotal
+            
+            labor_cost = int(subtotal * labor_percent)
+            contingency_cost = int(subtotal * contingency_percent)
+            
+            estimate.labor = labor_cost
+            estimate.contingency = contingency_cost
+            estimate.total = subtotal + labor_cost + contingency_cost
+            estimate.labor_percent = labor_percent # Store for display
+            estimate.contingency_percent = contingency_percent
 
-    return estimates
+        return self.estimate
 
 def _map_item_to_catalog(item_name):
     """
-    Simple helper to map extracted names to catalog structure.
-    In a real app, use fuzzy matching or embedding search.
+    Maps an extracted item name to a catalog key using the rules in data/catalog_rules.json.
+    Returns None when no rule matches.
     """
-    item_name = item_name.lower()
-    
-    # Check for specific hardware first to avoid matching "door" in "door handle"
-    if "closer" in item_name: return "door_closer"
-    if "handle" in item_name or "pull" in item_name: return "hardware_set"
-    
-    # Room elements
-    if "sofa" in item_name: return "sofa_3_seater"
-    if "table" in item_name and "coffee" in item_name: return "coffee_table"
-    if "rug" in item_name or "carpet" in item_name: return "area_rug"
-    if "curtain" in item_name: return "curtains_set"
-    if "light" in item_name or "lamp" in item_name: return "ceiling_light"
-    if "floor" in item_name: return "flooring_sqft"
-    
-    # Commercial specific
-    if "door" in item_name: return "commercial_door"
-    if "panel" in item_name and ("wall" in item_name or "cladding" in item_name): return "wall_paneling_sqft"
-    if "ceiling" in item_name: return "acoustic_ceiling_sqft"
-    if "screen" in item_name and "projection" in item_name: return "projector_screen"
-    if "speaker" in item_name or "sensor" in item_name or "device" in item_name: return "sensor_device"
-    
-    return None
+    catalog_key, _score = get_item_matcher().match(item_name)
+    return catalog_key
@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+from utils.metrics import metrics
+
+# Cache location: Vercel only allows writes under /tmp
+if os.getenv("VERCEL"):
+    DEFAULT_CACHE_DIR = "/tmp"
+else:
+    DEFAULT_CACHE_DIR = "temp"
+
+CACHE_MEMORY_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "256"))
+CACHE_TTL_SECONDS = int(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MAX_ROWS = int(os.getenv("ANALYSIS_CACHE_MAX_ROWS", "5000"))
+CACHE_DB_PATH = os.getenv("ANALYSIS_CACHE_DB", os.path.join(DEFAULT_CACHE_DIR, "analysis_cache.sqlite3"))
+CLASSIFICATION_CACHE_SIZE = int(os.getenv("CLASSIFICATION_CACHE_SIZE", "512"))
+CLASSIFICATION_CACHE_DB_PATH = os.getenv("CLASSIFICATION_CACHE_DB",
+                                         os.path.join(DEFAULT_CACHE_DIR, "classification_cache.sqlite3"))
+
+
+def hash_bytes(data):
+    """
+    Returns the sha256 hex digest of raw bytes (used as the content address).
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def prompt_version(*prompts):
+    """
+    Short, stable fingerprint of the prompt text so that editing a prompt
+    automatically invalidates every cached result produced with the old one.
+    """
+    digest = hashlib.sha256()
+    for prompt in prompts:
+        digest.update(prompt.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()[:12]
+
+
+def make_key(image_hash, model_name, version):
+    return f"{image_hash}:{model_name}:{version}"
+
+
+class ResultCache:
+    """
+    Two-tier result cache: an in-process LRU in front of a SQLite file.
+
+    Values must be JSON serialisable. Both tiers hold the encoded JSON, so
+    every get() returns a fresh copy: a caller mutating its result cannot
+    change what the next caller gets. Entries in either tier expire `ttl`
+    seconds after they were written, and the table is trimmed to `max_rows`
+    (oldest access first) on write.
+    """
+
+    def __init__(self, db_path=CACHE_DB_PATH, memory_size=CACHE_MEMORY_SIZE,
+                 ttl=CACHE_TTL_SECONDS, max_rows=CACHE_MAX_ROWS, clock=time.time):
+        self.db_path = db_path
+        self.memory_size = memory_size
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.clock = clock
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._db_failed = False
+
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def _count(self, stat, amount=1):
+        with self._lock:
+            self.stats[stat] += amount
+
+    # --- Disk tier ---
+    def _connect(self):
+        if self._db is not None or self._db_failed or not self.db_path:
+            return self._db
+        try:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed ON results(accessed_at)")
+            db.commit()
+            self._db = db
+        except Exception as e:
+            # A read-only filesystem should only cost us the disk tier, not the request
+            print(f"⚠️ CACHE: Disk tier disabled ({e})")
+            self._db_failed = True
+        return self._db
+
+    def _disk_get(self, key):
+        """
+        Returns (created_at, encoded) for a live row, or None.
+        """
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return None
+            try:
+                row = db.execute("SELECT value, created_at FROM results WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                value, created_at = row
+                now = self.clock()
+                if now - created_at > self.ttl:
+                    db.execute("DELETE FROM results WHERE key = ?", (key,))
+                    db.commit()
+                    return None
+                db.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+                db.commit()
+                return created_at, value
+            except Exception as e:
+                print(f"⚠️ CACHE: Disk read failed: {e}")
+                return None
+
+    def _disk_set(self, key, created_at, encoded):
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, encoded, created_at, created_at)
+                )
+                db.execute("DELETE FROM results WHERE created_at < ?", (created_at - self.ttl,))
+                count = db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+                if count > self.max_rows:
+                    db.execute(
+                        "DELETE FROM results WHERE key IN ("
+                        " SELECT key FROM results ORDER BY accessed_at ASC LIMIT ?)",
+                        (count - self.max_rows,)
+                    )
+                    self._count("evictions", count - self.max_rows)
+                db.commit()
+            except Exception as e:
+                print(f"⚠️ CACHE: Disk write failed: {e}")
+
+    # --- Memory tier ---
+    def _memory_set(self, key, created_at, encoded):
+        with self._lock:
+            self._memory[key] = (created_at, encoded)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    # --- Public API ---
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and self.clock() - entry[0] > self.ttl:
+                del self._memory[key]
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+        if entry is not None:
+            return json.loads(entry[1])
+
+        entry = self._disk_get(key)
+        if entry is not None:
+            self._count("disk_hits")
+            # Keeps the row's original created_at, so promotion does not extend its life
+            self._memory_set(key, *entry)
+            return json.loads(entry[1])
+
+        self._count("misses")
+        return None
+
+    def set(self, key, value):
+        self._count("writes")
+        encoded = json.dumps(value)
+        created_at = self.clock()
+        self._memory_set(key, created_at, encoded)
+        self._disk_set(key, created_at, encoded)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        return {
+            **stats,
+            "hits": hits,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_capacity": self.memory_size,
+            "disk_enabled": self._db is not None,
+        }
+
+
+# Shared instance used by the vision agent
+analysis_cache = ResultCache()
+metrics.add_collector("analysis_cache", analysis_cache.get_stats)
+
+# Classifications keyed by the fingerprint of the compact analysis (utils/classifier.py)
+classification_cache = ResultCache(db_path=CLASSIFICATION_CACHE_DB_PATH, memory_size=CLASSIFICATION_CACHE_SIZE)
+metrics.add_collector("classification_cache", classification_cache.get_stats)
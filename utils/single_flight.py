@@ -0,0 +1,103 @@
+import os
+import copy
+import hashlib
+import threading
+
+from utils.metrics import metrics
+
+# Longest a follower waits for the leader's call before giving up on it
+SINGLE_FLIGHT_WAIT = float(os.getenv("SINGLE_FLIGHT_WAIT", "120"))
+
+
+class SingleFlightTimeout(TimeoutError):
+    pass
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: the first caller for a key runs the
+    function, anyone arriving with the same key while it is still running
+    waits and receives the same result (or exception). Nothing is remembered
+    once the call finishes; that is the result cache's job.
+
+    Followers get a deep copy so a caller mutating its result (e.g. filling in
+    image URLs) cannot affect the others. A follower gives up with
+    SingleFlightTimeout after `wait_timeout` seconds.
+
+    Keys must include everything that changes the outcome, including (a hash
+    of) the API key the call is made with.
+    """
+
+    def __init__(self, wait_timeout=SINGLE_FLIGHT_WAIT):
+        self.wait_timeout = wait_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {"leaders": 0, "shared": 0, "wait_timeouts": 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.stats["leaders"] += 1
+            else:
+                call.waiters += 1
+                self.stats["shared"] += 1
+
+        if not leader:
+            if not call.done.wait(self.wait_timeout):
+                with self._lock:
+                    self.stats["wait_timeouts"] += 1
+                raise SingleFlightTimeout(f"Shared call {key[0] if isinstance(key, tuple) else key} "
+                                          f"did not finish within {self.wait_timeout:g}s")
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        result = None
+        try:
+            result = fn()
+            return result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+                waiters = call.waiters
+            # Snapshot before the leader's caller gets a chance to mutate its copy
+            if waiters and call.error is None:
+                call.result = copy.deepcopy(result)
+            call.done.set()
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "in_flight": len(self._calls)}
+
+
+def fingerprint(*parts):
+    """
+    Stable key from strings / bytes-like parts (e.g. prompt text, image bytes, model name).
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, (bytes, bytearray, memoryview)) else str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+# Shared by every Gemini call site (vision, classification, specs, images)
+model_calls = SingleFlight()
+metrics.add_collector("single_flight", model_calls.get_stats)
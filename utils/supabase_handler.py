@@ -1,7 +1,9 @@
 
 import os
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 from dotenv import load_dotenv
+from utils.models import as_vision_analysis, dump
+from utils.http_pool import http_pool
 
 load_dotenv()
 
@@ -10,7 +12,45 @@ key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = None
 
 if url and key:
-    supabase = create_client(url, key)
+    # PostgREST, auth and storage all share the pooled keep-alive client (its timeouts replace the per-service ones)
+    supabase = create_client(url, key, options=ClientOptions(httpx_client=http_pool.client("supabase"),
+                                                             postgrest_client_timeout=None))
+
+def build_analysis_row(vision_data, cost_estimates=None, business_classification=None, user_id=None):
+    """
+    Shapes one analysis into a row of the 'analyses' table. Accepts the
+    pipeline's models or plain dicts.
+    """
+    analysis = as_vision_analysis(vision_data)
+    return {
+        "room_type": analysis.room_type or None,
+        "style_guess": analysis.style_guess or None,
+        "vision_data": dump(vision_data),
+        "cost_estimates": dump(cost_estimates),
+        "business_classification": dump(business_classification),
+        "user_id": user_id
+    }
+
+def insert_analyses(rows):
+    """
+    Bulk-inserts rows into 'analyses' in one request. Raises on failure so the
+    caller can retry; used by the persistence queue.
+    """
+    if not supabase:
+        raise RuntimeError("Supabase client not initialized. Check URL and Key.")
+    return supabase.table("analyses").insert(rows).execute()
+
+def upload_public_object(bucket, name, data, content_type):
+    """
+    Uploads bytes to a public Storage bucket under `name` and returns their
+    public URL. Callers use content-addressed names, so overwriting an
+    existing object (upsert) never changes what a URL points to.
+    """
+    if not supabase:
+        raise RuntimeError("Supabase client not initialized. Check URL and Key.")
+    storage = supabase.storage.from_(bucket)
+    storage.upload(name, data, {"content-type": content_type, "cache-control": "31536000", "upsert": "true"})
+    return storage.get_public_url(name)
 
 def save_analysis(vision_data, cost_estimates=None, business_classification=None, user_id=None):
     """
@@ -21,14 +61,7 @@ def save_analysis(vision_data, cost_estimates=None, business_classification=None
         return None
 
     try:
-        data = {
-            "room_type": vision_data.get("room_type"),
-            "style_guess": vision_data.get("style_guess"),
-            "vision_data": vision_data,
-            "cost_estimates": cost_estimates,
-            "business_classification": business_classification,
-            "user_id": user_id
-        }
+        data = build_analysis_row(vision_data, cost_estimates, business_classification, user_id)
         
         # Insert into 'analyses' table
         response = supabase.table("analyses").insert(data).execute()
@@ -38,16 +71,49 @@ def save_analysis(vision_data, cost_estimates=None, business_classification=None
         print(f"❌ ERROR: Failed to sync to Supabase: {e}")
         return None
 
-def get_user_history(user_id):
+# Listing projection: JSON paths pull just the tier totals out of cost_estimates
+# so the heavy vision/cost/classification blobs never leave the database.
+HISTORY_SUMMARY_COLUMNS = (
+    "id,created_at,room_type,style_guess,"
+    "economy_total:cost_estimates->economy->total,"
+    "standard_total:cost_estimates->standard->total,"
+    "premium_total:cost_estimates->premium->total"
+)
+
+def get_user_history_page(user_id, limit=20, before=None):
     """
-    Fetches the history of analyses for a specific user.
+    One page of a user's analyses, newest first, as summary rows.
+    `before` is the (created_at, id) of the last row of the previous page; the id
+    breaks ties between rows written in the same instant. Fetches limit + 1 rows
+    so the caller can tell whether another page exists.
     """
     if not supabase:
         return []
-    
+
+    query = supabase.table("analyses").select(HISTORY_SUMMARY_COLUMNS).eq("user_id", user_id)
+    if before:
+        created_at, row_id = before
+        query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{row_id})')
+    response = query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1).execute()
+    return response.data
+
+def get_analysis(user_id, analysis_id):
+    """
+    Full payload of one analysis, or None if it does not exist for this user.
+    """
+    if not supabase:
+        return None
+
+    response = supabase.table("analyses").select("*").eq("id", analysis_id).eq("user_id", user_id).limit(1).execute()
+    return response.data[0] if response.data else None
+
+def get_user_history(user_id, limit=20):
+    """
+    Fetches the most recent analyses for a specific user (summary columns only).
+    Use utils.history.get_history_page for pagination.
+    """
     try:
-        response = supabase.table("analyses").select("*").eq("user_id", user_id).order("created_at", desc=True).execute()
-        return response.data
+        return get_user_history_page(user_id, limit)[:limit]
     except Exception as e:
         print(f"❌ ERROR: Failed to fetch history: {e}")
         return []
@@ -0,0 +1,188 @@
+import os
+import time
+import secrets
+import tempfile
+import threading
+
+from utils.metrics import metrics
+
+# Uploads larger than this spill to an anonymous temp file instead of staying in memory
+UPLOAD_SPOOL_MB = float(os.getenv("UPLOAD_SPOOL_MB", "8"))
+# Idle sessions are dropped after this many seconds
+UPLOAD_SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL", "1800"))
+UPLOAD_SWEEP_INTERVAL = float(os.getenv("UPLOAD_SWEEP_INTERVAL", "60"))
+UPLOAD_SESSION_MAX = int(os.getenv("UPLOAD_SESSION_MAX", "500"))
+
+CHUNK_SIZE = 256 * 1024
+
+
+class UploadSession:
+    """
+    One uploaded image. Held as bytes while small; above the spool threshold it
+    lives in an anonymous temp file (no name, removed by the OS on close).
+    The spill file's offset is shared, so reads and close() take the session's lock.
+    """
+    __slots__ = ("id", "filename", "size", "created", "last_access", "_data", "_file", "_lock")
+
+    def __init__(self, session_id, filename, data=None, spill_file=None, size=0):
+        self.id = session_id
+        self.filename = filename
+        self.size = size
+        self.created = self.last_access = time.monotonic()
+        self._data = data
+        self._file = spill_file
+        self._lock = threading.Lock()
+
+    @property
+    def in_memory(self):
+        return self._file is None
+
+    def view(self):
+        """
+        The upload's bytes: a zero-copy memoryview when held in memory,
+        otherwise read back from the spill file.
+        """
+        with self._lock:
+            if self._file is None:
+                if self._data is None:
+                    raise ValueError(f"Upload session {self.id} is closed")
+                return memoryview(self._data)
+            self._file.seek(0)
+            return memoryview(self._file.read())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._data = None
+
+
+class UploadSessionStore:
+    """
+    Upload sessions keyed by unguessable random ids, so a follow-up request can
+    refer to an earlier upload without the server's file paths ever leaving it.
+
+    Sessions expire `ttl` seconds after their last use. A daemon thread sweeps
+    expired sessions every `sweep_interval` seconds; lookups also check expiry,
+    so a missed sweep never serves a stale session. Past `max_sessions` the
+    least recently used session is dropped.
+    """
+
+    def __init__(self, ttl=UPLOAD_SESSION_TTL, spool_bytes=int(UPLOAD_SPOOL_MB * 1024 * 1024),
+                 sweep_interval=UPLOAD_SWEEP_INTERVAL, max_sessions=UPLOAD_SESSION_MAX):
+        self.ttl = ttl
+        self.spool_bytes = spool_bytes
+        self.sweep_interval = sweep_interval
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self.stats = {"created": 0, "expired": 0, "evicted": 0, "spilled": 0}
+
+    def create(self, source, filename=None):
+        """
+        Stores an upload from bytes or a readable stream and returns its session id.
+        """
+        spill_file = None
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            data, size = bytes(source), len(source)
+            if size > self.spool_bytes:
+                spill_file = tempfile.TemporaryFile()
+                spill_file.write(data)
+                data = None
+        else:
+            chunks, size = [], 0
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if spill_file is None and size > self.spool_bytes:
+                    spill_file = tempfile.TemporaryFile()
+                    spill_file.writelines(chunks)
+                    chunks = None
+                if spill_file is not None:
+                    spill_file.write(chunk)
+                else:
+                    chunks.append(chunk)
+            data = b"".join(chunks) if spill_file is None else None
+
+        session = UploadSession(secrets.token_urlsafe(16), filename, data, spill_file, size)
+        with self._lock:
+            self._sessions[session.id] = session
+            self.stats["created"] += 1
+            self.stats["spilled"] += spill_file is not None
+            while len(self._sessions) > self.max_sessions:
+                oldest = min(self._sessions.values(), key=lambda s: s.last_access)
+                self._sessions.pop(oldest.id).close()
+                self.stats["evicted"] += 1
+        self._start_sweeper()
+        return session.id
+
+    def get(self, session_id):
+        """
+        Returns the live session (refreshing its TTL) or None if unknown or expired.
+        """
+        if not session_id:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if now - session.last_access > self.ttl:
+                self._sessions.pop(session_id).close()
+                self.stats["expired"] += 1
+                return None
+            session.last_access = now
+            return session
+
+    def delete(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+
+    def sweep(self):
+        """
+        Drops every expired session; returns how many were removed.
+        """
+        cutoff = time.monotonic() - self.ttl
+        with self._lock:
+            expired = [sid for sid, s in self._sessions.items() if s.last_access < cutoff]
+            for sid in expired:
+                self._sessions.pop(sid).close()
+            self.stats["expired"] += len(expired)
+        return len(expired)
+
+    def _start_sweeper(self):
+        if self._sweeper is not None or self.sweep_interval <= 0:
+            return
+        with self._lock:
+            if self._sweeper is not None:
+                return
+
+            def loop():
+                while True:
+                    time.sleep(self.sweep_interval)
+                    removed = self.sweep()
+                    if removed:
+                        print(f"🧹 UPLOADS: Swept {removed} expired upload sessions")
+
+            self._sweeper = threading.Thread(target=loop, name="upload-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def get_stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            return {
+                **self.stats,
+                "active": len(sessions),
+                "memory_bytes": sum(s.size for s in sessions if s.in_memory),
+                "spilled_bytes": sum(s.size for s in sessions if not s.in_memory),
+            }
+
+
+upload_sessions = UploadSessionStore()
+metrics.add_collector("upload_sessions", upload_sessions.get_stats)